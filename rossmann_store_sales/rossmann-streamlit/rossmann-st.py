@@ -1,16 +1,47 @@
 ##################### LIBRARIES #####################
 
-import requests
+import os
+import sys
 import pickle
 import json
-import time
+import requests
 import pandas                   as pd
 import streamlit                as st
 import plotly.graph_objects     as go
 
+##################### SETTINGS #####################
+
+# where predictions come from:
+#   'api'      -> rows of the chosen store are sent to the prediction API (ROSSMANN_API_URL)
+#   'local'    -> Rossmann pipeline and model run in this process (web app folder on ROSSMANN_WEB_APP_PATH,
+#                 web app requirements must be installed)
+#   'forecast' -> precomputed forecast store (see materialize_forecasts.py) on ROSSMANN_FORECAST_PATH
+PREDICTION_MODE = os.environ.get( 'ROSSMANN_PREDICTION_MODE', 'api' )
+
+# prediction API
+API_URL = os.environ.get( 'ROSSMANN_API_URL', 'https://rossmann-six-weeks-prediction.herokuapp.com/rossmann/predict' )
+
+# web app folder, with the rossmann package, model and parameters (local and forecast modes)
+WEB_APP_PATH = os.environ.get( 'ROSSMANN_WEB_APP_PATH', os.path.join( '..', 'web-app-rossmann-sales' ) )
+
+# forecast store folder (forecast mode)
+FORECAST_PATH = os.environ.get( 'ROSSMANN_FORECAST_PATH', os.path.join( WEB_APP_PATH, 'forecasts' ) )
+
 ##################### FUNCTIONS #####################
 
-@st.cache( allow_output_mutation = True, suppress_st_warning = True )
+def import_rossmann( ):
+    """
+    Make the rossmann package of the web app importable (local and forecast modes).
+    """
+
+    # web app folder on import path (once)
+    web_app_path = os.path.abspath( WEB_APP_PATH )
+    if web_app_path not in sys.path:
+        sys.path.insert( 0, web_app_path )
+
+    return web_app_path
+
+@st.cache_data
 def data_to_predict( ):
     """ 
     Load csv files with data to be sent to API for prediction.
@@ -30,8 +61,66 @@ def data_to_predict( ):
                             )
 
     return df_deployment
-    
-@st.cache( allow_output_mutation = True, suppress_st_warning = True )   
+
+@st.cache_data
+def store_data( store_number ):
+    """
+    Rows of the given store (only these rows are predicted).
+
+    Args:
+        store_number: store the user wants to see results
+
+    Return:
+        df_store: test.csv + store.csv rows of the store
+    """
+
+    # all rows (loaded once)
+    df_deployment = data_to_predict( )
+
+    return df_deployment[ df_deployment['Store'] == store_number ].reset_index( drop = True )
+
+@st.cache_resource
+def load_pipeline( ):
+    """
+    Load Rossmann pipeline and model once per process (local mode).
+
+    Return:
+        pipeline, ml_model
+    """
+
+    web_app_path = import_rossmann( )
+    from rossmann.Rossmann          import Rossmann
+    from rossmann.ArtifactRegistry  import ArtifactRegistry
+
+    # model bundle if it was built, pickles otherwise (as on web app handler)
+    artifacts = ArtifactRegistry( model_path = os.path.join( web_app_path, 'model', 'model_rossmann_sales.pkl' ),
+                                  parameter_path = os.path.join( web_app_path, 'parameter' ),
+                                  bundle_path = os.path.join( web_app_path, 'model', 'model_rossmann_sales.bundle' ) ).load()
+
+    return Rossmann( artifacts.parameters, plan = artifacts.plan ), artifacts.model
+
+@st.cache_resource
+def load_forecast( ):
+    """
+    Open forecast store once per process (forecast mode).
+    """
+
+    import_rossmann( )
+    from rossmann.ForecastStore import ForecastStore
+
+    return ForecastStore( FORECAST_PATH )
+
+@st.cache_resource
+def load_mae( ):
+    """
+    Load MAE of each store (from generalization performance) once per process.
+    """
+
+    with open('data/mae_dict.pkl', 'rb') as file:
+        mae_dict = pickle.load( file )
+
+    return mae_dict
+
 def make_request( data_for_prediction ):
     """
     Send a API request to get predictions for the given data
@@ -43,72 +132,110 @@ def make_request( data_for_prediction ):
         df_predicted: dataframe with predictions
     """   
     
-    # import necessary libraries
-    import requests
-    
     # convert Dataframe to json
     data = json.dumps( data_for_prediction.to_dict( orient = 'records' ) )
 
-    # API url
-    url = 'https://rossmann-six-weeks-prediction.herokuapp.com/rossmann/predict'
     # request header
     header = {'Content-type': 'application/json' } 
-    # data
-    data = data
 
     # make request
-    r = requests.post( url, data = data, headers = header )
+    r = requests.post( API_URL, data = data, headers = header )
 
     # print request status message
     print( f'Status Code {r.status_code}' )
     # transform api response to pandas dataframe
-    df_predicted = pd.DataFrame( r.json(), columns = r.json()[0].keys() )
+    df_predicted = pd.DataFrame( r.json(), columns = ['store', 'date', 'predicted_sales'] )
 
     
     return df_predicted
-    
-@st.cache( allow_output_mutation = True, suppress_st_warning = True )
-def get_date_filtered( dataframe ):
+
+def predict_store( store_number ):
     """
-    On API prediction, data is filtered so only open stores
-    are considered for prediction. Therefore, we need to 
-    filter 'Date' column to get prediction for every date.
-    
+    Daily sales predictions of the given store (see PREDICTION_MODE).
+
     Args:
-        dataframe: dataframe with date feature to be filtered on open stores
-    
+        store_number: store the user wants to see results
+
     Return:
-        date_series: series with filtered dates
+        df_predicted: dataframe with store, date and predicted_sales
+                      (0 sales when store is closed, no rows if store doesn't exist)
     """
 
-    # filter open stores
-    date_series = dataframe.loc[ (dataframe['Open'] == 1) , 'Date' ]
-    
-    # convert data series to date format, instead of string
-    #date_series = pd.to_datetime( date_series, format = '%Y-%m-%d' )
-    
+    # precomputed forecast (reopened if it was written or patched again since last run,
+    # so cached results of a former forecast are not used)
+    if PREDICTION_MODE == 'forecast':
+        meta = load_forecast( ).refresh( ).meta
 
-    return date_series
-    
-@st.cache( allow_output_mutation = True, suppress_st_warning = True )    
-def interactive_plot( data_predicted, store_number, filtered_dates, plot_scenarios ):
+        return forecast_store( store_number, ( meta.get( 'created_at' ), meta.get( 'updated_at' ) ) )
+
+
+    return score_store( store_number )
+
+@st.cache_data
+def forecast_store( store_number, version ):
+    """
+    Daily sales of the given store on the forecast store (forecast mode).
+
+    Args:
+        store_number: store the user wants to see results
+        version: creation and patch time of the forecast (part of cache key)
+
+    Return:
+        df_predicted: dataframe with store, date and predicted_sales
+    """
+
+    records = load_forecast( ).daily( store_number ) or []
+    df_predicted = pd.DataFrame( records, columns = ['date', 'predicted_sales'] )
+    df_predicted.insert( 0, 'store', store_number )
+
+    return df_predicted
+
+@st.cache_data
+def score_store( store_number ):
+    """
+    Daily sales predictions of the given store, from the pipeline in
+    this process (local mode) or the prediction API (api mode).
+
+    Args:
+        store_number: store the user wants to see results
+
+    Return:
+        df_predicted: dataframe with store, date and predicted_sales
+    """
+
+    # rows of the chosen store
+    df_store = store_data( store_number )
+    if df_store.empty:
+        return pd.DataFrame( columns = ['store', 'date', 'predicted_sales'] )
+
+    # in process prediction
+    if PREDICTION_MODE == 'local':
+        pipeline, ml_model = load_pipeline( )
+        df_predicted = pipeline.run_pipeline( ml_model, df_store.copy() )[ ['store', 'date', 'predicted_sales'] ]
+
+        # dates as sent by the API
+        df_predicted['date'] = df_predicted['date'].dt.strftime( '%Y-%m-%d' )
+
+        return df_predicted
+
+    # API request
+    return make_request( df_store )
+
+def interactive_plot( data_predicted, store_number, plot_scenarios ):
     """
     Plot a interactive line chart with predicted sales for the given store.
 
     Args:
-        data_predicted: data predicted by API request.
+        data_predicted: predictions of the given store (one row per date,
+                        0 sales when store is closed).
         store_number: given store number the user wants to see results.
-        filtered_dates: filtered dates according to get_date_filtered function.
     
     Return:
         None
     """
-    
-    # append date filtered
-    data_predicted['date'] = filtered_dates
 
     # get prediction for the given store
-    df_store_prediction = data_predicted[ data_predicted['store'] == store_number  ]
+    df_store_prediction = data_predicted[ data_predicted['store'] == store_number  ].copy()
 
     # check if the chosen store exists
     if df_store_prediction.shape[0] == 0:
@@ -116,12 +243,13 @@ def interactive_plot( data_predicted, store_number, filtered_dates, plot_scenari
     
     else:
         # load mae_dict
-        with open('data/mae_dict.pkl', 'rb') as file:
-            mae_dict = pickle.load( file )
+        mae_dict = load_mae( )
         
         # create column with best and worst scenarios with MAE value for the given store
-        df_store_prediction['Best Scenario'] = round( df_store_prediction['predicted_sales'] + mae_dict[store_number], 2 )
-        df_store_prediction['Worst Scenario'] = round( df_store_prediction['predicted_sales'] - mae_dict[store_number], 2 )       
+        # (no sales on any scenario when store is closed)
+        closed = df_store_prediction['predicted_sales'] == 0
+        df_store_prediction['Best Scenario'] = round( df_store_prediction['predicted_sales'] + mae_dict[store_number], 2 ).mask( closed, 0 )
+        df_store_prediction['Worst Scenario'] = round( df_store_prediction['predicted_sales'] - mae_dict[store_number], 2 ).mask( closed, 0 )
 
         # create figure for chart
         fig = go.Figure()
@@ -227,23 +355,11 @@ if plot_scenarios == []:
 
 # if user select at least one scenario
 else:
-    # create a progress bar
-    progress_bar = st.progress(0)
-    for percent_complete in range(100):
-        time.sleep(0.1)
-        progress_bar.progress( percent_complete + 1 )
-
-    # load data
-    df_data_loaded = data_to_predict( )
-        
-    # request predictions via API
-    df_data_predicted = make_request( df_data_loaded )
-        
-    # get filtered dates
-    dates_filtered = get_date_filtered( df_data_loaded )
+    # predictions of the chosen store only (cached for each store)
+    df_data_predicted = predict_store( store_number )
         
     # plot interactive line chart
-    fig = interactive_plot( df_data_predicted, store_number, dates_filtered, plot_scenarios )
+    fig = interactive_plot( df_data_predicted, store_number, plot_scenarios )
 
     # if chosen store doesn't exist
     if fig is None:
@@ -265,13 +381,6 @@ project_overview = st.checkbox(
 
 # check if user wants to see project overview
 if project_overview:      
-    # create a progress bar
-    progress_bar = st.progress(0)
-    
-    for percent_complete in range(100):
-        time.sleep(0.1)
-        progress_bar.progress( percent_complete + 1 )
-
     # # display project README.md
     # st.markdown( project_readme )
     st.markdown( """# **BUSINESS UNDERSTANDING**
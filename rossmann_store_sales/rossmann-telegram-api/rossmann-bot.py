@@ -2,71 +2,133 @@
 
 
 import os
-import requests
 import json
+import asyncio
+import aiohttp
 import pandas as pd
-from flask import Flask, request, Response
+from   aiohttp import web
 
 
 ############## FUNCTIONS ##############
 
 # send message to user
-def send_message( chat_id, text ):
+async def send_message( app, chat_id, text ):
     # construct url to sent text
-    url = f'https://api.telegram.org/bot{TOKEN}/' 
+    url = f"{app['telegram_url']}/bot{TOKEN}/"
     url = url + f'sendMessage?chat_id={chat_id}'
 
-    # send text to given url
-    r = requests.post( url, json = {'text': text } )
-    print( f'Status Code {r.status_code}' )
+    # send text to given url (pooled connection, bounded concurrency)
+    async with app['upstream_limit']:
+        async with app['session'].post( url, json = {'text': text } ) as r:
+            print( f'Status Code {r.status}' )
 
 
     return None
 
 
+ # test + store data, already split and serialized by store
+class StoreDataset:
+    def __init__( self, home_path = '' ):
+        self.test_path = os.path.join( home_path, 'test.csv' )
+        self.store_path = os.path.join( home_path, 'store.csv' )
+
+        # store id -> json payload
+        self.payloads = {}
+        self._signature = None
+
+        # load data
+        self.load()
+
+
+    def _file_signature( self ):
+        """modification time and size of csv files"""
+
+        return tuple( ( os.stat( path ).st_mtime_ns, os.stat( path ).st_size )
+                      for path in [ self.test_path, self.store_path ] )
+
+
+    def load( self ):
+        """load csv files and serialize each store data once"""
+
+        # get file signature before loading
+        signature = self._file_signature()
+
+        # loading test dataset
+        df_test = pd.read_csv( self.test_path )
+        df_store_supl = pd.read_csv( self.store_path )
+
+        # merge test dataset + store suplementary info
+        df_test = pd.merge( df_test, df_store_supl,
+                            how = 'left', on = 'Store' )
+
+        # convert data of each store to json
+        payloads = { int( store_id ): json.dumps( df_store.to_dict( orient = 'records' ) )
+                     for store_id, df_store in df_test.groupby( 'Store', sort = False ) }
+
+        # publish (a single attribute assignment is atomic)
+        self.payloads = payloads
+        self._signature = signature
+
+
+        return self
+
+
+    def reload_if_changed( self ):
+        """reload data if csv files changed on disk (blocking -> run on an executor, see refresh_dataset)"""
+
+        if self._file_signature() != self._signature:
+            self.load()
+
+
+        return self
+
+
  # load data to make prediction
 def load_dataset( store_id ):
-    # loading test dataset  
-    home_path = ''    
-    df_test = pd.read_csv( f'{home_path}test.csv' )
-    df_store_supl = pd.read_csv( f'{home_path}store.csv' )
-
-    # merge test dataset + store suplementary info
-    df_test = pd.merge( df_test, df_store_supl, 
-						how = 'left', on = 'Store' )
-
-    # choose store for prediction
-    df_test = df_test[ df_test['Store'] == store_id ]
-
-	# check if there is data to make prediction
-    if not df_test.empty:
-        
-		# convert Dataframe to json
-        data = json.dumps( df_test.to_dict( orient = 'records' ) )
-		
-		# there is no data to be predicted
-    else:
+    # get data already loaded (reloaded on background if csv files changed)
+    data = dataset.payloads.get( store_id )
+
+    # there is no data to be predicted
+    if data is None:
         data = 'error: there is no data for this store'
 
 
     return data
 
 
+ # prediction API answered something that is not a list of predictions
+class PredictionError( Exception ):
+    pass
+
+
  # API call
-def predict( data ):
+async def predict( app, data ):
     # API url for prediction
-    url = 'https://rossmann-six-weeks-prediction.herokuapp.com/rossmann/predict'
+    url = app['prediction_url']
     # request header
     header = {'Content-type': 'application/json' }
-    # data to be be predicted
-    data = data
 
-	# make post request to API -> get prediction for given data
-    r = requests.post( url, data = data, headers = header )
-    print( f'Status Code {r.status_code}' )
+    # make post request to API -> get prediction for given data
+    async with app['upstream_limit']:
+        async with app['session'].post( url, data = data, headers = header ) as r:
+            print( f'Status Code {r.status}' )
+
+            # API error (e.g. error body instead of predictions)
+            if r.status != 200:
+                raise PredictionError( f'prediction API answered {r.status}: {( await r.text() )[ :200 ]}' )
 
-	# construct dataframe for the prediction made
-    df_predicted = pd.DataFrame( r.json(), columns = r.json()[0].keys() )
+            try:
+                predictions = await r.json( content_type = None )
+            except ValueError as error:
+                raise PredictionError( f'prediction API answered invalid JSON ({error})' )
+
+    # predictions -> non empty list of records with store and predicted sales
+    if ( not isinstance( predictions, list ) ) or ( not predictions ) or \
+       ( not all( isinstance( record, dict ) and { 'store', 'predicted_sales' } <= record.keys() for record in predictions ) ):
+        raise PredictionError( f'prediction API answered unexpected data: {str( predictions )[ :200 ]}' )
+
+    # construct dataframe for the prediction made
+    df_predicted = pd.DataFrame( predictions, columns = predictions[0].keys() )
 
 
     return df_predicted
@@ -76,93 +138,196 @@ def predict( data ):
 def parse_message( message ):
     # get chat id from conversation
     chat_id = message['message']['chat']['id']
-    # get message the user sent 
+    # get message the user sent
     store_id = message['message']['text']
 
     # remove / on store id message
     store_id = store_id.replace( '/', '' )
 
-    try: 
-		# check if user send a number as store id
+    try:
+        # check if user send a number as store id
         store_id = int( store_id )
 
-    except ValueError: 
-		# if user doesn't sent a number as store id
+    except ValueError:
+        # if user doesn't sent a number as store id
         store_id = 'error'
 
 
     return chat_id, store_id
 
 
-############## API ##############
-
-
-# constants
-TOKEN = 'TOKEN'
-
-
-# create the app object
-app = Flask( __name__ )
-
-# create endpoint for request
-@app.route( '/', methods=['GET', 'POST'] )
-def index():
-    if request.method == 'POST':
-        # get message sent on request as json
-        message = request.get_json()
-
-        # extract chat_id and store_id from
-        # message sent to bot
-        chat_id, store_id = parse_message( message )
-
-		# if user sent a store id as a number
+ # answer a message (runs on background, after webhook was acknowledged)
+async def handle_message( app, chat_id, store_id ):
+    try:
+        # if user sent a store id as a number
         if store_id != 'error':
             # load data for the given store
             data = load_dataset( store_id )
 
             if data != 'error: there is no data for this store':
                 # get prediction for the given store via api request
-                df_predicted = predict( data )
+                df_predicted = await predict( app, data )
 
                 # calculation
                 sales = df_predicted[ df_predicted[ 'store' ] == store_id ]
 
                 # calculate sales prediction for each store in the last 6 weeks
-                stores_prediction = sales[ ['store', 
-                                            'predicted_sales'] ].groupby('store').sum().reset_index()               
+                stores_prediction = sales[ ['store',
+                                            'predicted_sales'] ].groupby('store').sum().reset_index()
 
                 # create message for user
                 msg = 'Store Number {} will sell U$ {:,.2f} in the next 6 weeks'.format(
                             int(stores_prediction['store'].values[0]),
-                            stores_prediction['predicted_sales'].values[0] ) 
+                            stores_prediction['predicted_sales'].values[0] )
 
                 # send message to user
-                send_message( chat_id, msg )
-
-                # response to API
-                return Response( 'Ok', status = 200 )
+                await send_message( app, chat_id, msg )
 
             else: # if there is no data for the given store
-                send_message( chat_id, 'Store ID is wrong. Try another id ;)' )
-
-                # response to API
-                # always send status, otherwise API will loop forever
-                return Response( 'Ok', status=200 )
+                await send_message( app, chat_id, 'Store ID is wrong. Try another id ;)' )
 
         else: # if user sent a store id as a number
             # send message to user
-            send_message( chat_id, 'Store ID is Wrong. Try another id ;)' )
+            await send_message( app, chat_id, 'Store ID is Wrong. Try another id ;)' )
+
+    # upstream (or anything else) failed -> log and tell the user
+    # (webhook was already acknowledged, so nobody else sees the error)
+    except Exception as error:
+        print( f'Error answering chat {chat_id}: {error!r}' )
+
+        try:
+            await send_message( app, chat_id, 'Sorry, prediction is not available right now. Try again later ;)' )
+        except ( aiohttp.ClientError, asyncio.TimeoutError ) as send_error:
+            print( f'Error answering chat {chat_id}: {send_error!r}' )
+
+
+    return None
+
+
+############## API ##############
+
+
+# constants
+TOKEN = os.environ.get( 'TELEGRAM_TOKEN', 'TOKEN' )
+
+# upstream urls (can point to local stub servers for testing)
+PREDICTION_URL = os.environ.get( 'PREDICTION_API_URL', 'https://rossmann-six-weeks-prediction.herokuapp.com/rossmann/predict' )
+TELEGRAM_URL = os.environ.get( 'TELEGRAM_API_URL', 'https://api.telegram.org' )
+
+# maximum number of concurrent upstream calls and their timeout (seconds)
+MAX_UPSTREAM_CALLS = int( os.environ.get( 'MAX_UPSTREAM_CALLS', 20 ) )
+UPSTREAM_TIMEOUT = float( os.environ.get( 'UPSTREAM_TIMEOUT', 30 ) )
+
+# test + store data, loaded once at startup
+dataset = StoreDataset( home_path = os.environ.get( 'DATA_PATH', '' ) )
+
+# seconds between checks for changed csv files
+RELOAD_INTERVAL = float( os.environ.get( 'DATA_RELOAD_INTERVAL', 60 ) )
+
+
+# endpoint for request
+async def index( request ):
+    app = request.app
+
+    if request.method == 'POST':
+        try:
+            # get message sent on request as json
+            message = await request.json()
+
+            # extract chat_id and store_id from
+            # message sent to bot
+            chat_id, store_id = parse_message( message )
+
+        # malformed body or update without a text message (e.g. edited
+        # messages, stickers) -> nothing to answer, update is ignored
+        except ( ValueError, KeyError, TypeError, AttributeError ) as error:
+            print( f'Ignoring update: {error!r}' )
+
+        else:
+            # answer message on background
+            task = asyncio.create_task( handle_message( app, chat_id, store_id ) )
+            app['tasks'].add( task )
+            task.add_done_callback( app['tasks'].discard )
+
+        # response to API right away
+        # always send status, otherwise API will loop forever
+        return web.Response( text = 'Ok', status = 200 )
+
+    else: # if request.method = GET
+
+        return web.Response( text = '<h1> Rossmann Telegram BOT </h1>', content_type = 'text/html' )
+
+
+ # create pooled http client when app starts
+async def start_session( app ):
+    # keep-alive connections, limited to the maximum of concurrent calls
+    connector = aiohttp.TCPConnector( limit = app['max_upstream_calls'], keepalive_timeout = 60 )
+    app['session'] = aiohttp.ClientSession( connector = connector,
+                                            timeout = aiohttp.ClientTimeout( total = app['upstream_timeout'] ) )
+    app['upstream_limit'] = asyncio.Semaphore( app['max_upstream_calls'] )
+
+
+ # reload data on background when csv files change
+async def refresh_dataset( app ):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep( app['reload_interval'] )
+
+        # read_csv, merge and json.dumps run on a thread, so the event loop
+        # keeps answering webhooks with the current payloads meanwhile
+        try:
+            await loop.run_in_executor( None, dataset.reload_if_changed )
+        except Exception as error:
+            print( f'Error reloading data: {error!r}' )
+
+
+ # start data refresh when app starts
+async def start_refresh( app ):
+    app['refresh'] = asyncio.create_task( refresh_dataset( app ) )
+
+
+ # finish background answers and close http client when app stops
+async def close_session( app ):
+    app['refresh'].cancel()
+    if app['tasks']:
+        await asyncio.gather( *app['tasks'], return_exceptions = True )
+    await app['session'].close()
+
+
+ # create the app object
+def create_app( prediction_url = PREDICTION_URL, telegram_url = TELEGRAM_URL,
+                max_upstream_calls = MAX_UPSTREAM_CALLS, upstream_timeout = UPSTREAM_TIMEOUT,
+                reload_interval = RELOAD_INTERVAL ):
+    app = web.Application()
+
+    # upstream settings
+    app['prediction_url'] = prediction_url
+    app['telegram_url'] = telegram_url
+    app['max_upstream_calls'] = max_upstream_calls
+    app['upstream_timeout'] = upstream_timeout
+
+    # background answers
+    app['tasks'] = set()
+
+    # data refresh
+    app['reload_interval'] = reload_interval
+
+    # http client lifecycle (and data refresh)
+    app.on_startup.append( start_session )
+    app.on_startup.append( start_refresh )
+    app.on_cleanup.append( close_session )
 
-            # response to API
-            return Response( 'Ok', status=200 )
+    # create endpoint for request
+    app.router.add_route( 'GET', '/', index )
+    app.router.add_route( 'POST', '/', index )
 
-    else: # if request.method = GET               
 
-        return '<h1> Rossmann Telegram BOT </h1>'
+    return app
 
 
-# when this script is run, run flask
+# when this script is run, run bot server
 if __name__ == '__main__':
     # set port number
-    port = os.environ.get( 'PORT', 5000 )
-    app.run( host = '0.0.0.0', port = port, debug = True )
\ No newline at end of file
+    port = int( os.environ.get( 'PORT', 5000 ) )
+    web.run_app( create_app(), host = '0.0.0.0', port = port )
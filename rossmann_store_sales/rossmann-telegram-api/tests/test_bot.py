@@ -0,0 +1,114 @@
+############## LIBRARIES ##############
+
+
+import os
+import time
+import asyncio
+import importlib.util
+from   aiohttp                     import web
+from   aiohttp.test_utils          import TestServer, TestClient
+
+
+############## SETUP ##############
+
+
+# bot folder (rossmann-bot.py, test.csv and store.csv)
+BOT_PATH = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+# load bot module (its file name is not a module name), with its own data
+os.environ.setdefault( 'DATA_PATH', BOT_PATH )
+spec = importlib.util.spec_from_file_location( 'rossmann_bot', os.path.join( BOT_PATH, 'rossmann-bot.py' ) )
+bot = importlib.util.module_from_spec( spec )
+spec.loader.exec_module( bot )
+
+# seconds the stub prediction API takes to answer
+PREDICTION_DELAY = 0.5
+
+
+def run_with_stubs( scenario ):
+    """
+    Run a scenario against the bot, with stub prediction and Telegram servers.
+
+    Args:
+        scenario: coroutine function called with ( bot client, list of texts sent to Telegram )
+    """
+
+    sent = []
+
+    # prediction API -> slow answer, 100 sales for each row
+    async def predict( request ):
+        records = await request.json()
+        await asyncio.sleep( PREDICTION_DELAY )
+        return web.json_response( [ {'store': record['Store'], 'predicted_sales': 100.0} for record in records ] )
+
+    # Telegram API -> keep texts sent to users
+    async def send_message( request ):
+        sent.append( ( await request.json() )['text'] )
+        return web.json_response( {'ok': True} )
+
+    async def main():
+        prediction_app = web.Application()
+        prediction_app.router.add_post( '/rossmann/predict', predict )
+        telegram_app = web.Application()
+        telegram_app.router.add_post( '/{path:.*}', send_message )
+
+        async with TestServer( prediction_app ) as prediction_server, TestServer( telegram_app ) as telegram_server:
+            app = bot.create_app( prediction_url = str( prediction_server.make_url( '/rossmann/predict' ) ),
+                                  telegram_url = str( telegram_server.make_url( '' ) ).rstrip( '/' ) )
+            async with TestClient( TestServer( app ) ) as client:
+                await scenario( client, sent )
+
+    asyncio.run( main() )
+
+
+async def wait_for( condition, timeout = 10 ):
+    """wait (without blocking the event loop) until condition() is true"""
+
+    deadline = time.monotonic() + timeout
+    while not condition() and ( time.monotonic() < deadline ):
+        await asyncio.sleep( 0.05 )
+
+
+############## TESTS ##############
+
+
+def test_burst_of_webhooks_is_acknowledged_before_predictions():
+
+    async def scenario( client, sent ):
+        stores = [ 1, 3, 7, 8, 9, 10, 11, 12, 13, 14 ]
+
+        async def webhook( store_id ):
+            start = time.perf_counter()
+            response = await client.post( '/', json = {'message': {'chat': {'id': store_id}, 'text': f'/{store_id}'}} )
+            return response.status, time.perf_counter() - start
+
+        # every webhook is answered before the prediction API answers
+        acknowledged = await asyncio.gather( *[ webhook( store_id ) for store_id in stores ] )
+        assert all( status == 200 for status, _ in acknowledged )
+        assert max( seconds for _, seconds in acknowledged ) < PREDICTION_DELAY
+
+        # replies are sent on background
+        await wait_for( lambda: len( sent ) == len( stores ) )
+        assert sorted( sent ) == sorted( f'Store Number {store_id} will sell U$ {100 * 48:,.2f} in the next 6 weeks' for store_id in stores )
+
+    run_with_stubs( scenario )
+
+
+def test_unparsable_updates_are_acknowledged_and_ignored():
+
+    async def scenario( client, sent ):
+        updates = [ {'data': 'not json', 'headers': {'Content-Type': 'application/json'}},
+                    {'json': {'update_id': 1, 'edited_message': {'chat': {'id': 1}, 'text': '/1'}}},
+                    {'json': {'message': {'chat': {'id': 1}, 'sticker': {}}}},
+                    {'json': {'message': {'chat': {'id': 1}, 'text': 1}}},
+                    {'json': [ 1, 2 ]} ]
+
+        for update in updates:
+            response = await client.post( '/', **update )
+            assert response.status == 200
+
+        # nothing to answer
+        await asyncio.sleep( 0.2 )
+        assert sent == []
+
+    run_with_stubs( scenario )
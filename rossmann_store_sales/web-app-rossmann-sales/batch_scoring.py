@@ -0,0 +1,210 @@
+############## LIBRARIES ##############
+
+
+import argparse
+import os
+import time
+import numpy                       as np
+import pandas                      as pd
+from   concurrent.futures          import ProcessPoolExecutor
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.InferenceEngine    import split_thresholds
+from   rossmann.Serialization      import import_pyarrow
+
+
+############## FUNCTIONS ##############
+
+
+# artifacts of each worker process (loaded once by init_worker)
+worker_artifacts = None
+
+# split thresholds of the model (compact mode, read once by init_worker)
+worker_thresholds = None
+
+# store data of each worker process (read once by init_worker)
+worker_store = None
+
+
+def read_data( path ):
+    """read csv or parquet file (according to its extension) as a dataframe"""
+
+    # parquet file (or folder)
+    if path.endswith( '.parquet' ) or os.path.isdir( path ):
+        return pd.read_parquet( path )
+
+
+    return pd.read_csv( path, low_memory = False )
+
+
+def count_rows( path ):
+    """number of rows of a csv or parquet file (without reading its data)"""
+
+    # parquet -> row count is on file metadata
+    if path.endswith( '.parquet' ):
+        pa, pq = import_pyarrow()
+        return pq.ParquetFile( path ).metadata.num_rows
+
+    # csv -> lines without header
+    with open( path, 'rb' ) as file:
+        n_lines = sum( 1 for _ in file )
+
+
+    return max( n_lines - 1, 0 )
+
+
+def plan_partitions( path, n_partitions ):
+    """
+    Partitions of test data, read by each worker on its own (rows are
+    not sent to workers): every file of a parquet folder or row ranges
+    of a single csv or parquet file. Rows of the same stores are scored
+    faster together, so test data sorted (or partitioned) by store is
+    scored faster than test data in date order (e.g. test.csv).
+
+    Args:
+        path: test data (csv or parquet file, or folder of parquet files)
+        n_partitions: number of row ranges of a single file
+
+    Return:
+        partitions: list of ( path, start, stop ) (start and stop None -> whole file)
+    """
+
+    # parquet folder -> one partition for each file
+    if os.path.isdir( path ):
+        return [ ( os.path.join( path, name ), None, None ) for name in sorted( os.listdir( path ) ) if name.endswith( '.parquet' ) ]
+
+    # single file -> row ranges of (about) the same size
+    bounds = np.linspace( 0, count_rows( path ), n_partitions + 1 ).astype( 'int64' )
+
+
+    return [ ( path, int( start ), int( stop ) ) for start, stop in zip( bounds[ :-1 ], bounds[ 1: ] ) if stop > start ]
+
+
+def read_rows( path, start = None, stop = None ):
+    """
+    Read a partition of test data (see plan_partitions).
+
+    Args:
+        path: csv or parquet file
+        start, stop: row range (None -> whole file)
+
+    Return:
+        df_rows: dataframe with the rows of the range
+    """
+
+    # whole file
+    if start is None:
+        return read_data( path )
+
+    # parquet -> memory mapped file, only rows of the range are converted
+    if path.endswith( '.parquet' ):
+        pa, pq = import_pyarrow()
+        return pq.read_table( path, memory_map = True ).slice( start, stop - start ).to_pandas()
+
+    # csv -> lines of the range (header is read on its own)
+    columns = pd.read_csv( path, nrows = 0 ).columns
+
+
+    return pd.read_csv( path, skiprows = start + 1, nrows = stop - start, header = None, names = columns, low_memory = False )
+
+
+def init_worker( model_path, parameter_path, bundle_path, store_path, compact = False ):
+    """load model and compiled plan (from the memory mapped model bundle, if it
+    was built from current pickles) and store data once for each worker process
+    (and split thresholds of the model, on compact mode)"""
+
+    global worker_artifacts, worker_thresholds, worker_store
+
+    # load artifacts
+    worker_artifacts = ArtifactRegistry( model_path = model_path, parameter_path = parameter_path, bundle_path = bundle_path ).load()
+
+    # thresholds used to round float32 features
+    worker_thresholds = split_thresholds( worker_artifacts.model, COLS_SELECTED ) if compact else None
+
+    # store suplementary info (merged with each partition)
+    worker_store = read_data( store_path )
+
+
+def score_partition( partition_id, partition, output_path ):
+    """
+    Read a partition of test rows, score it and write its predictions as a parquet partition.
+
+    Args:
+        partition_id: partition number (used on partition file name)
+        partition: ( path, start, stop ) of test rows (see plan_partitions)
+        output_path: folder for parquet partitions
+
+    Return:
+        n_rows, n_predicted: number of rows read and with a prediction (0 for closed stores)
+    """
+
+    # read test rows and merge store suplementary info
+    df_chunk = pd.merge( read_rows( *partition ), worker_store, how = 'left', on = 'Store' )
+
+    # sort by store -> rows of a store are predicted (and written) together
+    df_chunk = df_chunk.sort_values( ['Store', 'Date'], kind = 'stable' ).reset_index( drop = True )
+
+    # clean, engineer, filter, prepare data and make prediction
+    # (one LightGBM thread per process -> processes don't compete for cores)
+    pipeline = Rossmann( worker_artifacts.parameters, num_threads = 1, plan = worker_artifacts.plan,
+                         compact = worker_thresholds is not None, thresholds = worker_thresholds )
+    df_predicted = pipeline.run_pipeline( worker_artifacts.model, df_chunk )
+
+    # output columns (every row, closed stores with 0 sales)
+    df_output = df_predicted[ [ column for column in ['id', 'date', 'store', 'predicted_sales'] if column in df_predicted.columns ] ]
+
+    # write partition
+    pa, pq = import_pyarrow()
+    pq.write_table( pa.Table.from_pandas( df_output, preserve_index = False ),
+                    os.path.join( output_path, f'part-{partition_id:05d}.parquet' ) )
+
+
+    return df_chunk.shape[0], int( df_output['predicted_sales'].notna().sum() )
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Score test data for every store, without the API' )
+    parser.add_argument( '--test', default = '../data/test.csv', help = 'test data (csv or parquet file, or folder of parquet files)' )
+    parser.add_argument( '--store', default = '../data/store.csv', help = 'store data (csv or parquet)' )
+    parser.add_argument( '--output', default = './predictions', help = 'folder for parquet partitions' )
+    parser.add_argument( '--model', default = './model/model_rossmann_sales.pkl', help = 'pickled model' )
+    parser.add_argument( '--parameter', default = './parameter', help = 'folder with inputters and scalers' )
+    parser.add_argument( '--bundle', default = './model/model_rossmann_sales.bundle', help = 'model bundle (loaded instead of pickles if it was built from them)' )
+    parser.add_argument( '--workers', type = int, default = os.cpu_count(), help = 'number of processes' )
+    parser.add_argument( '--chunk-size', type = int, default = 50000, help = 'maximum rows of each partition of a single file' )
+    parser.add_argument( '--compact', action = 'store_true', help = 'memory-lean pipeline (smallest dtypes, float32 features)' )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    # partitions of test data (at least one per worker), read by the workers
+    # themselves -> no rows are read by this process or sent to workers
+    n_rows = count_rows( args.test ) if not os.path.isdir( args.test ) else 0
+    partitions = plan_partitions( args.test, max( args.workers, int( np.ceil( n_rows / args.chunk_size ) ) ) )
+
+    # create output folder
+    os.makedirs( args.output, exist_ok = True )
+    plan_time = time.perf_counter() - start
+
+    # score partitions in parallel
+    with ProcessPoolExecutor( max_workers = args.workers,
+                              initializer = init_worker,
+                              initargs = ( args.model, args.parameter, args.bundle, args.store, args.compact ) ) as executor:
+        futures = [ executor.submit( score_partition, partition_id, partition, args.output ) for partition_id, partition in enumerate( partitions ) ]
+        results = [ future.result() for future in futures ]
+
+    # report
+    total_time = time.perf_counter() - start
+    n_rows = sum( rows for rows, _ in results )
+    n_predicted = sum( predicted for _, predicted in results )
+    print( f'{n_rows} rows read, {n_predicted} predicted (closed stores -> 0) on {len( partitions )} partitions' )
+    print( f'plan {plan_time:.2f} s, total {total_time:.2f} s -> {n_rows / total_time:,.0f} rows/s with {args.workers} workers' )
+
+
+    return None
+
+
+# when batch_scoring.py script is run, score data
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+############## LIBRARIES ##############
+
+
+import argparse
+import time
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Rossmann           import Rossmann
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.InferenceEngine    import make_engine, ENGINES
+from   batch_scoring               import read_data
+
+
+############## FUNCTIONS ##############
+
+
+def single_row_latency( pipeline, engine, df_test, n_requests ):
+    """
+    Latency of single row requests (whole pipeline, as on /rossmann/predict).
+
+    Return:
+        latencies: array with the seconds of each request
+    """
+
+    # open store rows (closed ones are filtered before prediction)
+    rows = df_test[ df_test['Open'] == 1 ].sample( n_requests, replace = True, random_state = 0 )
+
+    latencies = np.empty( n_requests )
+    for number in range( n_requests ):
+        df_row = rows.iloc[ [ number ] ]
+        start = time.perf_counter()
+        pipeline.run_pipeline( engine, df_row )
+        latencies[ number ] = time.perf_counter() - start
+
+
+    return latencies
+
+
+def bulk_throughput( engine, prepared_data, n_repeats, num_threads ):
+    """
+    Predicted rows per second on prepared data (prediction only).
+
+    Return:
+        prediction, rows_per_second
+    """
+
+    # best of n_repeats
+    timings = []
+    for _ in range( n_repeats ):
+        start = time.perf_counter()
+        prediction = engine.predict( prepared_data, num_threads = num_threads )
+        timings.append( time.perf_counter() - start )
+
+
+    return prediction, prepared_data.shape[0] / min( timings )
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Compare predictions and speed of inference engines' )
+    parser.add_argument( '--test', default = '../data/test.csv', help = 'test data (csv or parquet)' )
+    parser.add_argument( '--store', default = '../data/store.csv', help = 'store data (csv or parquet)' )
+    parser.add_argument( '--engines', default = ','.join( ENGINES ), help = 'comma separated engine names' )
+    parser.add_argument( '--threads', type = int, default = None, help = 'LightGBM threads (default: one per core)' )
+    parser.add_argument( '--requests', type = int, default = 1000, help = 'number of single row requests' )
+    parser.add_argument( '--repeats', type = int, default = 5, help = 'number of bulk predictions (best one is kept)' )
+    args = parser.parse_args()
+
+    # load artifacts and data
+    artifacts = ArtifactRegistry().load()
+    df_test = pd.merge( read_data( args.test ), read_data( args.store ), how = 'left', on = 'Store' )
+
+    # prepare every row once (bulk prediction input)
+    pipeline = Rossmann( artifacts.parameters, num_threads = args.threads )
+    prepared_data = pipeline.data_preparation( pipeline.data_filtering( pipeline.feature_engineering( pipeline.data_cleaning( df_test.copy() ) ) ) )
+
+    # reference predictions
+    reference = artifacts.model.predict( prepared_data )
+
+    print( f"{'engine':<10}{'equal':>7}{'max diff':>11}{'p50 ms':>9}{'p99 ms':>9}{'bulk rows/s':>14}" )
+    for name in args.engines.split( ',' ):
+        # compiled predictor threads are set when it is created
+        options = {'num_threads': args.threads} if name == 'compiled' else {}
+        engine = make_engine( artifacts.model, name, **options )
+
+        # bulk predictions and their difference to sklearn predictions
+        prediction, rows_per_second = bulk_throughput( engine, prepared_data, args.repeats, args.threads )
+        max_diff = np.abs( prediction - reference ).max()
+
+        # single row requests
+        latencies = single_row_latency( pipeline, engine, df_test, args.requests ) * 1000
+
+        print( f"{name:<10}{str( np.array_equal( prediction, reference ) ):>7}{max_diff:>11.2e}"
+               f"{np.percentile( latencies, 50 ):>9.2f}{np.percentile( latencies, 99 ):>9.2f}{rows_per_second:>14,.0f}" )
+
+
+    return None
+
+
+# when benchmark_engines.py script is run, compare engines
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+############## LIBRARIES ##############
+
+
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.InferenceEngine    import make_engine, split_thresholds, ENGINES
+from   rossmann.ResponseBuilder    import parse_fields, select_fields, records_json
+from   batch_scoring               import read_data
+
+
+############## FUNCTIONS ##############
+
+
+# pipeline steps, in the order they are run (see Rossmann.run_pipeline),
+# and the response built from their output (as on /rossmann/predict)
+STAGES = [ 'data_cleaning',
+           'feature_engineering',
+           'data_filtering',
+           'data_preparation',
+           'make_prediction',
+           'restore_rows',
+           'response' ]
+
+
+def make_rows( df_data, n_rows, seed = 0 ):
+    """
+    Request rows sampled from test data (synthetic rows, sampled with
+    replacement, when more rows than test data are asked).
+
+    Args:
+        df_data: test.csv + store.csv rows
+        n_rows: number of rows
+        seed: random seed of the sample
+
+    Return:
+        df_rows: dataframe with n_rows rows and unique Ids
+    """
+
+    df_rows = df_data.sample( n_rows, replace = n_rows > df_data.shape[0], random_state = seed ).reset_index( drop = True )
+    df_rows['Id'] = np.arange( 1, n_rows + 1 )
+
+
+    return df_rows
+
+
+def run_stages( pipeline, ml_model, df_raw, clock ):
+    """
+    Run every pipeline step on its own.
+
+    Args:
+        pipeline: Rossmann instance
+        ml_model: model (or inference engine)
+        df_raw: request rows (changed by data cleaning)
+        clock: function called after each stage with its name
+
+    Return:
+        body: JSON response
+    """
+
+    clock( None )
+
+    df_dc_done = pipeline.data_cleaning( df_raw )
+    df_identity = pipeline.row_identity( df_dc_done )
+    clock( 'data_cleaning' )
+
+    df_fe_done = pipeline.feature_engineering( df_dc_done )
+    clock( 'feature_engineering' )
+
+    df_df_done = pipeline.data_filtering( df_fe_done )
+    clock( 'data_filtering' )
+
+    df_dp_done = pipeline.data_preparation( df_df_done )
+    clock( 'data_preparation' )
+
+    df_predicted = pipeline.make_prediction( ml_model, df_dp_done )
+    clock( 'make_prediction' )
+
+    df_predicted = pipeline.restore_rows( df_predicted, df_identity )
+    clock( 'restore_rows' )
+
+    body = records_json( select_fields( df_predicted, parse_fields( None, has_id = True ) ) )
+    clock( 'response' )
+
+
+    return body
+
+
+def time_stages( pipeline, ml_model, df_rows, n_repeats ):
+    """
+    Seconds of each stage (best of n_repeats runs, without memory tracing).
+
+    Return:
+        seconds: dictionary stage -> seconds
+    """
+
+    best = { stage: np.inf for stage in STAGES }
+
+    for _ in range( n_repeats ):
+        df_raw = df_rows.copy()
+        marks = []
+        run_stages( pipeline, ml_model, df_raw, lambda stage: marks.append( ( stage, time.perf_counter() ) ) )
+
+        for ( _, begin ), ( stage, end ) in zip( marks, marks[1:] ):
+            best[ stage ] = min( best[ stage ], end - begin )
+
+
+    return best
+
+
+def trace_stages( pipeline, ml_model, df_rows ):
+    """
+    Peak of memory allocated on each stage (one run, with tracemalloc).
+
+    Return:
+        peaks: dictionary stage -> peak MB above memory in use when stage started
+        working_set: peak MB of the whole run, request rows included
+    """
+
+    peaks = {}
+    state = {'working_set': 0}
+
+    def clock( stage ):
+        current, peak = tracemalloc.get_traced_memory()
+        if stage is not None:
+            peaks[ stage ] = ( peak - state['start'] ) / 1e6
+        state['working_set'] = max( state['working_set'], peak / 1e6 )
+        tracemalloc.reset_peak()
+        state['start'] = current
+
+    tracemalloc.start()
+    try:
+        df_raw = df_rows.copy()
+        run_stages( pipeline, ml_model, df_raw, clock )
+    finally:
+        tracemalloc.stop()
+
+
+    return peaks, state['working_set']
+
+
+def prediction_difference( pipeline, reference, ml_model, df_rows ):
+    """
+    Difference between predictions of a pipeline and of a reference
+    pipeline (e.g. compact and float64 modes) on the same rows.
+
+    Return:
+        difference: dictionary with share of rows whose prediction changed,
+                    largest absolute and relative (to reference) difference
+    """
+
+    predicted = pipeline.run_pipeline( ml_model, df_rows.copy() )['predicted_sales'].values
+    expected = reference.run_pipeline( ml_model, df_rows.copy() )['predicted_sales'].values
+
+    # rows with a prediction (open stores)
+    kept = ~np.isnan( expected )
+    error = np.abs( predicted[ kept ] - expected[ kept ] )
+    if np.isnan( predicted[ kept ] ).any() or not np.isnan( predicted[ ~kept ] ).all():
+        raise RuntimeError( 'pipelines predicted different rows' )
+
+    difference = {'changed_rows': float( ( error > 0 ).mean() ) if error.size else 0.0,
+                  'max_abs_error': float( error.max() ) if error.size else 0.0,
+                  'max_rel_error': float( ( error / np.maximum( np.abs( expected[ kept ] ), 1.0 ) ).max() ) if error.size else 0.0
+                 }
+
+
+    return difference
+
+
+def time_endpoint( df_rows, n_repeats ):
+    """
+    Seconds of a /rossmann/predict request (best of n_repeats), made with
+    Flask test client (JSON encoding of the request is not timed).
+
+    Return:
+        seconds
+    """
+
+    # imported only when needed (handler loads its own artifacts)
+    import handler
+
+    client = handler.app.test_client()
+    payload = json.dumps( df_rows.to_dict( orient = 'records' ) )
+
+    timings = []
+    for _ in range( n_repeats ):
+        start = time.perf_counter()
+        response = client.post( '/rossmann/predict', data = payload, headers = {'Content-Type': 'application/json'} )
+        timings.append( time.perf_counter() - start )
+
+        if response.status_code != 200:
+            raise RuntimeError( f'/rossmann/predict answered {response.status_code}: {response.data[:200]}' )
+
+
+    return min( timings )
+
+
+def compare( results, baseline, tolerance ):
+    """
+    Print time of each stage against a baseline.
+
+    Args:
+        results: benchmark results (see main)
+        baseline: results of a former run
+        tolerance: relative slow down that is reported as a regression
+
+    Return:
+        regressions: list of ( size, stage ) that are slower than baseline
+    """
+
+    regressions = []
+
+    print( f"\n{'rows':>9} {'stage':<20}{'baseline ms':>13}{'ms':>11}{'change':>9}" )
+    for size, stages in results['sizes'].items():
+        for stage, result in stages.items():
+            # not on baseline
+            former = baseline['sizes'].get( size, {} ).get( stage )
+            if former is None:
+                continue
+
+            change = result['seconds'] / former['seconds'] - 1
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append( ( size, stage ) )
+
+            print( f"{size:>9} {stage:<20}{former['seconds'] * 1000:>13.2f}{result['seconds'] * 1000:>11.2f}{change:>+9.0%}{flag}" )
+
+
+    return regressions
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Time each pipeline stage and /rossmann/predict at several batch sizes' )
+    parser.add_argument( '--test', default = '../data/test.csv', help = 'test data (csv or parquet)' )
+    parser.add_argument( '--store', default = '../data/store.csv', help = 'store data (csv or parquet)' )
+    parser.add_argument( '--sizes', default = '1,100,10000,1000000', help = 'comma separated numbers of rows' )
+    parser.add_argument( '--engine', default = 'sklearn', choices = list( ENGINES ), help = 'inference engine' )
+    parser.add_argument( '--threads', type = int, default = None, help = 'LightGBM threads (default: one per core)' )
+    parser.add_argument( '--compact', action = 'store_true', help = 'memory-lean pipeline (compared with float64 predictions)' )
+    parser.add_argument( '--nearest', action = 'store_true', help = 'with --compact, round features to nearest float32 (split thresholds are not used)' )
+    parser.add_argument( '--repeats', type = int, default = 5, help = 'runs of each size (best one is kept)' )
+    parser.add_argument( '--endpoint-max-rows', type = int, default = 10000, help = 'largest size sent to /rossmann/predict (0 -> endpoint is not timed)' )
+    parser.add_argument( '--save', default = None, help = 'write results as JSON (e.g. --save benchmarks/baseline.json to update the baseline)' )
+    parser.add_argument( '--baseline', default = None, help = 'JSON results of a former run to compare with (e.g. benchmarks/baseline.json)' )
+    parser.add_argument( '--tolerance', type = float, default = 0.2, help = 'relative slow down reported as regression' )
+    args = parser.parse_args()
+
+    # load artifacts and data
+    artifacts = ArtifactRegistry().load()
+    df_data = pd.merge( read_data( args.test ), read_data( args.store ), how = 'left', on = 'Store' )
+
+    # pipeline and model as on handler
+    thresholds = split_thresholds( artifacts.model, COLS_SELECTED ) if args.compact and not args.nearest else None
+    pipeline = Rossmann( artifacts.parameters, num_threads = args.threads, compact = args.compact, thresholds = thresholds )
+    options = {'num_threads': args.threads} if args.engine == 'compiled' else {}
+    if ( args.engine == 'booster' ) and args.compact:
+        options['dtype'] = 'float32'
+    ml_model = make_engine( artifacts.model, args.engine, **options )
+
+    # float64 pipeline, for the precision of compact mode
+    reference = Rossmann( artifacts.parameters, num_threads = args.threads ) if args.compact else None
+
+    results = {'engine': args.engine,
+               'threads': args.threads,
+               'compact': args.compact,
+               'thresholds': thresholds is not None,
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__,
+               'cpu_count': os.cpu_count(),
+               'created_at': time.time(),
+               'sizes': {}
+              }
+
+    print( f"{'rows':>9} {'stage':<20}{'ms':>11}{'peak MB':>10}{'rows/s':>14}" )
+    for n_rows in [ int( size ) for size in args.sizes.split( ',' ) ]:
+        df_rows = make_rows( df_data, n_rows )
+
+        # fewer repeats for large batches
+        n_repeats = max( 1, min( args.repeats, int( 1e6 // n_rows ) ) )
+
+        # time and memory of each stage
+        seconds = time_stages( pipeline, ml_model, df_rows, n_repeats )
+        peaks, working_set = trace_stages( pipeline, ml_model, df_rows )
+        stages = { stage: {'seconds': seconds[ stage ], 'peak_mb': peaks[ stage ]} for stage in STAGES }
+        # (peak of whole run, with request rows)
+        stages['total'] = {'seconds': sum( seconds.values() ), 'peak_mb': working_set}
+
+        # whole request, from JSON body to JSON response
+        if n_rows <= args.endpoint_max_rows:
+            stages['endpoint'] = {'seconds': time_endpoint( df_rows, n_repeats ), 'peak_mb': None}
+
+        for stage, result in stages.items():
+            result['rows_per_second'] = n_rows / result['seconds']
+            peak = f"{result['peak_mb']:>10.1f}" if result['peak_mb'] is not None else f"{'-':>10}"
+            print( f"{n_rows:>9} {stage:<20}{result['seconds'] * 1000:>11.2f}{peak}{result['rows_per_second']:>14,.0f}" )
+
+        # predictions of compact mode against float64 ones
+        if reference is not None:
+            difference = prediction_difference( pipeline, reference, ml_model, df_rows )
+            results.setdefault( 'precision', {} )[ str( n_rows ) ] = difference
+            print( f"{n_rows:>9} {'precision':<20}{difference['changed_rows']:>10.2%} rows changed, "
+                   f"max error {difference['max_abs_error']:.4g} ({difference['max_rel_error']:.2%})" )
+
+        results['sizes'][ str( n_rows ) ] = stages
+
+    # save results
+    if args.save:
+        os.makedirs( os.path.dirname( os.path.abspath( args.save ) ), exist_ok = True )
+        with open( args.save, 'w' ) as file:
+            json.dump( results, file, indent = 2 )
+
+    # compare with baseline (exit status 1 on regressions, e.g. for CI).
+    # benchmarks/baseline.json was written by a run with default arguments
+    # (--save benchmarks/baseline.json); times depend on the machine, so
+    # the baseline is written again on the machine that compares with it
+    if args.baseline:
+        with open( args.baseline ) as file:
+            regressions = compare( results, json.load( file ), args.tolerance )
+
+        if regressions:
+            print( f'\n{len( regressions )} stages are more than {args.tolerance:.0%} slower than baseline' )
+            raise SystemExit( 1 )
+
+
+    return None
+
+
+# when benchmark_pipeline.py script is run, benchmark pipeline
+if __name__ == '__main__':
+    main()
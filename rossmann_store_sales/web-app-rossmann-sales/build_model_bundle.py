@@ -0,0 +1,43 @@
+############## LIBRARIES ##############
+
+
+import argparse
+import os
+import time
+from   rossmann.Rossmann           import TRANSFORM_STEPS
+from   rossmann.CompiledPlan       import CompiledPlan
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.ModelBundle        import ModelBundle
+
+
+############## FUNCTIONS ##############
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Pack model and inputters/scalers pickles into a single model bundle' )
+    parser.add_argument( '--model', default = './model/model_rossmann_sales.pkl', help = 'pickled model' )
+    parser.add_argument( '--parameter', default = './parameter', help = 'folder with inputters and scalers' )
+    parser.add_argument( '--output', default = './model/model_rossmann_sales.bundle', help = 'model bundle file' )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    # load pickles (never from an existing bundle)
+    artifacts = ArtifactRegistry( model_path = args.model, parameter_path = args.parameter ).load()
+
+    # compile inputters and scalers and write bundle
+    plan = CompiledPlan.from_parameters( artifacts.parameters, TRANSFORM_STEPS )
+    ModelBundle.write( args.output, artifacts.model, plan, artifacts.digest )
+
+    # report
+    print( f'{args.output} ({os.path.getsize( args.output ) / 1e6:.1f} MB, digest {artifacts.digest}) '
+           f'written in {time.perf_counter() - start:.2f} s' )
+
+
+    return None
+
+
+# when build_model_bundle.py script is run, write model bundle
+if __name__ == '__main__':
+    main()
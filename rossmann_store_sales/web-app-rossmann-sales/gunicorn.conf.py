@@ -0,0 +1,85 @@
+############## LIBRARIES ##############
+
+
+import os
+
+
+############## SERVER ##############
+
+
+# NOTE: run with -> gunicorn -c gunicorn.conf.py handler:app
+# handler.py (model, inputters and scalers) is loaded once by the master
+# process, before workers are forked, so workers share its memory pages.
+# kill -HUP <master pid> reloads artifacts on master and replaces workers
+# gracefully (old workers finish their requests first).
+
+
+# port given by the platform (e.g. Heroku)
+bind = f"0.0.0.0:{os.environ.get( 'PORT', 5000 )}"
+
+# number of worker processes and threads of each worker
+cores = os.cpu_count() or 1
+workers = int( os.environ.get( 'WEB_CONCURRENCY', cores ) )
+threads = int( os.environ.get( 'GUNICORN_THREADS', 1 ) )
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# LightGBM threads of each worker -> workers x threads x LightGBM threads <= cores
+# (environment is read by handler.py, which is loaded after this file)
+os.environ.setdefault( 'LGBM_NUM_THREADS', str( max( 1, cores // ( workers * threads ) ) ) )
+
+# load handler.py before forking workers
+preload_app = True
+
+# seconds for a request to be answered and for workers to finish on reload/shutdown
+timeout = int( os.environ.get( 'GUNICORN_TIMEOUT', 60 ) )
+graceful_timeout = int( os.environ.get( 'GUNICORN_GRACEFUL_TIMEOUT', 30 ) )
+
+# replace workers after some requests (not set -> never)
+max_requests = int( os.environ.get( 'GUNICORN_MAX_REQUESTS', 0 ) )
+max_requests_jitter = max_requests // 10
+
+# logs on stdout/stderr
+accesslog = '-'
+errorlog = '-'
+
+
+############## HOOKS ##############
+
+
+def on_reload( server ):
+    """on HUP, reload artifacts on master before new workers are forked"""
+
+    # preloaded handler.py
+    import handler
+
+    # load model, inputters and scalers again
+    # (if files can't be loaded, workers keep the artifacts they had)
+    try:
+        artifacts = handler.registry.load()
+    except Exception:
+        server.log.exception( 'Artifacts could not be reloaded' )
+        return None
+
+    # rebuild store index and inference engine for new artifacts, so workers inherit them
+    handler.get_store_index( artifacts )
+    handler.get_engine( artifacts )
+
+    # reload server-side store data if it changed
+    if ( handler.store_calendar is not None ) and handler.store_calendar.is_stale():
+        handler.store_calendar.load()
+
+    server.log.info( f'Artifacts reloaded (digest {artifacts.digest})' )
+
+
+    return None
+
+
+def child_exit( server, worker ):
+    """remove prometheus_client files of exited workers (metrics of every worker, see rossmann/Metrics.py)"""
+
+    if os.environ.get( 'PROMETHEUS_MULTIPROC_DIR' ):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead( worker.pid )
+
+
+    return None
@@ -1,74 +1,591 @@
 ############## LIBRARIES ##############
 
 
-import pickle
+import time
+# startup timing report (see record_startup) starts before the other imports
+startup_marks = [ ( 'start', time.perf_counter() ) ]
+
+import itertools
+import json
+import logging
 import os
-import lightgbm
-import pandas              as pd
-from   rossmann.Rossmann   import Rossmann
-from   flask               import Flask, request, Response
+import threading
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.StoreFeatureIndex  import StoreFeatureIndex
+from   rossmann.PredictionCache    import PredictionCache, cached_run_pipeline, cache_digest
+from   rossmann.ForecastStore      import ForecastStore
+from   rossmann.StoreCalendar      import StoreCalendar
+from   rossmann.MicroBatcher       import MicroBatcher
+from   rossmann.InferenceEngine    import make_engine, split_thresholds
+from   rossmann.ResponseBuilder    import parse_fields, select_fields, records_json, date_strings
+from   rossmann.RequestSchema      import parse_body, SchemaError, REQUIRED_COLUMNS, STORE_COLUMNS
+from   rossmann.Metrics            import Metrics
+from   rossmann.SlowRequestProfiler import SlowRequestProfiler
+from   rossmann.Serialization      import read_table, write_table, media_type, UnsupportedMediaType
+from   rossmann.Serialization      import JSON_TYPE, ARROW_TYPE, PARQUET_TYPE
+from   rossmann.Streaming          import iter_ndjson_chunks, iter_arrow_chunks, write_ndjson_chunks, write_arrow_chunks
+from   rossmann.Streaming          import NDJSON_TYPE
+from   flask                       import Flask, request, Response, stream_with_context, g
 
 
 ############## API ##############
 
 
-# loading model
-with open('./model/model_rossmann_sales.pkl', 'rb') as file:
-    model = pickle.load( file )
+# app logs -> gunicorn error log when served by gunicorn (stderr otherwise)
+logger = logging.getLogger( 'rossmann' )
+gunicorn_logger = logging.getLogger( 'gunicorn.error' )
+if gunicorn_logger.handlers:
+    logger.handlers = gunicorn_logger.handlers
+    logger.propagate = False
+else:
+    logging.basicConfig( format = '%(asctime)s %(levelname)s %(name)s: %(message)s' )
+logger.setLevel( os.environ.get( 'ROSSMANN_LOG_LEVEL', 'INFO' ).upper() )
+
+
+def record_startup( step ):
+    """record seconds spent on a startup step (since previous step)"""
+
+    startup_marks.append( ( step, time.perf_counter() ) )
+
+
+# every import is done (lightgbm is imported by the model loading,
+# sklearn only if pickles are loaded, pyarrow and treelite only if used)
+record_startup( 'imports' )
+
+# seconds between checks for changed model/parameter files
+# (not set -> files are loaded only once, at worker start)
+reload_interval = os.environ.get( 'ROSSMANN_RELOAD_INTERVAL' )
+
+# load model, inputters and scalers once per process
+# (from the model bundle, if it was built from current pickles -> see build_model_bundle.py)
+registry = ArtifactRegistry( model_path = './model/model_rossmann_sales.pkl',
+                             parameter_path = './parameter',
+                             reload_interval = float( reload_interval ) if reload_interval else None,
+                             bundle_path = os.environ.get( 'ROSSMANN_MODEL_BUNDLE', './model/model_rossmann_sales.bundle' ) )
+registry.load()
+record_startup( 'artifacts' )
+
+# LightGBM threads of each process (not set -> one thread per core).
+# with several server workers, workers x threads should not exceed the cores
+num_threads = os.environ.get( 'LGBM_NUM_THREADS' )
+num_threads = int( num_threads ) if num_threads else None
+
+# how the model predicts: 'sklearn' (model as trained), 'booster' (raw LightGBM
+# Booster on a NumPy matrix) or 'compiled' (trees compiled with treelite/tl2cgen)
+inference_engine = os.environ.get( 'ROSSMANN_INFERENCE_ENGINE', 'sklearn' )
+
+# memory-lean pipeline: smallest dtypes and float32 features, rounded so
+# that they take the same split branches as float64 ones (see Rossmann)
+compact_dtypes = os.environ.get( 'ROSSMANN_COMPACT_DTYPES', '0' ) == '1'
+
+# engine of the current artifacts: ( artifacts digest, engine )
+engine_cache = {'digest': None, 'engine': None}
+engine_lock = threading.Lock()
+
+# split thresholds of the current model (compact mode): ( artifacts digest, thresholds )
+thresholds_cache = {'digest': None, 'thresholds': None}
+
+
+def get_thresholds( artifacts ):
+    """Split thresholds of the model of the given artifacts (None if not on compact mode).
+    Thresholds are read again only if artifacts were reloaded"""
+
+    # float64 features
+    if not compact_dtypes:
+        return None
+
+    with engine_lock:
+        if thresholds_cache['digest'] != artifacts.digest:
+            thresholds_cache['thresholds'] = split_thresholds( artifacts.model, COLS_SELECTED )
+            thresholds_cache['digest'] = artifacts.digest
+
+
+        return thresholds_cache['thresholds']
+
+
+def make_pipeline( artifacts ):
+    """Rossmann pipeline with the given artifacts (pickled parameters or bundle plan)"""
+
+    return Rossmann( artifacts.parameters, num_threads = num_threads, plan = artifacts.plan,
+                     compact = compact_dtypes, thresholds = get_thresholds( artifacts ) )
+
+
+# store.csv used to precompute store level features once
+# (not set -> store features are computed from request data)
+store_path = os.environ.get( 'ROSSMANN_STORE_CSV' )
+store_index = StoreFeatureIndex( make_pipeline( registry.get() ),
+                                 store_path = store_path,
+                                 version = registry.get().loaded_at ) if store_path else None
+
+
+# cache of predicted rows (not set -> every row is always scored)
+cache_size = os.environ.get( 'ROSSMANN_PREDICTION_CACHE_SIZE' )
+cache_ttl = os.environ.get( 'ROSSMANN_PREDICTION_CACHE_TTL', 3600 )
+prediction_cache = PredictionCache( maxsize = int( cache_size ),
+                                    ttl = float( cache_ttl ) if cache_ttl else None,
+                                    disk_path = os.environ.get( 'ROSSMANN_PREDICTION_CACHE_DIR' ) ) if cache_size else None
+
+
+# forecasts written by materialize_forecasts.py (not set -> no forecast lookup)
+forecast_path = os.environ.get( 'ROSSMANN_FORECAST_PATH' )
+forecast_store = ForecastStore( forecast_path ) if forecast_path else None
+
+
+# server-side test.csv + store.csv, to build prediction rows from a store id
+# (repository data folder by default; folder without these files -> no store-scoped forecast)
+data_path = os.environ.get( 'ROSSMANN_DATA_PATH', '../data' )
+store_calendar = StoreCalendar( data_path ) if os.path.isfile( os.path.join( data_path, 'test.csv' ) ) else None
+record_startup( 'data' )
+
+# columns every request must have (store.csv columns are
+# not needed if store features are taken from store index)
+required_columns = REQUIRED_COLUMNS if store_index is not None else REQUIRED_COLUMNS + STORE_COLUMNS
+
+# request, pipeline step and rows metrics (served on /metrics)
+metrics = Metrics()
+
+# sampling profiler of requests slower than ROSSMANN_PROFILE_SLOW_MS
+# (not set -> requests are not sampled)
+profile_slow_ms = os.environ.get( 'ROSSMANN_PROFILE_SLOW_MS' )
+profiler = SlowRequestProfiler( threshold_ms = float( profile_slow_ms ),
+                                interval_ms = float( os.environ.get( 'ROSSMANN_PROFILE_INTERVAL_MS', 5 ) ),
+                                output_path = os.environ.get( 'ROSSMANN_PROFILE_PATH', './profiles' ) ) if profile_slow_ms else None
+
+
+def get_store_index( artifacts ):
+    """Store feature index for the given artifacts (None if not enabled).
+    Index is rebuilt if artifacts were reloaded or, when reloading is
+    enabled, if store.csv changed on disk"""
+
+    # store index not enabled
+    if store_index is None:
+        return None
+
+    # rebuild index with the current artifacts
+    if ( store_index.version != artifacts.loaded_at ) or ( ( registry.reload_interval is not None ) and store_index.is_stale() ):
+        store_index.rebuild( pipeline = make_pipeline( artifacts ), version = artifacts.loaded_at )
+
+
+    return store_index
+
+
+def get_store_calendar():
+    """Store calendar (None if not enabled), reloaded, when reloading is
+    enabled, if test.csv or store.csv changed on disk"""
+
+    # reload calendar data
+    if ( store_calendar is not None ) and ( registry.reload_interval is not None ) and store_calendar.is_stale():
+        store_calendar.load()
+
+
+    return store_calendar
+
+
+def get_engine( artifacts ):
+    """Inference engine for the model of the given artifacts.
+    Engine is created again only if artifacts were reloaded"""
+
+    with engine_lock:
+        if engine_cache['digest'] != artifacts.digest:
+            # compiled predictor threads are set when it is created
+            options = {'num_threads': num_threads} if inference_engine == 'compiled' else {}
+            # float32 matrix on compact mode
+            if ( inference_engine == 'booster' ) and compact_dtypes:
+                options['dtype'] = 'float32'
+
+            engine_cache['engine'] = make_engine( artifacts.model, inference_engine, **options )
+            engine_cache['digest'] = artifacts.digest
+
+
+        return engine_cache['engine']
+
+
+# create engine on startup (before forking, on a prefork server)
+get_engine( registry.get() )
+record_startup( 'engine' )
+
+
+def score( test_raw ):
+    """Run Rossmann pipeline on raw data with the current artifacts"""
+
+    # get artifacts loaded at worker start
+    artifacts = registry.get()
+
+    # Instantiate Rossmann class with already loaded parameters
+    pipeline = make_pipeline( artifacts )
+
+    # model (or its faster equivalent)
+    ml_model = get_engine( artifacts )
+
+    # store features (index is rebuilt if store.csv changed)
+    index = get_store_index( artifacts )
+
+    # clean, engineer, filter, prepare data and make prediction
+    if prediction_cache is None:
+        df_predicted = pipeline.run_pipeline( ml_model, test_raw, store_index = index, observe = metrics.observe_stage )
+
+    # only for rows that were not predicted before
+    else:
+        # (rows predicted with another store.csv or dtype mode are not reused)
+        digest = cache_digest( artifacts.digest, store_index = index, compact = compact_dtypes )
+        df_predicted = cached_run_pipeline( prediction_cache, pipeline, ml_model, digest,
+                                            test_raw, store_index = index, observe = metrics.observe_stage )
+
+
+    return df_predicted
+
+
+# coalesce concurrent /rossmann/predict requests into a single pipeline run
+# (not set -> every request is scored on its own). Requests are only concurrent
+# on a threaded server, e.g. gunicorn with GUNICORN_THREADS > 1
+micro_batch_wait = os.environ.get( 'ROSSMANN_MICRO_BATCH_MAX_WAIT_MS' )
+micro_batcher = MicroBatcher( score,
+                              max_wait_ms = float( micro_batch_wait ),
+                              max_rows = int( os.environ.get( 'ROSSMANN_MICRO_BATCH_MAX_ROWS', 1024 ) ) ) if micro_batch_wait else None
+
+
+def score_fields( test_raw, fields, scorer = score ):
+    """Score raw data and keep only the response columns
+    (fields -> comma separated names, see ResponseBuilder.parse_fields)"""
+
+    metrics.observe_rows( request.url_rule.rule, test_raw.shape[0] )
+
+    # clean, engineer, filter, prepare data and make prediction
+    df_predicted = scorer( test_raw )
+
+
+    return select_fields( df_predicted, parse_fields( fields, has_id = 'id' in df_predicted.columns ) )
+
+
+def cache_metrics():
+    """prediction cache and micro batching counters (see Metrics.add_callback)"""
+
+    values = []
+
+    if prediction_cache is not None:
+        stats = prediction_cache.stats()
+        values += [ ( 'prediction_cache_hits_total', 'counter', 'Rows found on prediction cache (memory or disk)', stats['hits'] ),
+                    ( 'prediction_cache_disk_hits_total', 'counter', 'Rows found on disk tier of prediction cache', stats['disk_hits'] ),
+                    ( 'prediction_cache_misses_total', 'counter', 'Rows scored because they were not cached', stats['misses'] ),
+                    ( 'prediction_cache_size', 'gauge', 'Rows on memory tier of prediction cache', stats['size'] ) ]
+
+    if micro_batcher is not None:
+        stats = micro_batcher.stats()
+        values += [ ( 'micro_batches_total', 'counter', 'Pipeline runs of coalesced requests', stats['batches'] ),
+                    ( 'micro_batch_requests_total', 'counter', 'Requests scored on micro batches', stats['requests'] ) ]
+
+
+    return values
+
+
+metrics.add_callback( cache_metrics )
+
+
+def error_response( message, status ):
+    """json response with an error message"""
+
+    return Response( json.dumps( {'error': message} ), status = status, mimetype = 'application/json' )
 
 
 # Create the app object
 app = Flask( __name__ )
 
+# startup report -> seconds of each step and total
+record_startup( 'app' )
+startup = { step: round( end - begin, 4 ) for ( _, begin ), ( step, end ) in zip( startup_marks, startup_marks[1:] ) }
+startup['total'] = round( startup_marks[-1][1] - startup_marks[0][1], 4 )
+logger.info( 'Startup %s (artifacts from %s)', ', '.join( f'{step} {seconds * 1000:.0f} ms' for step, seconds in startup.items() ), registry.source )
+
+@app.before_request
+def start_request():
+    # request start (and sampling of slow requests)
+    g.start = time.perf_counter()
+    g.profile = profiler.start() if profiler is not None else None
+
+
+@app.after_request
+def finish_request( response ):
+    # route of request (not its values, so metrics have few labels)
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    # latency until response is ready (streams are still being sent)
+    metrics.observe_request( endpoint, request.method, response.status_code, time.perf_counter() - g.start )
+
+    # write samples if request was slow
+    if g.profile is not None:
+        profiler.stop( g.profile, f'{request.method} {request.path}' )
+
+
+    return response
+
+
 # create endpoint for request
 @app.route( '/rossmann/predict', methods=['POST'] )
 def rossmann_predict():
-    # get json data on request
-    test_json = request.get_json()   
+    # response columns (not set -> id, store, date and predicted_sales)
+    fields = request.args.get( 'fields' )
+    try:
+        parse_fields( fields )
+    except ValueError as error:
+        return error_response( str( error ), 400 )
+
+    # data was not sent as json
+    if not request.is_json:
+        return Response( '{}', status = 200, mimetype = 'application/json' )
+
+    # parse json data on request into typed columns (invalid data -> bad request)
+    try:
+        test_raw = parse_body( request.get_data(), required = required_columns )
+    except SchemaError as error:
+        return error_response( str( error ), 400 )
 
     # check if data was sent on request
-    if test_json:
-    # unique row given on the request made: json = dictionary
-        if isinstance( test_json, dict ): 
-            test_raw = pd.DataFrame( test_json, index = [0] )
+    if test_raw is not None:
+        # clean, engineer, filter, prepare data and make prediction
+        # (together with other concurrent requests, if micro batching is enabled)
+        df_response = score_fields( test_raw, fields, scorer = score if micro_batcher is None else micro_batcher.submit )
 
-        # multiple rows given on the request made
-        else:
-            test_raw = pd.DataFrame( test_json, columns=test_json[0].keys() )
-       
-        # create a copy of original data
-        original_data = test_raw.copy()
+        
+        # convert the result to json (API transferring format)
+        return Response( records_json( df_response ), status = 200, mimetype = 'application/json' )
+
+
+    # data was not sent on request
+    else:
+        # mimetype -> from a json application
+        return Response( '{}', status = 200, mimetype = 'application/json' )
 
-        # Instantiate Rossmann class
-        pipeline = Rossmann()
 
-        # clean data
-        df_dc_done = pipeline.data_cleaning( test_raw )
+# create endpoint for bulk requests (JSON, Arrow IPC stream or Parquet bodies)
+@app.route( '/rossmann/predict/bulk', methods=['POST'] )
+def rossmann_predict_bulk():
+    # response columns (not set -> id, store, date and predicted_sales)
+    fields = request.args.get( 'fields' )
+    try:
+        parse_fields( fields )
+    except ValueError as error:
+        return error_response( str( error ), 400 )
 
-        # engineer data
-        df_fe_done = pipeline.feature_engineering( df_dc_done )
+    try:
+        # get request body format
+        body_type = media_type( request.content_type )
 
-        # filter data
-        df_df_done = pipeline.data_filtering( df_fe_done )
-               
-        # prepare data
-        df_dp_done = pipeline.data_preparation( df_df_done )
-       
-        # make prediction
-        df_response = pipeline.get_prediction( model, original_data, df_dp_done )
+        # response format -> the best one the client accepts (request format if it has no preference)
+        if request.accept_mimetypes:
+            response_type = request.accept_mimetypes.best_match( [ body_type ] + [ other for other in [JSON_TYPE, ARROW_TYPE, PARQUET_TYPE] if other != body_type ] )
+        else:
+            response_type = body_type
+        if response_type is None:
+            return error_response( 'response can only be application/json, application/vnd.apache.arrow.stream or application/vnd.apache.parquet', 406 )
 
-        
-        return df_response
+        # read data sent on request
+        test_raw = read_table( request.get_data(), body_type, required = required_columns )
 
+    # unsupported request format
+    except UnsupportedMediaType as error:
+        return error_response( str( error ), 415 )
+
+    # invalid data
+    except SchemaError as error:
+        return error_response( str( error ), 400 )
 
     # data was not sent on request
-    else:
-        # mimetype -> from a json application
+    if test_raw.empty:
         return Response( '{}', status = 200, mimetype = 'application/json' )
 
+    # clean, engineer, filter, prepare data and make prediction
+    df_response = score_fields( test_raw, fields )
+
+    # write response on the chosen format
+    body, mimetype = write_table( df_response, response_type )
+
+
+    return Response( body, status = 200, mimetype = mimetype )
+
+
+# create endpoint for streaming requests (NDJSON or Arrow IPC stream bodies)
+@app.route( '/rossmann/predict/stream', methods=['POST'] )
+def rossmann_predict_stream():
+    # maximum number of rows scored at once
+    chunk_size = request.args.get( 'chunk_size', default = 10000, type = int )
+    if not 0 < chunk_size <= 100000:
+        return error_response( 'chunk_size must be between 1 and 100000', 400 )
+
+    # response columns (not set -> id, store, date and predicted_sales)
+    fields = request.args.get( 'fields' )
+    try:
+        parse_fields( fields )
+    except ValueError as error:
+        return error_response( str( error ), 400 )
+
+    # get request body format
+    body_type = ( request.content_type or '' ).split( ';' )[0].strip().lower()
+
+    # NDJSON records -> NDJSON predictions
+    if body_type == NDJSON_TYPE:
+        chunks = iter_ndjson_chunks( request.stream, chunk_size, required = required_columns )
+        writer, mimetype = write_ndjson_chunks, NDJSON_TYPE
+
+    # Arrow record batches -> Arrow record batches
+    elif body_type == ARROW_TYPE:
+        chunks = iter_arrow_chunks( request.stream, chunk_size, required = required_columns )
+        writer, mimetype = write_arrow_chunks, ARROW_TYPE
+
+    # unsupported request format
+    else:
+        return error_response( f'streaming requires {NDJSON_TYPE} or {ARROW_TYPE} body', 415 )
+
+    # read first chunk before the response starts (invalid data -> bad request)
+    try:
+        first = next( chunks, None )
+    except SchemaError as error:
+        return error_response( str( error ), 400 )
+
+    # score one chunk at a time, as chunks are read (errors of later
+    # chunks end the stream with an error record, see Streaming)
+    chunks = itertools.chain( [ first ], chunks ) if first is not None else iter( [] )
+    predictions = ( score_fields( chunk, fields ) for chunk in chunks )
+
+
+    # send predictions of each chunk as soon as they are ready
+    return Response( stream_with_context( writer( predictions ) ), status = 200, mimetype = mimetype )
+
+
+# create endpoint for precomputed forecast of a single store
+@app.route( '/rossmann/forecasts/<int:store_id>', methods=['GET'] )
+def rossmann_forecast( store_id ):
+    # forecasts were not materialized
+    if forecast_store is None:
+        return error_response( 'forecasts are not available (ROSSMANN_FORECAST_PATH is not set)', 404 )
+
+    # reopen forecast if it was written again
+    forecast = forecast_store.refresh()
+
+    # store has no forecast
+    if store_id not in forecast:
+        return error_response( f'there is no forecast for store {store_id}', 404 )
+
+    # six weeks total (and daily predictions, unless only the total was asked)
+    response = {'store': store_id, 'predicted_sales': forecast.total( store_id )}
+    if request.args.get( 'daily', default = 1, type = int ):
+        response['daily'] = forecast.daily( store_id )
+
+
+    return Response( json.dumps( response ), status = 200, mimetype = 'application/json' )
+
+
+def date_arg( name ):
+    """YYYY-MM-DD date of a query argument (None if not given, ValueError if empty or invalid)"""
+
+    # not given
+    value = request.args.get( name )
+    if value is None:
+        return None
+
+    # empty or invalid date (e.g. '', '2015-13-01', 'tomorrow')
+    try:
+        date = pd.to_datetime( value, format = '%Y-%m-%d' )
+    except ( ValueError, OverflowError ):
+        date = pd.NaT
+    if pd.isna( date ):
+        raise ValueError( f'{name} must be a date (YYYY-MM-DD), got {value!r}' )
+
+
+    return date
+
+
+# create endpoint for forecast of a single store, built from server-side data
+@app.route( '/rossmann/stores/<int:store_id>/forecast', methods=['GET'] )
+def rossmann_store_forecast( store_id ):
+    # calendar data is not available
+    calendar = get_store_calendar()
+    if calendar is None:
+        return error_response( f'store data is not available (no test.csv on {data_path})', 404 )
+
+    # store is not on calendar
+    if store_id not in calendar:
+        return error_response( f'there is no data for store {store_id}', 404 )
+
+    # date range -> from start (first calendar date if not given) to end (or horizon days)
+    try:
+        start, end = [ date_arg( name ) for name in ['start', 'end'] ]
+    except ValueError as error:
+        return error_response( str( error ), 400 )
+    if ( start is not None ) and ( end is not None ) and ( start > end ):
+        return error_response( f'start ({start:%Y-%m-%d}) must not be after end ({end:%Y-%m-%d})', 400 )
+
+    # horizon -> whole number of days (e.g. 'abc', '1.5' or '-3' are not)
+    horizon = request.args.get( 'horizon', default = '42' )
+    if not ( horizon.isascii() and horizon.isdigit() and 0 < int( horizon ) <= 366 ):
+        return error_response( f'horizon must be a number of days between 1 and 366, got {horizon!r}', 400 )
+    horizon = int( horizon )
+
+    # calendar rows of the store on date range
+    test_raw = calendar.rows( store_id, start = start, end = end, horizon = horizon )
+    metrics.observe_rows( request.url_rule.rule, test_raw.shape[0] )
+
+    # clean, engineer, filter, prepare data and make prediction (closed days -> 0 sales)
+    df_predicted = score( test_raw ) if not test_raw.empty else pd.DataFrame( columns = ['date', 'predicted_sales'] )
+    dates = date_strings( df_predicted['date'].values )
+
+    # total on date range (and daily predictions, unless only the total was asked)
+    response = {'store': store_id,
+                'start': dates[0] if dates.size else None,
+                'end': dates[-1] if dates.size else None,
+                'predicted_sales': float( df_predicted['predicted_sales'].sum() )}
+    if request.args.get( 'daily', default = 1, type = int ):
+        response['daily'] = [ {'date': date, 'predicted_sales': None if np.isnan( value ) else float( value )}
+                              for date, value in zip( dates, df_predicted['predicted_sales'].values.astype( 'float64' ) ) ]
+
+
+    return Response( json.dumps( response ), status = 200, mimetype = 'application/json' )
+
+
+# create endpoint for prometheus metrics
+@app.route( '/metrics', methods=['GET'] )
+def rossmann_metrics():
+    # latency histograms, rows, cache counters and memory
+    body, content_type = metrics.render()
+
+
+    return Response( body, status = 200, content_type = content_type )
+
+
+# create endpoint for readiness check
+@app.route( '/rossmann/health', methods=['GET'] )
+def rossmann_health():
+    # get registry status (load timing, reloads, errors)
+    status = registry.status()
+
+    # process answering the request (one of the server workers)
+    status['pid'] = os.getpid()
+    status['num_threads'] = num_threads
+    status['inference_engine'] = inference_engine
+    status['startup'] = startup
+
+    # prediction cache metrics
+    if prediction_cache is not None:
+        status['prediction_cache'] = prediction_cache.stats()
+
+    # micro batching metrics (batch size histograms)
+    if micro_batcher is not None:
+        status['micro_batcher'] = micro_batcher.stats()
+
+    # not ready -> service unavailable
+    status_code = 200 if status['ready'] else 503
+
+
+    return Response( json.dumps( status ), status = status_code, mimetype = 'application/json' )
+
 
-# when handler.py script is run, run flask
+# when handler.py script is run, run flask development server
+# (production -> gunicorn -c gunicorn.conf.py handler:app)
 if __name__ == '__main__':
     port = os.environ.get('PORT', 5000)
+    # debug mode only if asked for
+    debug = os.environ.get( 'FLASK_DEBUG', '0' ) == '1'
     # '0.0.0.0' is the local host
-    app.run( host = '0.0.0.0', port = port, debug = True )
\ No newline at end of file
+    app.run( host = '0.0.0.0', port = port, debug = debug )
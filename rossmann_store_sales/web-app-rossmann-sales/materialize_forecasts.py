@@ -0,0 +1,92 @@
+############## LIBRARIES ##############
+
+
+import argparse
+import os
+import time
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.InferenceEngine    import split_thresholds
+from   rossmann.ForecastStore      import ForecastStore
+from   rossmann.IncrementalScorer  import take_snapshot, write_snapshot
+from   batch_scoring               import read_data
+
+
+############## FUNCTIONS ##############
+
+
+def predict_forecast( df_test, artifacts, compact = False ):
+    """
+    Predict daily sales for every row of test data.
+
+    Args:
+        df_test: test.csv + store.csv rows
+        artifacts: loaded artifacts (see ArtifactRegistry)
+        compact: True -> memory-lean pipeline (see Rossmann)
+
+    Return:
+        df_forecast: dataframe with store, date and predicted_sales
+                     (0 on days a store is closed)
+    """
+
+    # clean, engineer, filter, prepare data and make prediction
+    # (every row is kept, with its date)
+    pipeline = Rossmann( artifacts.parameters, compact = compact,
+                         thresholds = split_thresholds( artifacts.model, COLS_SELECTED ) if compact else None )
+    df_predicted = pipeline.run_pipeline( artifacts.model, df_test.copy() )
+
+
+    return df_predicted[ ['store', 'date', 'predicted_sales'] ].reset_index( drop = True )
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Precompute daily and six weeks forecasts for every store' )
+    parser.add_argument( '--test', default = '../data/test.csv', help = 'test data (csv or parquet)' )
+    parser.add_argument( '--store', default = '../data/store.csv', help = 'store data (csv or parquet)' )
+    parser.add_argument( '--predictions', default = None, help = 'use batch_scoring.py parquet output instead of scoring again' )
+    parser.add_argument( '--output', default = './forecasts', help = 'forecast store folder' )
+    parser.add_argument( '--model', default = './model/model_rossmann_sales.pkl', help = 'pickled model' )
+    parser.add_argument( '--parameter', default = './parameter', help = 'folder with inputters and scalers' )
+    parser.add_argument( '--compact', action = 'store_true', help = 'memory-lean pipeline (smallest dtypes, float32 features)' )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    # load artifacts
+    artifacts = ArtifactRegistry( model_path = args.model, parameter_path = args.parameter ).load()
+
+    # already scored predictions
+    if args.predictions:
+        df_forecast = read_data( args.predictions )[ ['store', 'date', 'predicted_sales'] ]
+
+    # score test data
+    else:
+        df_test, df_store = read_data( args.test ), read_data( args.store )
+        df_forecast = predict_forecast( pd.merge( df_test, df_store, how = 'left', on = 'Store' ), artifacts, compact = args.compact )
+
+    # write forecast store
+    ForecastStore.write( args.output, df_forecast, digest = artifacts.digest )
+
+    # rows the forecast was scored from -> later changes are scored by rescore.py
+    # (unknown for already scored predictions -> rescore.py scores every row once)
+    if args.predictions:
+        if os.path.isfile( os.path.join( args.output, 'snapshot.npz' ) ):
+            os.remove( os.path.join( args.output, 'snapshot.npz' ) )
+    else:
+        write_snapshot( args.output, take_snapshot( df_test, df_store ) )
+
+    # report
+    forecast = ForecastStore( args.output )
+    print( f"{forecast.meta['n_stores']} stores, {forecast.meta['n_days']} days from {forecast.meta['start_date']} "
+           f"written to {args.output} in {time.perf_counter() - start:.2f} s" )
+
+
+    return None
+
+
+# when materialize_forecasts.py script is run, write forecasts
+if __name__ == '__main__':
+    main()
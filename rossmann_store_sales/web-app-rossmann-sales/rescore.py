@@ -0,0 +1,48 @@
+############## LIBRARIES ##############
+
+
+import argparse
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.InferenceEngine    import split_thresholds
+from   rossmann.IncrementalScorer  import IncrementalScorer
+from   batch_scoring               import read_data
+
+
+############## FUNCTIONS ##############
+
+
+def main():
+    # command line arguments
+    parser = argparse.ArgumentParser( description = 'Update a forecast store, scoring only the test.csv/store.csv rows that changed since it was scored' )
+    parser.add_argument( '--test', default = '../data/test.csv', help = 'new test data (csv or parquet)' )
+    parser.add_argument( '--store', default = '../data/store.csv', help = 'new store data (csv or parquet)' )
+    parser.add_argument( '--output', default = './forecasts', help = 'forecast store folder (see materialize_forecasts.py)' )
+    parser.add_argument( '--model', default = './model/model_rossmann_sales.pkl', help = 'pickled model' )
+    parser.add_argument( '--parameter', default = './parameter', help = 'folder with inputters and scalers' )
+    parser.add_argument( '--compact', action = 'store_true', help = 'memory-lean pipeline (smallest dtypes, float32 features)' )
+    parser.add_argument( '--full', action = 'store_true', help = 'score every row again' )
+    args = parser.parse_args()
+
+    # load artifacts
+    artifacts = ArtifactRegistry( model_path = args.model, parameter_path = args.parameter ).load()
+
+    # pipeline as on materialize_forecasts.py
+    pipeline = Rossmann( artifacts.parameters, compact = args.compact,
+                         thresholds = split_thresholds( artifacts.model, COLS_SELECTED ) if args.compact else None )
+
+    # score changed rows and patch forecast store
+    scorer = IncrementalScorer( pipeline, artifacts.model, digest = artifacts.digest )
+    report = scorer.rescore( args.output, read_data( args.test ), read_data( args.store ), full = args.full )
+
+    # report
+    print( f"{report['mode']} update of {args.output}: {report['rows_scored']} rows scored, {report['rows_removed']} removed, "
+           f"{report['changed_stores']} stores changed in {report['seconds']:.2f} s" )
+
+
+    return None
+
+
+# when rescore.py script is run, update forecasts
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+############## LIBRARIES ##############
+
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from   collections            import namedtuple
+from   rossmann.Rossmann      import PARAMETERS
+from   rossmann.ModelBundle   import ModelBundle
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+logger = logging.getLogger( __name__ )
+
+
+# immutable snapshot of everything needed to make a prediction.
+# a reload creates a new snapshot, so requests that already got
+# the previous one keep using it until they are done.
+# digest identifies the content of the loaded files (e.g. for caches).
+# artifacts loaded from a model bundle have no parameters (sklearn
+# objects), only their compiled plan (see Rossmann plan argument).
+Artifacts = namedtuple( 'Artifacts', ['model', 'parameters', 'loaded_at', 'digest', 'plan'], defaults = [ None ] )
+
+
+class ArtifactRegistry:
+    """
+    Load ML model and Rossmann inputters/scalers once per process
+    and share them (read-only) across requests and threads.
+
+    Args:
+        model_path: path to the pickled ML model
+        parameter_path: folder with the pickled inputters and scalers
+        reload_interval: if given, seconds between checks for changed
+                         files on disk (files are reloaded if changed).
+                         If None, artifacts are only loaded by load()
+        bundle_path: if given, model bundle (see ModelBundle) loaded instead
+                     of the pickles, if it was built from them (or pickles
+                     are not on disk)
+    """
+
+    def __init__( self,
+                  model_path = './model/model_rossmann_sales.pkl',
+                  parameter_path = './parameter',
+                  reload_interval = None,
+                  bundle_path = None ):
+
+        self.model_path = model_path
+        self.parameter_path = parameter_path
+        self.reload_interval = reload_interval
+        self.bundle_path = bundle_path
+
+        # current snapshot -> None until the first load is done
+        self._artifacts = None
+        # lock so that only one thread loads files at a time
+        self._lock = threading.Lock()
+
+        # bookkeeping for reloads and health checks
+        self._signature = None
+        self._last_check = 0.0
+        self.load_time = None
+        self.load_timings = {}
+        self.reloads = 0
+        self.last_error = None
+        self.source = None
+
+
+    def _paths( self ):
+        """dictionary with artifact name -> pickle file path"""
+
+        # model path
+        paths = {'model': self.model_path}
+
+        # inputters and scalers paths
+        for name in PARAMETERS:
+            paths[ name ] = os.path.join( self.parameter_path, f'{name}.pkl' )
+
+
+        return paths
+
+
+    def _file_signature( self ):
+        """modification time and size of every artifact file (None if not on disk)"""
+
+        # pickles and bundle
+        paths = list( self._paths().items() ) + ( [ ('bundle', self.bundle_path) ] if self.bundle_path else [] )
+
+        # tuple of (name, mtime, size) -> changes if any file changes
+        signature = tuple( ( name, os.stat( path ).st_mtime_ns, os.stat( path ).st_size ) if os.path.isfile( path ) else ( name, None )
+                           for name, path in paths )
+
+
+        return signature
+
+
+    def pickle_digest( self ):
+        """digest of pickle files content, without unpickling them (None if they are not on disk)"""
+
+        # pickles are not on disk (e.g. only the bundle was deployed)
+        if not all( os.path.isfile( path ) for path in self._paths().values() ):
+            return None
+
+        # hash content of every pickle
+        digest = hashlib.sha256()
+        for path in self._paths().values():
+            with open( path, 'rb' ) as file:
+                digest.update( file.read() )
+
+
+        return digest.hexdigest()[ :16 ]
+
+
+    def _use_bundle( self ):
+        """True if model bundle exists and it was built from current pickles"""
+
+        # bundle not given (or not on disk)
+        if ( self.bundle_path is None ) or not os.path.isfile( self.bundle_path ):
+            return False
+
+        # bundle built from other pickles -> pickles are loaded
+        pickle_digest = self.pickle_digest()
+        if ( pickle_digest is not None ) and ( pickle_digest != ModelBundle.read_header( self.bundle_path )['digest'] ):
+            logger.warning( 'Model bundle %s was not built from current pickles -> loading pickles', self.bundle_path )
+            return False
+
+
+        return True
+
+
+    def load( self ):
+        """(Re)load every artifact from disk and publish a new snapshot"""
+
+        with self._lock:
+            return self._load()
+
+
+    def _load( self ):
+        """load every artifact (caller holds the lock)"""
+
+        # get file signature before loading
+        signature = self._file_signature()
+
+        # time total and per-file loading
+        timings = {}
+        start = time.perf_counter()
+
+        # model bundle -> LightGBM model text and compiled plan (no unpickling)
+        if self._use_bundle():
+            timings['check'] = time.perf_counter() - start
+            bundle = ModelBundle( self.bundle_path )
+            timings['bundle'] = time.perf_counter() - start - timings['check']
+
+            # publish new snapshot (a single attribute assignment is atomic)
+            self._artifacts = Artifacts( model = bundle.model,
+                                         parameters = None,
+                                         loaded_at = time.time(),
+                                         digest = bundle.digest,
+                                         plan = bundle.plan )
+            self.source = 'bundle'
+
+        else:
+            # unpickle every artifact (and hash their content)
+            loaded = {}
+            digest = hashlib.sha256()
+            for name, path in self._paths().items():
+                file_start = time.perf_counter()
+                with open( path, 'rb' ) as file:
+                    content = file.read()
+                digest.update( content )
+                loaded[ name ] = pickle.loads( content )
+                timings[ name ] = time.perf_counter() - file_start
+
+            # split model from inputters and scalers
+            model = loaded.pop( 'model' )
+
+            # publish new snapshot (a single attribute assignment is atomic)
+            self._artifacts = Artifacts( model = model,
+                                         parameters = loaded,
+                                         loaded_at = time.time(),
+                                         digest = digest.hexdigest()[ :16 ] )
+            self.source = 'pickle'
+
+        # update bookkeeping
+        if self._signature is not None:
+            self.reloads += 1
+        self._signature = signature
+        self._last_check = time.monotonic()
+        self.load_time = time.perf_counter() - start
+        self.load_timings = timings
+        self.last_error = None
+
+
+        return self._artifacts
+
+
+    def reload_if_changed( self ):
+        """Reload artifacts if any file changed on disk since last load.
+        If reloading fails, the previous snapshot is kept."""
+
+        # check and reload under the lock -> threads that saw stale artifacts at the
+        # same time reload them once (the others find the new signature)
+        with self._lock:
+            # record check time
+            self._last_check = time.monotonic()
+
+            try:
+                # check if files changed
+                if self._file_signature() != self._signature:
+                    self._load()
+
+            # keep serving with the previous artifacts
+            except Exception as error:
+                self.last_error = repr( error )
+                logger.error( 'Artifacts could not be reloaded: %r', error )
+
+
+        return self._artifacts
+
+
+    def get( self ):
+        """Current artifacts snapshot (loaded on first call if needed)"""
+
+        # load artifacts for the first time (unless another thread did it meanwhile)
+        if self._artifacts is None:
+            with self._lock:
+                if self._artifacts is None:
+                    self._load()
+
+            return self._artifacts
+
+        # check for changed files if reloading is enabled
+        # (signature is checked again under the lock -> files are reloaded once)
+        if ( self.reload_interval is not None ) and ( time.monotonic() - self._last_check >= self.reload_interval ):
+            return self.reload_if_changed()
+
+
+        return self._artifacts
+
+
+    def is_ready( self ):
+        """True if artifacts were loaded and predictions can be made"""
+
+        return self._artifacts is not None
+
+
+    def status( self ):
+        """dictionary with registry information for health checks"""
+
+        status = {'ready': self.is_ready(),
+                  'loaded_at': self._artifacts.loaded_at if self.is_ready() else None,
+                  'digest': self._artifacts.digest if self.is_ready() else None,
+                  'source': self.source,
+                  'load_time': self.load_time,
+                  'load_timings': self.load_timings,
+                  'reloads': self.reloads,
+                  'last_error': self.last_error
+                 }
+
+
+        return status
@@ -0,0 +1,230 @@
+############## LIBRARIES ##############
+
+
+import numpy as np
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+def inputter_fill( inputter ):
+    """
+    Get fill value learned by a fitted SimpleImputer.
+
+    Args:
+        inputter: fitted SimpleImputer (one feature)
+
+    Return:
+        fill: value used to replace missing values
+    """
+
+    # only missing values represented as NaN can be filled by the plan
+    missing_values = inputter.missing_values
+    if not ( isinstance( missing_values, float ) and np.isnan( missing_values ) ):
+        raise ValueError( f'cannot compile inputter with missing_values={missing_values!r}' )
+
+    # missing indicator columns are not supported
+    if getattr( inputter, 'add_indicator', False ):
+        raise ValueError( 'cannot compile inputter with add_indicator=True' )
+
+
+    return float( inputter.statistics_[0] )
+
+
+def scaler_affine( scaler ):
+    """
+    Get affine transformation learned by a fitted scaler as
+    ( ( x * mul ) + add - sub ) / div, in the same order of
+    operations sklearn uses (so results are the same).
+
+    Args:
+        scaler: fitted MinMaxScaler, StandardScaler, RobustScaler or MaxAbsScaler (one feature)
+
+    Return:
+        mul, add, sub, div: affine parameters
+    """
+
+    # identity parameters
+    mul, add, sub, div = 1.0, 0.0, 0.0, 1.0
+
+    # MinMaxScaler -> X *= scale_; X += min_
+    if hasattr( scaler, 'min_' ):
+        if getattr( scaler, 'clip', False ):
+            raise ValueError( 'cannot compile MinMaxScaler with clip=True' )
+        mul, add = float( scaler.scale_[0] ), float( scaler.min_[0] )
+
+    # RobustScaler -> X -= center_; X /= scale_
+    elif hasattr( scaler, 'center_' ):
+        if scaler.center_ is not None:
+            sub = float( scaler.center_[0] )
+        if scaler.scale_ is not None:
+            div = float( scaler.scale_[0] )
+
+    # StandardScaler -> X -= mean_; X /= scale_
+    elif hasattr( scaler, 'mean_' ):
+        if getattr( scaler, 'with_mean', True ) and ( scaler.mean_ is not None ):
+            sub = float( scaler.mean_[0] )
+        if scaler.scale_ is not None:
+            div = float( scaler.scale_[0] )
+
+    # MaxAbsScaler -> X /= scale_
+    elif hasattr( scaler, 'max_abs_' ):
+        div = float( scaler.scale_[0] )
+
+    else:
+        raise ValueError( f'cannot compile scaler of type {type( scaler ).__name__}' )
+
+
+    return mul, add, sub, div
+
+
+class CompiledPlan:
+    """
+    Fused NumPy version of fitted inputters and scalers.
+
+    Learned parameters (fill values, scales, centers...) are read out of
+    the fitted sklearn objects once, so that all features are transformed
+    together, on a contiguous feature matrix, with a single fill step
+    followed by a single affine step (no sklearn call and validation per
+    feature).
+
+    Args:
+        columns: list of feature names, in the matrix row order
+        fill: fill value for each feature (NaN -> no missing value inputation)
+        mul, add, sub, div: affine parameters for each feature ( ( x * mul ) + add - sub ) / div
+        dtype: 'float64' (same results as sklearn) or 'float32'
+    """
+
+    def __init__( self, columns, fill, mul, add, sub, div, dtype = 'float64' ):
+
+        self.columns = list( columns )
+        self.dtype = np.dtype( dtype )
+
+        # matrix row of each feature
+        self.rows = {column: row for row, column in enumerate( self.columns )}
+
+        # parameters as column vectors -> broadcast over (features, rows) matrix
+        self.fill = np.asarray( fill, dtype = self.dtype ).reshape( -1, 1 )
+        self.mul = np.asarray( mul, dtype = self.dtype ).reshape( -1, 1 )
+        self.add = np.asarray( add, dtype = self.dtype ).reshape( -1, 1 )
+        self.sub = np.asarray( sub, dtype = self.dtype ).reshape( -1, 1 )
+        self.div = np.asarray( div, dtype = self.dtype ).reshape( -1, 1 )
+
+        # features with missing value inputation
+        self.has_fill = ~np.isnan( self.fill )
+
+        # skip steps that are identities for every feature
+        self.do_mul_add = bool( ( self.mul != 1 ).any() or ( self.add != 0 ).any() )
+        self.do_sub_div = bool( ( self.sub != 0 ).any() or ( self.div != 1 ).any() )
+
+
+    @classmethod
+    def from_parameters( cls, parameters, steps, dtype = 'float64' ):
+        """
+        Compile fitted inputters and scalers into a plan.
+
+        Args:
+            parameters: dictionary with parameter name -> fitted object (see load_parameters)
+            steps: list of ( feature, inputter name or None, scaler name or None )
+            dtype: 'float64' or 'float32'
+
+        Return:
+            plan: CompiledPlan
+        """
+
+        # lists to store parameters of each feature
+        columns, fill, mul, add, sub, div = [], [], [], [], [], []
+
+        # extract learned parameters for each feature
+        for column, inputter_name, scaler_name in steps:
+            columns.append( column )
+            fill.append( inputter_fill( parameters[ inputter_name ] ) if inputter_name else np.nan )
+            affine = scaler_affine( parameters[ scaler_name ] ) if scaler_name else ( 1.0, 0.0, 0.0, 1.0 )
+            for values, value in zip( [mul, add, sub, div], affine ):
+                values.append( value )
+
+
+        return cls( columns, fill, mul, add, sub, div, dtype = dtype )
+
+
+    def to_dict( self ):
+        """plain (JSON serializable) dictionary with plan parameters"""
+
+        plan = {'columns': self.columns,
+                'dtype': self.dtype.name,
+                'fill': [ float( value ) for value in self.fill.ravel() ],
+                'mul': [ float( value ) for value in self.mul.ravel() ],
+                'add': [ float( value ) for value in self.add.ravel() ],
+                'sub': [ float( value ) for value in self.sub.ravel() ],
+                'div': [ float( value ) for value in self.div.ravel() ]
+               }
+
+
+        return plan
+
+
+    @classmethod
+    def from_dict( cls, plan ):
+        """plan from a dictionary returned by to_dict (no sklearn object is needed)"""
+
+        return cls( plan['columns'], plan['fill'], plan['mul'], plan['add'], plan['sub'], plan['div'], dtype = plan['dtype'] )
+
+
+    def transform( self, data ):
+        """
+        Fill missing values and rescale every feature of the plan.
+
+        Args:
+            data: dataframe (or dictionary of arrays) with the plan columns
+
+        Return:
+            matrix: contiguous (features, rows) matrix -> matrix[ plan.rows[ feature ] ]
+        """
+
+        # number of rows
+        n_rows = len( data[ self.columns[0] ] )
+
+        # preallocated contiguous feature matrix
+        matrix = np.empty( ( len( self.columns ), n_rows ), dtype = self.dtype )
+        for row, column in enumerate( self.columns ):
+            matrix[ row ] = np.asarray( data[ column ], dtype = self.dtype )
+
+        # fill missing values
+        np.copyto( matrix, self.fill, where = np.isnan( matrix ) & self.has_fill )
+
+        # rescale in place
+        if self.do_mul_add:
+            matrix *= self.mul
+            matrix += self.add
+        if self.do_sub_div:
+            matrix -= self.sub
+            matrix /= self.div
+
+
+        return matrix
+
+
+    def inverse_transform( self, column, values ):
+        """
+        Reverse rescaling of a single feature.
+
+        Args:
+            column: feature name
+            values: rescaled values
+
+        Return:
+            values: values on original scale
+        """
+
+        # feature parameters
+        row = self.rows[ column ]
+
+        # reverse affine transformation (same order as sklearn)
+        values = np.array( values, dtype = self.dtype )
+        values *= self.div[ row ]
+        values += self.sub[ row ]
+        values -= self.add[ row ]
+        values /= self.mul[ row ]
+
+
+        return values
@@ -0,0 +1,124 @@
+############## LIBRARIES ##############
+
+
+import datetime
+import functools
+import numpy  as np
+import pandas as pd
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+class DateFeatureCache:
+    """
+    Date features computed once per distinct date and broadcast to rows.
+
+    Features of each date are memoized on a bounded LRU cache, so a batch
+    costs a factorize of its dates, one computation per date not on cache
+    and a gather -> it scales with the number of distinct dates.
+
+    Args:
+        cyclic_transform: function( values, column, transformation ) used for
+                          sin/cos transformations (see Rossmann.cyclic_transform)
+        maxsize: maximum number of dates kept on cache
+    """
+
+    # integer features of a date
+    INT_FEATURES = ['day_of_month', 'day_of_year', 'month', 'day_of_week']
+
+    # cyclic transformations of integer features
+    CYCLIC_FEATURES = [ f'{column}_{transformation}' for column in INT_FEATURES
+                                                     for transformation in ['sin', 'cos'] ]
+
+
+    def __init__( self, cyclic_transform, maxsize = 4096 ):
+
+        self.cyclic_transform = cyclic_transform
+        self.maxsize = maxsize
+
+        # LRU cache for the features of a single date (one per instance)
+        self._date_features = functools.lru_cache( maxsize = maxsize )( self._compute_date_features )
+
+
+    def _compute_date_features( self, day ):
+        """
+        Compute features of a single date.
+
+        Args:
+            day: date as number of days since 1970-01-01
+
+        Return:
+            int_features, cyclic_features: tuples ordered as INT_FEATURES and CYCLIC_FEATURES
+        """
+
+        # get date
+        date = datetime.date( 1970, 1, 1 ) + datetime.timedelta( days = int( day ) )
+
+        # day of month, day of year, month and day of week (sunday = 0)
+        int_features = ( date.day,
+                         date.timetuple().tm_yday,
+                         date.month,
+                         date.isoweekday() % 7 )
+
+        # sin and cos transformations
+        cyclic_features = tuple( self.cyclic_transform( np.array( [ value ] ), column, transformation )[0]
+                                 for column, value in zip( self.INT_FEATURES, int_features )
+                                 for transformation in ['sin', 'cos'] )
+
+
+        return int_features, cyclic_features
+
+
+    def lookup( self, dates, int_dtype = 'int64', cast = None ):
+        """
+        Get date features for each row.
+
+        Args:
+            dates: datetime array (or series) with the date of each row
+            int_dtype: dtype of INT_FEATURES (e.g. 'int16' -> Rossmann compact mode)
+            cast: optional function( feature, values ) applied to CYCLIC_FEATURES of
+                  distinct dates before they are broadcast to rows (e.g. float32
+                  rounding -> Rossmann compact mode)
+
+        Return:
+            features: dictionary with feature -> array, for INT_FEATURES and CYCLIC_FEATURES
+        """
+
+        # code of each row and distinct dates
+        codes, uniques = pd.factorize( pd.DatetimeIndex( dates ), sort = False )
+
+        # dates are required
+        if ( codes < 0 ).any():
+            raise ValueError( 'date is missing on some rows' )
+
+        # features of distinct dates (from cache or computed)
+        days = np.asarray( uniques.values.astype( 'datetime64[D]' ).astype( 'int64' ) )
+        # -> (features, dates) blocks so that each feature is contiguous after gather
+        int_block = np.empty( ( len( self.INT_FEATURES ), days.size ), dtype = int_dtype )
+        cyclic_block = np.empty( ( len( self.CYCLIC_FEATURES ), days.size ), dtype = 'float64' )
+        for position, day in enumerate( days ):
+            int_block[ :, position ], cyclic_block[ :, position ] = self._date_features( day )
+        # rounded features (e.g. float32) -> rounded once per date
+        if cast is not None:
+            cyclic_block = np.stack( [ cast( column, values ) for column, values in zip( self.CYCLIC_FEATURES, cyclic_block ) ] )
+
+        # broadcast distinct dates features to rows
+        int_rows = int_block[ :, codes ]
+        cyclic_rows = cyclic_block[ :, codes ]
+
+        # dictionary with features
+        features = dict( zip( self.INT_FEATURES, int_rows ) )
+        features.update( zip( self.CYCLIC_FEATURES, cyclic_rows ) )
+
+
+        return features
+
+
+    def info( self ):
+        """dictionary with cache hits, misses and size"""
+
+        info = self._date_features.cache_info()
+
+
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
@@ -0,0 +1,239 @@
+############## LIBRARIES ##############
+
+
+import json
+import os
+import time
+import numpy  as np
+import pandas as pd
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: a forecast store is a folder with
+#   daily.npy  -> (stores, days) float32 predictions (NaN -> no prediction, e.g. closed store)
+#   totals.npy -> (stores,) float64 sum of daily predictions (NaN -> store not on forecast)
+#   meta.json  -> first date, number of days, artifacts digest, creation (and patch) time
+# row of each store is its store id, so a lookup is just an array index.
+
+
+class ForecastStore:
+    """
+    Read-only, memory-mapped daily forecasts and totals of every store.
+
+    Args:
+        path: forecast store folder (see ForecastStore.write)
+    """
+
+    def __init__( self, path ):
+
+        self.path = path
+        self._signature = None
+        self.refresh()
+
+
+    def _meta_signature( self ):
+        """modification time of meta.json (written last by ForecastStore.write)"""
+
+        return os.stat( os.path.join( self.path, 'meta.json' ) ).st_mtime_ns
+
+
+    def refresh( self ):
+        """(Re)open forecast files if they were written again since last open"""
+
+        # check if forecast was written again
+        signature = self._meta_signature()
+        if signature == self._signature:
+            return self
+
+        # read metadata
+        with open( os.path.join( self.path, 'meta.json' ) ) as file:
+            meta = json.load( file )
+
+        # memory map arrays -> only accessed pages are read from disk
+        daily = np.load( os.path.join( self.path, 'daily.npy' ), mmap_mode = 'r' )
+        totals = np.load( os.path.join( self.path, 'totals.npy' ), mmap_mode = 'r' )
+
+        # forecast dates
+        dates = pd.date_range( meta['start_date'], periods = meta['n_days'], freq = 'D' ).strftime( '%Y-%m-%d' ).tolist()
+
+        # publish (a single attribute assignment is atomic)
+        self._tables = ( meta, dates, daily, totals )
+        self._signature = signature
+
+
+        return self
+
+
+    @property
+    def meta( self ):
+        """forecast metadata"""
+
+        return self._tables[0]
+
+
+    def __contains__( self, store_id ):
+        """True if store_id has a forecast"""
+
+        totals = self._tables[3]
+
+
+        return 0 <= store_id < totals.size and not np.isnan( totals[ store_id ] )
+
+
+    def total( self, store_id ):
+        """sum of daily predictions of the given store (None if store has no forecast)"""
+
+        # store has no forecast
+        if store_id not in self:
+            return None
+
+
+        return float( self._tables[3][ store_id ] )
+
+
+    def daily( self, store_id ):
+        """
+        Daily predictions of the given store.
+
+        Args:
+            store_id: store number
+
+        Return:
+            records: list of {'date', 'predicted_sales'} (None if store has no forecast)
+        """
+
+        # store has no forecast
+        if store_id not in self:
+            return None
+
+        # forecast tables
+        _, dates, daily, _ = self._tables
+
+        # days with prediction
+        values = daily[ store_id ]
+        records = [ {'date': date, 'predicted_sales': float( value )} for date, value in zip( dates, values ) if not np.isnan( value ) ]
+
+
+        return records
+
+
+    @staticmethod
+    def write( path, df_forecast, digest = None ):
+        """
+        Write daily predictions as a forecast store.
+
+        Args:
+            path: forecast store folder
+            df_forecast: dataframe with store, date and predicted_sales columns.
+                         Stores without predicted_sales (e.g. always closed) can
+                         be given with NaN predicted_sales so they still have a total
+            digest: optional artifacts digest (see ArtifactRegistry)
+
+        Return:
+            None
+        """
+
+        # create folder
+        os.makedirs( path, exist_ok = True )
+
+        # store and day of each prediction
+        store_ids = df_forecast['store'].values.astype( 'int64' )
+        dates = pd.to_datetime( df_forecast['date'] ).values.astype( 'datetime64[D]' )
+        start_date = dates.min()
+        days = ( dates - start_date ).astype( 'int64' )
+        n_days = int( days.max() ) + 1
+
+        # dense (stores, days) matrix
+        daily = np.full( ( store_ids.max() + 1, n_days ), np.nan, dtype = 'float32' )
+        daily[ store_ids, days ] = df_forecast['predicted_sales'].values
+
+        # six weeks totals (NaN for stores that are not on forecast)
+        totals = np.full( store_ids.max() + 1, np.nan )
+        on_forecast = np.unique( store_ids )
+        predicted = np.nan_to_num( df_forecast['predicted_sales'].values.astype( 'float64' ) )
+        totals[ on_forecast ] = np.bincount( store_ids, weights = predicted, minlength = totals.size )[ on_forecast ]
+
+        # write arrays on temporary files and move them -> readers never see half-written files
+        for name, array in [ ('daily', daily), ('totals', totals) ]:
+            np.save( os.path.join( path, f'{name}.tmp.npy' ), array )
+            os.replace( os.path.join( path, f'{name}.tmp.npy' ), os.path.join( path, f'{name}.npy' ) )
+
+        # metadata is written last (readers refresh when it changes)
+        meta = {'start_date': str( start_date ),
+                'n_days': n_days,
+                'n_stores': int( on_forecast.size ),
+                'digest': digest,
+                'created_at': time.time()
+               }
+        with open( os.path.join( path, 'meta.tmp.json' ), 'w' ) as file:
+            json.dump( meta, file )
+        os.replace( os.path.join( path, 'meta.tmp.json' ), os.path.join( path, 'meta.json' ) )
+
+
+        return None
+
+
+    @staticmethod
+    def patch( path, df_forecast, digest = None ):
+        """
+        Update daily predictions of a forecast store in place (only the
+        given rows and the totals of their stores are written).
+
+        Readers see patched values as soon as they are written (arrays are
+        memory mapped) and reopen the forecast when meta.json is written.
+
+        Args:
+            path: forecast store folder (see ForecastStore.write)
+            df_forecast: dataframe with store, date and predicted_sales columns
+                         of the rows to be updated (NaN predicted_sales -> no
+                         prediction). Stores left without any prediction are
+                         not on forecast anymore
+            digest: optional artifacts digest (see ArtifactRegistry)
+
+        Return:
+            patched: False if some rows are out of the forecast range (store
+                     ids above the largest one or dates out of the forecast
+                     days) -> nothing is written and forecast must be written again
+        """
+
+        # read metadata
+        with open( os.path.join( path, 'meta.json' ) ) as file:
+            meta = json.load( file )
+
+        # writable memory maps
+        daily = np.load( os.path.join( path, 'daily.npy' ), mmap_mode = 'r+' )
+        totals = np.load( os.path.join( path, 'totals.npy' ), mmap_mode = 'r+' )
+
+        # store and day of each prediction
+        store_ids = df_forecast['store'].values.astype( 'int64' )
+        dates = pd.to_datetime( df_forecast['date'] ).values.astype( 'datetime64[D]' )
+        days = ( dates - np.datetime64( meta['start_date'], 'D' ) ).astype( 'int64' )
+
+        # rows out of forecast range
+        if ( ( store_ids < 0 ) | ( store_ids >= daily.shape[0] ) | ( days < 0 ) | ( days >= daily.shape[1] ) ).any():
+            return False
+
+        # daily predictions
+        daily[ store_ids, days ] = df_forecast['predicted_sales'].values
+
+        # totals of patched stores (NaN -> store has no prediction left)
+        patched = np.unique( store_ids )
+        values = daily[ patched ].astype( 'float64' )
+        totals[ patched ] = np.where( np.isnan( values ).all( axis = 1 ), np.nan, np.nansum( values, axis = 1 ) )
+
+        # write changed pages to disk
+        daily.flush()
+        totals.flush()
+
+        # metadata is written last (readers refresh when it changes)
+        meta.update( {'n_stores': int( ( ~np.isnan( totals ) ).sum() ),
+                      'digest': digest if digest is not None else meta.get( 'digest' ),
+                      'updated_at': time.time()} )
+        with open( os.path.join( path, 'meta.tmp.json' ), 'w' ) as file:
+            json.dump( meta, file )
+        os.replace( os.path.join( path, 'meta.tmp.json' ), os.path.join( path, 'meta.json' ) )
+
+
+        return True
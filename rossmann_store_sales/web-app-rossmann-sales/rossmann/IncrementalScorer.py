@@ -0,0 +1,272 @@
+############## LIBRARIES ##############
+
+
+import json
+import os
+import time
+import numpy                  as np
+import pandas                 as pd
+from   rossmann.Rossmann      import snake_case
+from   rossmann.ForecastStore import ForecastStore
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: the test.csv and store.csv rows a forecast store was scored from
+# are kept on its folder (snapshot.npz) as a 64-bit hash of each row:
+#   store_ids, store_hashes          -> store.csv row of each store
+#   row_stores, row_days, row_hashes -> test.csv row of each ( store, day )
+# only columns that change a prediction are hashed (see PredictionCache.KEY_COLUMNS),
+# so new snapshots can be compared without keeping the former files.
+
+
+# test.csv columns that change a prediction (row key -> store and date)
+TEST_KEY_COLUMNS = [ 'day_of_week', 'open' ]
+
+# store.csv columns that change a prediction (row key -> store)
+STORE_KEY_COLUMNS = [ 'store_type',
+                      'assortment',
+                      'competition_distance',
+                      'competition_open_since_month',
+                      'competition_open_since_year',
+                      'promo2_since_week',
+                      'promo2_since_year' ]
+
+
+def hash_rows( df_data, columns ):
+    """
+    64-bit hash of each row, on the given columns.
+
+    Args:
+        df_data: dataframe with snake case columns
+        columns: columns to be hashed (missing columns are hashed as NaN)
+
+    Return:
+        hashes: uint64 array
+    """
+
+    # normalized columns -> same hash for 1 and 1.0, strings and categories...
+    normalized = {}
+    for column in columns:
+        if column not in df_data.columns:
+            normalized[ column ] = np.full( df_data.shape[0], np.nan )
+        elif column in ['store_type', 'assortment']:
+            normalized[ column ] = df_data[ column ].astype( 'str' ).values
+        else:
+            normalized[ column ] = pd.to_numeric( df_data[ column ] ).values.astype( 'float64' )
+
+
+    return pd.util.hash_pandas_object( pd.DataFrame( normalized ), index = False ).values
+
+
+def take_snapshot( df_test, df_store ):
+    """
+    Snapshot of test.csv and store.csv rows.
+
+    Args:
+        df_test: test.csv rows (Pascal or snake case columns)
+        df_store: store.csv rows (Pascal or snake case columns)
+
+    Return:
+        snapshot: dictionary with snapshot arrays (see NOTE)
+    """
+
+    # snake case columns (without changing given data)
+    df_test = df_test.set_axis( snake_case( df_test.columns ), axis = 'columns' )
+    df_store = df_store.set_axis( snake_case( df_store.columns ), axis = 'columns' )
+
+    # day of each test row (days since 1970-01-01)
+    days = pd.to_datetime( df_test['date'] ).values.astype( 'datetime64[D]' ).astype( 'int64' )
+
+    snapshot = {'store_ids': df_store['store'].values.astype( 'int64' ),
+                'store_hashes': hash_rows( df_store, STORE_KEY_COLUMNS ),
+                'row_stores': df_test['store'].values.astype( 'int64' ),
+                'row_days': days,
+                'row_hashes': hash_rows( df_test, TEST_KEY_COLUMNS )
+               }
+
+
+    return snapshot
+
+
+def read_snapshot( path ):
+    """snapshot of a forecast store folder (None if it has no snapshot)"""
+
+    snapshot_path = os.path.join( path, 'snapshot.npz' )
+    if not os.path.isfile( snapshot_path ):
+        return None
+
+    with np.load( snapshot_path ) as arrays:
+        snapshot = { name: arrays[ name ] for name in arrays.files }
+
+
+    return snapshot
+
+
+def write_snapshot( path, snapshot ):
+    """write snapshot on a forecast store folder (temporary file moved -> never half-written)"""
+
+    temporary_path = os.path.join( path, 'snapshot.tmp.npz' )
+    np.savez( temporary_path, **snapshot )
+    os.replace( temporary_path, os.path.join( path, 'snapshot.npz' ) )
+
+
+    return None
+
+
+def diff_snapshots( former, current ):
+    """
+    Rows of current snapshot whose prediction may have changed.
+
+    Args:
+        former: snapshot the forecast was scored from
+        current: snapshot of new test.csv and store.csv
+
+    Return:
+        rescore: boolean array -> current test rows to be scored again
+                 (new or changed rows and every row of a changed store)
+        df_removed: dataframe with store and day of former rows that are not on current snapshot
+        changed_stores: array with ids of new, changed or removed stores
+    """
+
+    # stores -> former and current hash of each store id
+    df_stores = pd.merge( pd.DataFrame( {'store': former['store_ids'], 'former': former['store_hashes']} ),
+                          pd.DataFrame( {'store': current['store_ids'], 'current': current['store_hashes']} ),
+                          how = 'outer', on = 'store' )
+    changed_stores = df_stores.loc[ df_stores['former'] != df_stores['current'], 'store' ].values
+
+    # test rows -> former hash of each current row (NaN -> new row)
+    # (one row per store and day, as on test.csv -> merge keeps current rows and their order)
+    df_former = pd.DataFrame( {'store': former['row_stores'], 'day': former['row_days'], 'former': former['row_hashes']} ).drop_duplicates( ['store', 'day'] )
+    df_current = pd.DataFrame( {'store': current['row_stores'], 'day': current['row_days'], 'current': current['row_hashes']} )
+    df_rows = pd.merge( df_current, df_former, how = 'left', on = ['store', 'day'] )
+
+    # new or changed rows, and rows of changed stores
+    rescore = ( df_rows['former'] != df_rows['current'] ).values | np.isin( df_rows['store'].values, changed_stores )
+
+    # former rows that are gone
+    df_removed = pd.merge( df_former, df_current, how = 'left', on = ['store', 'day'] )
+    df_removed = df_removed.loc[ df_removed['current'].isna(), ['store', 'day'] ].reset_index( drop = True )
+
+
+    return rescore, df_removed, changed_stores
+
+
+class IncrementalScorer:
+    """
+    Keep a forecast store (see ForecastStore) up to date with new test.csv
+    and store.csv snapshots, scoring again only the rows that changed since
+    the forecast was scored (and every row of a store whose store.csv row
+    changed). Rescored rows are patched in place, so the cost depends on
+    the amount of change instead of the size of the data.
+
+    The whole forecast is scored again when there is no former snapshot,
+    when the model changed (artifacts digest) or when new rows are out of
+    the forecast range (new stores above the largest id or new dates).
+
+    Args:
+        pipeline: Rossmann instance
+        ml_model: model trained (or inference engine)
+        digest: artifacts digest (see ArtifactRegistry)
+    """
+
+    def __init__( self, pipeline, ml_model, digest = None ):
+
+        self.pipeline = pipeline
+        self.ml_model = ml_model
+        self.digest = digest
+
+
+    def score( self, df_test, df_store ):
+        """
+        Predict daily sales of test rows.
+
+        Args:
+            df_test: test.csv rows
+            df_store: store.csv rows
+
+        Return:
+            df_forecast: dataframe with store, date and predicted_sales
+                         (0 on days a store is closed)
+        """
+
+        # test dataset + store suplementary info
+        df_raw = pd.merge( df_test, df_store, how = 'left', on = 'Store' )
+
+        # no rows -> nothing to score
+        if df_raw.empty:
+            return pd.DataFrame( {'store': np.empty( 0, dtype = 'int64' ), 'date': np.empty( 0, dtype = 'datetime64[ns]' ), 'predicted_sales': np.empty( 0 )} )
+
+        # clean, engineer, filter, prepare data and make prediction
+        df_predicted = self.pipeline.run_pipeline( self.ml_model, df_raw )
+
+
+        return df_predicted[ ['store', 'date', 'predicted_sales'] ].reset_index( drop = True )
+
+
+    def rescore( self, path, df_test, df_store, full = False ):
+        """
+        Update the forecast store with new test.csv and store.csv rows.
+
+        Args:
+            path: forecast store folder (written if it does not exist)
+            df_test: new test.csv rows (Pascal case columns)
+            df_store: new store.csv rows (Pascal case columns)
+            full: True -> score every row again
+
+        Return:
+            report: dictionary with mode ('full' or 'incremental'), rows scored,
+                    rows removed, changed stores and seconds
+        """
+
+        start = time.perf_counter()
+
+        current = take_snapshot( df_test, df_store )
+        former = read_snapshot( path ) if not full else None
+
+        # forecast metadata (None -> forecast was not written yet)
+        meta_path = os.path.join( path, 'meta.json' )
+        meta = None
+        if os.path.isfile( meta_path ):
+            with open( meta_path ) as file:
+                meta = json.load( file )
+
+        # incremental update -> former snapshot of the same model
+        if ( former is not None ) and ( meta is not None ) and ( meta.get( 'digest' ) == self.digest ):
+            rescore, df_removed, changed_stores = diff_snapshots( former, current )
+
+            # predictions of changed rows, and no prediction for removed rows
+            df_forecast = self.score( df_test[ rescore ], df_store )
+            df_gone = pd.DataFrame( {'store': df_removed['store'].values,
+                                     'date': df_removed['day'].values.astype( 'datetime64[D]' ),
+                                     'predicted_sales': np.nan} )
+            df_patch = pd.concat( [ df_forecast, df_gone ], ignore_index = True )
+
+            # patch forecast in place (not possible -> new stores or dates out of range)
+            if df_patch.empty or ForecastStore.patch( path, df_patch, digest = self.digest ):
+                write_snapshot( path, current )
+
+                report = {'mode': 'incremental',
+                          'rows_scored': int( rescore.sum() ),
+                          'rows_removed': int( df_removed.shape[0] ),
+                          'changed_stores': int( changed_stores.size ),
+                          'seconds': time.perf_counter() - start
+                         }
+
+                return report
+
+        # score every row and write the forecast again
+        df_forecast = self.score( df_test, df_store )
+        ForecastStore.write( path, df_forecast, digest = self.digest )
+        write_snapshot( path, current )
+
+        report = {'mode': 'full',
+                  'rows_scored': int( df_test.shape[0] ),
+                  'rows_removed': 0,
+                  'changed_stores': int( np.unique( current['store_ids'] ).size ),
+                  'seconds': time.perf_counter() - start
+                 }
+
+
+        return report
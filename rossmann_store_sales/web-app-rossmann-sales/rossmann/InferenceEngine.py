@@ -0,0 +1,276 @@
+############## LIBRARIES ##############
+
+
+import hashlib
+import os
+import numpy  as np
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: an engine is a drop-in replacement for the trained model on
+# Rossmann.make_prediction -> engine.predict( prepared_data, num_threads = ... )
+# returns the same (log scale) predictions as ml_model.predict( prepared_data )
+
+
+def import_tl2cgen():
+    """import treelite and tl2cgen only when the compiled engine is required"""
+
+    try:
+        import treelite
+        import tl2cgen
+
+    except ImportError:
+        raise ImportError( "treelite and tl2cgen are required for the 'compiled' inference engine" )
+
+
+    return treelite, tl2cgen
+
+
+def get_booster( ml_model ):
+    """raw lightgbm.Booster of a trained model (LGBMRegressor or Booster)"""
+
+    return ml_model.booster_ if hasattr( ml_model, 'booster_' ) else ml_model
+
+
+def split_thresholds( ml_model, feature_names ):
+    """
+    Thresholds of every numerical split of the model trees, by feature.
+
+    Args:
+        ml_model: model trained (LGBMRegressor or Booster)
+        feature_names: feature of each model column (e.g. Rossmann.COLS_SELECTED)
+
+    Return:
+        thresholds: dictionary with feature -> sorted array of distinct thresholds
+    """
+
+    # every split node of every tree
+    thresholds = [ [] for _ in feature_names ]
+    nodes = [ tree['tree_structure'] for tree in get_booster( ml_model ).dump_model()['tree_info'] ]
+    while nodes:
+        node = nodes.pop()
+        if 'split_feature' not in node:
+            continue
+        if node['decision_type'] == '<=':
+            thresholds[ node['split_feature'] ].append( node['threshold'] )
+        nodes += [ node['left_child'], node['right_child'] ]
+
+
+    return { name: np.unique( np.array( values, dtype = 'float64' ) ) for name, values in zip( feature_names, thresholds ) }
+
+
+def to_float32( values, thresholds = None ):
+    """
+    Round float64 feature values to float32, keeping the branch they take
+    on every split of the model (value <= threshold -> left child).
+
+    Nearest float32 values that cross a threshold are moved one step back,
+    to the float32 value on the other side of the float64 value, so that
+    float32 values give the same predictions as float64 ones.
+
+    Args:
+        values: float64 array
+        thresholds: sorted split thresholds of the feature (see split_thresholds).
+                    None -> values are just rounded to nearest
+
+    Return:
+        single: float32 array
+    """
+
+    values = np.asarray( values )
+    single = values.astype( 'float32', copy = False )
+
+    # no split on feature (or already float32 values)
+    if ( thresholds is None ) or ( thresholds.size == 0 ) or ( values.dtype == np.float32 ):
+        return single
+
+    # only values changed by rounding can cross a threshold
+    # (e.g. whole numbers and discretized features are kept)
+    inexact = np.flatnonzero( single != values )
+
+    # thresholds around each value (thresholds[ side - 1 ] < value <= thresholds[ side ])
+    # -> rounded values out of them crossed a threshold
+    side = np.searchsorted( thresholds, values[ inexact ], side = 'left' )
+    bounds = np.concatenate( [ [ -np.inf ], thresholds, [ np.inf ] ] )
+    rounded = single[ inexact ]
+    crossed = inexact[ ( rounded <= bounds[ side ] ) | ( rounded > bounds[ side + 1 ] ) ]
+
+    # one float32 step towards the float64 value
+    if crossed.size:
+        towards = np.where( single[ crossed ] > values[ crossed ], -np.inf, np.inf ).astype( 'float32' )
+        single[ crossed ] = np.nextafter( single[ crossed ], towards )
+
+
+    return single
+
+
+class SklearnEngine:
+    """
+    Reference engine -> prediction through the sklearn wrapper of the model.
+
+    Args:
+        ml_model: model trained
+    """
+
+    name = 'sklearn'
+
+    def __init__( self, ml_model ):
+
+        self.ml_model = ml_model
+
+
+    def predict( self, data, num_threads = None ):
+        """log scale predictions of prepared data (num_threads -> LightGBM threads)"""
+
+        # number of threads is a predict argument
+        predict_params = {'num_threads': num_threads} if num_threads else {}
+
+
+        return self.ml_model.predict( data, **predict_params )
+
+
+class BoosterEngine:
+    """
+    Prediction with the raw lightgbm.Booster on a contiguous NumPy matrix,
+    skipping the DataFrame checks and conversions of the sklearn wrapper.
+
+    Args:
+        ml_model: model trained (LGBMRegressor or Booster)
+        dtype: matrix dtype. float64 gives the same predictions as the
+               sklearn wrapper. float32 is cheaper to build but values that
+               round across a split threshold change predictions
+    """
+
+    name = 'booster'
+
+    def __init__( self, ml_model, dtype = 'float64' ):
+
+        self.booster = get_booster( ml_model )
+        self.dtype = np.dtype( dtype )
+
+
+    def predict( self, data, num_threads = None ):
+        """log scale predictions of prepared data (num_threads -> LightGBM threads)"""
+
+        # C-contiguous matrix -> passed to LightGBM without copies
+        matrix = np.ascontiguousarray( data, dtype = self.dtype )
+
+        # number of threads is a predict argument
+        predict_params = {'num_threads': num_threads} if num_threads else {}
+
+
+        return self.booster.predict( matrix, **predict_params )
+
+
+class CompiledEngine:
+    """
+    Prediction with the trees compiled to a shared library (treelite + tl2cgen).
+
+    Compiled code reads a feature as missing when the low 32 bits of its
+    value are all ones (feature values share memory with an int flag),
+    and missing values follow the default child instead of LightGBM rules.
+    Rows with such values (or NaN) are predicted by the Booster instead,
+    so predictions are the same as the sklearn wrapper ones.
+
+    Args:
+        ml_model: model trained (LGBMRegressor or Booster)
+        library_path: compiled model (.so). It is compiled if it does not exist.
+                      None -> ./model/compiled/model_<hash of model trees>.so
+        num_threads: threads of the compiled predictor (None -> one per core)
+    """
+
+    name = 'compiled'
+
+    def __init__( self, ml_model, library_path = None, num_threads = None ):
+
+        _, tl2cgen = import_tl2cgen()
+
+        self.booster = get_booster( ml_model )
+
+        # library named after model content -> a new model is never predicted by an old library
+        if library_path is None:
+            digest = hashlib.sha256( self.booster.model_to_string().encode() ).hexdigest()[ :16 ]
+            library_path = os.path.join( '.', 'model', 'compiled', f'model_{digest}.so' )
+        self.library_path = library_path
+
+        # compile trees (only once, library is reused by every process)
+        if not os.path.isfile( library_path ):
+            self.compile( self.booster, library_path )
+
+        # load compiled model
+        self.predictor = tl2cgen.Predictor( library_path, nthread = num_threads )
+
+
+    @staticmethod
+    def compile( ml_model, library_path ):
+        """compile trees of the model into a shared library"""
+
+        treelite, tl2cgen = import_tl2cgen()
+
+        # create folder
+        os.makedirs( os.path.dirname( os.path.abspath( library_path ) ), exist_ok = True )
+
+        # trees -> C code -> shared library (written on a temporary file, so
+        # other processes never load a half-written library)
+        model = treelite.frontend.from_lightgbm( get_booster( ml_model ) )
+        temporary_path = f'{library_path}.{os.getpid()}.tmp.so'
+        tl2cgen.export_lib( model, toolchain = 'gcc', libpath = temporary_path,
+                            params = {'parallel_comp': os.cpu_count() or 1} )
+        os.replace( temporary_path, library_path )
+
+
+        return library_path
+
+
+    def predict( self, data, num_threads = None ):
+        """log scale predictions of prepared data (threads are set on constructor)"""
+
+        _, tl2cgen = import_tl2cgen()
+
+        matrix = np.ascontiguousarray( data, dtype = 'float64' )
+
+        # rows that compiled code would read as missing values
+        fallback = ( ( matrix.view( 'uint64' ) & np.uint64( 0xFFFFFFFF ) ) == 0xFFFFFFFF ).any( axis = 1 ) | np.isnan( matrix ).any( axis = 1 )
+
+        # compiled predictions
+        prediction = np.empty( matrix.shape[0] )
+        if not fallback.all():
+            prediction[ ~fallback ] = self.predictor.predict( tl2cgen.DMatrix( matrix[ ~fallback ], dtype = 'float64' ) ).reshape( -1 )
+
+        # booster predictions
+        if fallback.any():
+            predict_params = {'num_threads': num_threads} if num_threads else {}
+            prediction[ fallback ] = self.booster.predict( matrix[ fallback ], **predict_params )
+
+
+        return prediction
+
+
+# engine name -> engine class
+ENGINES = {'sklearn': SklearnEngine,
+           'booster': BoosterEngine,
+           'compiled': CompiledEngine
+          }
+
+
+def make_engine( ml_model, name = 'sklearn', **kwargs ):
+    """
+    Create an inference engine for the trained model.
+
+    Args:
+        ml_model: model trained
+        name: 'sklearn', 'booster' or 'compiled'
+        kwargs: engine arguments (e.g. dtype, library_path)
+
+    Return:
+        engine: object with predict( data, num_threads = None )
+    """
+
+    # check engine name
+    if name not in ENGINES:
+        raise ValueError( f"inference engine must be one of {sorted( ENGINES )}, not {name!r}" )
+
+
+    return ENGINES[ name ]( ml_model, **kwargs )
@@ -0,0 +1,244 @@
+############## LIBRARIES ##############
+
+
+import bisect
+import os
+import sys
+import threading
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: prometheus_client is used if it is installed (and, with
+# PROMETHEUS_MULTIPROC_DIR set, metrics of every server worker are
+# aggregated). Otherwise the same metrics are kept by Histogram below
+# and written on Prometheus text format for the process answering /metrics.
+
+
+# request and pipeline step latency buckets (seconds)
+LATENCY_BUCKETS = ( 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+
+# rows of a request buckets
+ROWS_BUCKETS = ( 1, 10, 100, 1000, 10000, 100000, 1000000 )
+
+# prometheus text format content type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def import_prometheus_client():
+    """import prometheus_client if it is installed (None -> built-in metrics are used)"""
+
+    try:
+        import prometheus_client
+
+    except ImportError:
+        return None
+
+
+    return prometheus_client
+
+
+def resident_memory():
+    """resident memory of the process, in bytes (peak resident memory if current one can't be read)"""
+
+    # current resident pages (linux)
+    try:
+        with open( '/proc/self/statm' ) as file:
+            return int( file.read().split()[1] ) * os.sysconf( 'SC_PAGE_SIZE' )
+
+    except ( OSError, ValueError ):
+        import resource
+
+    # peak resident memory (kilobytes on linux, bytes on macOS)
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def format_labels( labelnames, labels, extra = '' ):
+    """prometheus label set, e.g. {endpoint="/rossmann/predict",le="0.1"}"""
+
+    pairs = [ f'{name}="{value}"' for name, value in zip( labelnames, labels ) ]
+    if extra:
+        pairs.append( extra )
+
+
+    return '{' + ','.join( pairs ) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels, kept in process (used when
+    prometheus_client is not installed).
+
+    Args:
+        name: metric name
+        documentation: metric help text
+        labelnames: list of label names
+        buckets: upper bounds of buckets (+Inf is added)
+    """
+
+    def __init__( self, name, documentation, labelnames, buckets ):
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = list( buckets ) + [ float( 'inf' ) ]
+
+        # labels -> [ bucket counts, sum ]
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def observe( self, labels, value ):
+        """add a value to the histogram of the given labels (tuple)"""
+
+        with self._lock:
+            counts_and_sum = self._values.setdefault( labels, [ [ 0 ] * len( self.buckets ), 0.0 ] )
+            counts_and_sum[0][ bisect.bisect_left( self.buckets, value ) ] += 1
+            counts_and_sum[1] += value
+
+
+    def render( self ):
+        """lines of the histogram on prometheus text format"""
+
+        lines = [ f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram' ]
+
+        with self._lock:
+            for labels, ( counts, total ) in sorted( self._values.items() ):
+                # cumulative bucket counts
+                cumulative = 0
+                for bound, count in zip( self.buckets, counts ):
+                    cumulative += count
+                    le = 'le="{}"'.format( '+Inf' if bound == float( 'inf' ) else repr( float( bound ) ) )
+                    lines.append( f'{self.name}_bucket{format_labels( self.labelnames, labels, le )} {cumulative}' )
+
+                lines.append( f'{self.name}_sum{format_labels( self.labelnames, labels )} {total}' )
+                lines.append( f'{self.name}_count{format_labels( self.labelnames, labels )} {cumulative}' )
+
+
+        return lines
+
+
+class Metrics:
+    """
+    Metrics of the prediction API, served on prometheus text format.
+
+    Args:
+        prefix: prefix of metric names
+    """
+
+    def __init__( self, prefix = 'rossmann' ):
+
+        self.prefix = prefix
+
+        # functions called on each scrape -> list of ( name, type, documentation, value )
+        # (e.g. prediction cache counters). They are computed by the process answering
+        # the scrape, so are not aggregated over server workers
+        self.callbacks = [ lambda: [ ( 'resident_memory_bytes', 'gauge', 'Resident memory of the process answering /metrics', resident_memory() ) ] ]
+
+        # histograms: name -> ( documentation, label names, buckets )
+        histograms = {'request_duration_seconds': ( 'Seconds to answer a request (until the first byte, for streams)', [ 'endpoint', 'method', 'status' ], LATENCY_BUCKETS ),
+                      'stage_duration_seconds': ( 'Seconds of each pipeline step (make_prediction -> model inference)', [ 'stage' ], LATENCY_BUCKETS ),
+                      'request_rows': ( 'Rows scored by a request (each chunk, for streams)', [ 'endpoint' ], ROWS_BUCKETS ) }
+
+        self.prometheus = import_prometheus_client()
+
+        # prometheus_client metrics (on their own registry)
+        if self.prometheus is not None:
+            self.registry = self.prometheus.CollectorRegistry()
+            self.histograms = { name: self.prometheus.Histogram( f'{prefix}_{name}', documentation, labelnames, buckets = buckets, registry = self.registry )
+                                for name, ( documentation, labelnames, buckets ) in histograms.items() }
+
+        # built-in metrics
+        else:
+            self.histograms = { name: Histogram( f'{prefix}_{name}', documentation, labelnames, buckets )
+                                for name, ( documentation, labelnames, buckets ) in histograms.items() }
+
+
+    def observe( self, name, labels, value ):
+        """add a value to a histogram (labels -> tuple of label values)"""
+
+        histogram = self.histograms[ name ]
+
+        if self.prometheus is not None:
+            histogram.labels( *labels ).observe( value )
+        else:
+            histogram.observe( tuple( str( label ) for label in labels ), value )
+
+
+    def observe_request( self, endpoint, method, status, seconds ):
+        """request latency"""
+
+        self.observe( 'request_duration_seconds', ( endpoint, method, status ), seconds )
+
+
+    def observe_stage( self, stage, seconds ):
+        """pipeline step latency (see Rossmann.run_pipeline)"""
+
+        self.observe( 'stage_duration_seconds', ( stage, ), seconds )
+
+
+    def observe_rows( self, endpoint, n_rows ):
+        """rows scored by a request"""
+
+        self.observe( 'request_rows', ( endpoint, ), n_rows )
+
+
+    def add_callback( self, callback ):
+        """add a function called on each scrape, that returns a list of ( name, type, documentation, value )"""
+
+        self.callbacks.append( callback )
+
+
+    def callback_lines( self ):
+        """lines of callback metrics on prometheus text format"""
+
+        lines = []
+        for callback in self.callbacks:
+            for name, kind, documentation, value in callback():
+                if value is None:
+                    continue
+                lines += [ f'# HELP {self.prefix}_{name} {documentation}',
+                           f'# TYPE {self.prefix}_{name} {kind}',
+                           f'{self.prefix}_{name} {value}' ]
+
+
+        return lines
+
+
+    def render( self ):
+        """
+        Metrics on prometheus text format.
+
+        Return:
+            body, content_type
+        """
+
+        # prometheus_client metrics
+        if self.prometheus is not None:
+            # every worker (metrics written on PROMETHEUS_MULTIPROC_DIR) or only this process
+            if os.environ.get( 'PROMETHEUS_MULTIPROC_DIR' ):
+                from prometheus_client import multiprocess
+                registry = self.prometheus.CollectorRegistry()
+                multiprocess.MultiProcessCollector( registry )
+            else:
+                registry = self.registry
+            body = self.prometheus.generate_latest( registry ).decode()
+
+        # built-in metrics
+        else:
+            lines = []
+            for histogram in self.histograms.values():
+                lines += histogram.render()
+            body = '\n'.join( lines ) + '\n'
+
+        # callback metrics (of the process answering the request)
+        lines = self.callback_lines()
+        if lines:
+            body += '\n'.join( lines ) + '\n'
+
+
+        return body, CONTENT_TYPE
@@ -0,0 +1,192 @@
+############## LIBRARIES ##############
+
+
+import os
+import queue
+import threading
+import time
+import numpy                  as np
+import pandas                 as pd
+from   concurrent.futures     import Future
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+def size_bucket( size ):
+    """histogram bucket of a batch size -> smallest power of two >= size"""
+
+    return 1 << max( size - 1, 0 ).bit_length()
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent scoring requests into a single pipeline run.
+
+    Requests are queued and a background thread waits up to max_wait_ms
+    (or until max_rows rows are queued) for other requests, runs one
+    vectorized call for all of them and gives each request its own rows back.
+
+    Args:
+        run_batch: function that scores a dataframe and returns predicted rows
+                   labeled with the index of the rows it was given (e.g. handler.score)
+        max_wait_ms: maximum milliseconds a request waits for others
+        max_rows: maximum rows of a batch (bigger requests are scored on their own)
+    """
+
+    def __init__( self, run_batch, max_wait_ms = 5.0, max_rows = 1024 ):
+
+        self.run_batch = run_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_rows = max_rows
+
+        # pending requests: ( dataframe, future )
+        self._queue = queue.Queue()
+
+        # worker thread is started by the first request of each process
+        # (threads are not inherited by forked server workers)
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+
+        # metrics: batch size (rows and requests) -> number of batches
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.rows_histogram = {}
+        self.requests_histogram = {}
+
+
+    def _ensure_thread( self ):
+        """start worker thread on this process, if it was not started yet"""
+
+        with self._thread_lock:
+            if self._thread_pid != os.getpid():
+                # requests queued before a fork belong to the parent process
+                self._queue = queue.Queue()
+                threading.Thread( target = self._loop, name = 'micro-batcher', daemon = True ).start()
+                self._thread_pid = os.getpid()
+
+
+    def submit( self, df_raw ):
+        """
+        Score data(frame) together with other concurrent requests.
+
+        Args:
+            df_raw: data(frame) as sent on request (with unique index)
+
+        Return:
+            df_predicted: same as run_batch( df_raw )
+        """
+
+        # big requests are already vectorized -> score them on their own
+        if df_raw.shape[0] >= self.max_rows:
+            self._record( df_raw.shape[0] )
+
+            return self.run_batch( df_raw )
+
+        # queue request and wait for its rows
+        self._ensure_thread()
+        future = Future()
+        self._queue.put( ( df_raw, future ) )
+
+
+        return future.result()
+
+
+    def _loop( self ):
+        """worker thread -> gather requests and run them as batches"""
+
+        pending = self._queue
+
+        while True:
+            # wait for a request
+            batch = [ pending.get() ]
+            n_rows = batch[0][0].shape[0]
+
+            # gather other requests until batch is full or max wait is over
+            deadline = time.monotonic() + self.max_wait
+            while n_rows < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append( pending.get( timeout = remaining ) )
+                except queue.Empty:
+                    break
+                n_rows += batch[-1][0].shape[0]
+
+            # requests with the same columns are scored together
+            # (a missing column changes how the pipeline computes a feature)
+            groups = {}
+            for df_raw, future in batch:
+                groups.setdefault( tuple( df_raw.columns ), [] ).append( ( df_raw, future ) )
+
+            for group in groups.values():
+                self._run( group )
+
+
+    def _run( self, group ):
+        """score a group of requests at once and scatter rows to each request"""
+
+        # tag rows -> rows of request i are positions offsets[i] to offsets[i+1] of the batch
+        offsets = np.cumsum( [ 0 ] + [ df_raw.shape[0] for df_raw, _ in group ] )
+        self._record( int( offsets[-1] ), n_requests = len( group ) )
+
+        try:
+            df_batch = pd.concat( [ df_raw for df_raw, _ in group ], ignore_index = True )
+            df_predicted = self.run_batch( df_batch )
+
+        except Exception as error:
+            # a single request -> it is the one that failed
+            if len( group ) == 1:
+                group[0][1].set_exception( error )
+
+            # score requests one by one, so only the failing ones get the error
+            else:
+                for df_raw, future in group:
+                    try:
+                        future.set_result( self.run_batch( df_raw ) )
+                    except Exception as request_error:
+                        future.set_exception( request_error )
+
+            return None
+
+        # scatter rows back (pipeline returns every row, in order), labeled with the index of each request
+        for number, ( df_raw, future ) in enumerate( group ):
+            df_request = df_predicted.iloc[ offsets[ number ]:offsets[ number + 1 ] ]
+            df_request.index = df_raw.index
+            future.set_result( df_request )
+
+
+        return None
+
+
+    def _record( self, n_rows, n_requests = 1 ):
+        """update batch metrics"""
+
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += n_requests
+            self.rows += n_rows
+            bucket = size_bucket( n_rows )
+            self.rows_histogram[ bucket ] = self.rows_histogram.get( bucket, 0 ) + 1
+            bucket = size_bucket( n_requests )
+            self.requests_histogram[ bucket ] = self.requests_histogram.get( bucket, 0 ) + 1
+
+
+    def stats( self ):
+        """dictionary with batching metrics (histograms -> batch size upper bound: number of batches)"""
+
+        with self._stats_lock:
+            stats = {'max_wait_ms': self.max_wait * 1000,
+                     'max_rows': self.max_rows,
+                     'batches': self.batches,
+                     'requests': self.requests,
+                     'rows': self.rows,
+                     'rows_histogram': { str( bucket ): count for bucket, count in sorted( self.rows_histogram.items() ) },
+                     'requests_histogram': { str( bucket ): count for bucket, count in sorted( self.requests_histogram.items() ) }
+                    }
+
+
+        return stats
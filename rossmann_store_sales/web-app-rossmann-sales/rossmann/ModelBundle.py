@@ -0,0 +1,154 @@
+############## LIBRARIES ##############
+
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from   rossmann.CompiledPlan   import CompiledPlan
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: a model bundle is a single file with
+#   8 bytes  -> MAGIC
+#   8 bytes  -> header size (little-endian unsigned integer)
+#   header   -> JSON with format version, artifacts digest, compiled plan
+#               parameters (see CompiledPlan.to_dict) and model text size
+#   model    -> LightGBM model text (Booster.model_to_string)
+# so it is loaded without unpickling (nor importing) sklearn objects.
+
+
+MAGIC = b'RSMBNDL1'
+FORMAT_VERSION = 1
+
+
+def import_lightgbm():
+    """
+    import lightgbm without its sklearn API.
+
+    lightgbm imports sklearn (and scipy.stats) on import only to define
+    LGBMRegressor & co, which a Booster doesn't need. If neither is imported
+    yet, sklearn is hidden while lightgbm is imported.
+    """
+
+    # already imported (e.g. model pickles were loaded) -> nothing to save
+    if ( 'lightgbm' in sys.modules ) or ( 'sklearn' in sys.modules ):
+        import lightgbm
+
+        return lightgbm
+
+    # None on sys.modules -> import sklearn raises ImportError
+    sys.modules['sklearn'] = None
+    try:
+        import lightgbm
+    finally:
+        del sys.modules['sklearn']
+
+
+    return lightgbm
+
+
+class ModelBundle:
+    """
+    Model and preprocessing parameters read from a model bundle file.
+
+    Args:
+        path: model bundle (see ModelBundle.write)
+    """
+
+    def __init__( self, path ):
+
+        self.path = path
+
+        # header (format is checked before anything else is read)
+        self.header = self.read_header( path )
+        offset = 16 + self.header['header_size']
+
+        # memory map file -> model text is read without an extra copy of the file
+        with open( path, 'rb' ) as file, mmap.mmap( file.fileno(), 0, access = mmap.ACCESS_READ ) as content:
+            model_text = content[ offset:offset + self.header['model_size'] ].decode()
+
+        # LightGBM model and compiled inputters/scalers
+        self.model = import_lightgbm().Booster( model_str = model_text )
+        self.plan = CompiledPlan.from_dict( self.header['plan'] )
+
+
+    @staticmethod
+    def read_header( path ):
+        """
+        Read only the header of a model bundle (e.g. to check its digest
+        before loading the model).
+
+        Args:
+            path: model bundle file
+
+        Return:
+            header: dictionary with bundle header (and its size, header_size)
+        """
+
+        with open( path, 'rb' ) as file:
+            # check file format
+            if file.read( 8 ) != MAGIC:
+                raise ValueError( f'{path} is not a model bundle' )
+
+            # header
+            header_size = struct.unpack( '<Q', file.read( 8 ) )[0]
+            header = json.loads( file.read( header_size ) )
+
+        # check format version
+        if header['format_version'] != FORMAT_VERSION:
+            raise ValueError( f"unsupported model bundle version {header['format_version']}" )
+        header['header_size'] = header_size
+
+
+        return header
+
+
+    @property
+    def digest( self ):
+        """digest of the artifacts the bundle was built from (see ArtifactRegistry)"""
+
+        return self.header['digest']
+
+
+    @staticmethod
+    def write( path, ml_model, plan, digest ):
+        """
+        Write model and compiled parameters as a model bundle.
+
+        Args:
+            path: model bundle file
+            ml_model: model trained (LGBMRegressor or Booster)
+            plan: CompiledPlan of the fitted inputters and scalers
+            digest: digest of the artifacts (see ArtifactRegistry)
+
+        Return:
+            None
+        """
+
+        # LightGBM model text
+        booster = ml_model.booster_ if hasattr( ml_model, 'booster_' ) else ml_model
+        model_text = booster.model_to_string().encode()
+
+        # header
+        header = json.dumps( {'format_version': FORMAT_VERSION,
+                              'digest': digest,
+                              'plan': plan.to_dict(),
+                              'model_size': len( model_text ),
+                              'created_at': time.time()
+                             } ).encode()
+
+        # write on temporary file and move it -> readers never see a half-written bundle
+        with open( f'{path}.tmp', 'wb' ) as file:
+            file.write( MAGIC )
+            file.write( struct.pack( '<Q', len( header ) ) )
+            file.write( header )
+            file.write( model_text )
+        os.replace( f'{path}.tmp', path )
+
+
+        return None
@@ -0,0 +1,368 @@
+############## LIBRARIES ##############
+
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy                  as np
+import pandas                 as pd
+from   collections            import OrderedDict
+from   rossmann.Rossmann      import COLS_SELECTED, snake_case
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# columns that change a prediction (the other request columns are
+# dropped by the pipeline, so they are not part of the cache key)
+KEY_COLUMNS = [ 'store',
+                'day_of_week',
+                'date',
+                'open',
+                'store_type',
+                'assortment',
+                'competition_distance',
+                'competition_open_since_month',
+                'competition_open_since_year',
+                'promo2_since_week',
+                'promo2_since_year' ]
+
+# columns of predicted rows (see Rossmann.make_prediction)
+PREDICTED_COLUMNS = COLS_SELECTED + [ 'predicted_sales' ]
+
+# size of a cached row (float64 values of PREDICTED_COLUMNS)
+ROW_SIZE = 8 * len( PREDICTED_COLUMNS )
+
+# cached value of filtered rows (closed stores or unknown open)
+FILTERED_ROW = np.full( len( PREDICTED_COLUMNS ), np.nan ).tobytes()
+
+
+def cache_digest( digest, store_index = None, compact = False ):
+    """
+    Digest of everything a cached prediction depends on besides its row:
+    the artifacts, the store.csv of the store index (store features of
+    indexed stores are taken from it, not from the request) and the
+    dtype mode.
+
+    Args:
+        digest: artifacts digest (see ArtifactRegistry)
+        store_index: optional StoreFeatureIndex used by the pipeline
+        compact: True -> compact mode pipeline (see Rossmann)
+
+    Return:
+        digest: hex digest (artifacts digest itself if there is nothing else)
+    """
+
+    # nothing else -> keys of former versions are still valid
+    parts = [ digest ]
+    if store_index is not None:
+        parts.append( f'store-{store_index.digest}' )
+    if compact:
+        parts.append( 'compact' )
+    if len( parts ) == 1:
+        return digest
+
+
+    return hashlib.sha256( '-'.join( parts ).encode() ).hexdigest()[ :16 ]
+
+
+def row_keys( df_raw, digest ):
+    """
+    Cache key of each row: a 64-bit hash of the normalized row
+    (KEY_COLUMNS) combined with the artifacts digest.
+
+    Args:
+        df_raw: data(frame) as sent on request
+        digest: artifacts digest (see cache_digest)
+
+    Return:
+        keys: list with the (int) key of each row
+    """
+
+    # snake case columns (without changing request data)
+    df_key = df_raw.set_axis( snake_case( df_raw.columns ), axis = 'columns' )
+
+    # normalized key columns -> same key for 1 and 1.0, '2015-09-17' and a datetime...
+    normalized = {}
+    for column in KEY_COLUMNS:
+        if column not in df_key.columns:
+            normalized[ column ] = np.full( df_key.shape[0], np.nan )
+        elif column == 'date':
+            normalized[ column ] = pd.to_datetime( df_key[ column ] ).values.astype( 'datetime64[D]' ).astype( 'int64' )
+        elif column in ['store_type', 'assortment']:
+            normalized[ column ] = df_key[ column ].astype( 'str' ).values
+        else:
+            normalized[ column ] = pd.to_numeric( df_key[ column ] ).values.astype( 'float64' )
+
+    # hash normalized rows
+    hashes = pd.util.hash_pandas_object( pd.DataFrame( normalized ), index = False ).values
+
+    # combine hashes with artifacts digest
+    hashes = hashes ^ np.uint64( int( digest, 16 ) & 0xFFFFFFFFFFFFFFFF )
+
+
+    # signed 64-bit keys (sqlite integers)
+    return hashes.view( 'int64' ).tolist()
+
+
+class PredictionCache:
+    """
+    Cache of predicted rows: an in-process LRU with time to live and
+    an optional on-disk (sqlite) tier shared by worker processes.
+
+    Args:
+        maxsize: maximum number of rows on memory
+        ttl: seconds a cached row is valid (None -> no expiration)
+        disk_path: folder for the on-disk tier (None -> memory only)
+    """
+
+    def __init__( self, maxsize = 100000, ttl = 3600, disk_path = None ):
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # memory tier: key -> ( expiration time, value )
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        # disk tier (connection is opened on first use by each process)
+        self.disk_path = disk_path
+        self._connection = None
+        self._connection_pid = None
+        if disk_path is not None:
+            os.makedirs( disk_path, exist_ok = True )
+
+        # dtypes of predicted columns by digest (see cached_run_pipeline)
+        self.dtypes = {}
+
+        # metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    @property
+    def _disk( self ):
+        """sqlite connection of this process (None -> memory only).
+        A connection can't be shared with forked processes (e.g.
+        prefork server workers), so each process opens its own"""
+
+        # memory only
+        if self.disk_path is None:
+            return None
+
+        # open connection (again, if process was forked)
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect( os.path.join( self.disk_path, 'predictions.sqlite' ),
+                                                check_same_thread = False, isolation_level = None )
+            self._connection.execute( 'PRAGMA journal_mode=WAL' )
+            self._connection.execute( 'CREATE TABLE IF NOT EXISTS predictions ( key INTEGER PRIMARY KEY, expires REAL, value BLOB )' )
+            self._connection_pid = os.getpid()
+
+
+        return self._connection
+
+
+    def _expires( self ):
+        """expiration time for a row cached now"""
+
+        return time.time() + self.ttl if self.ttl is not None else float( 'inf' )
+
+
+    def get_many( self, keys ):
+        """
+        Get cached values.
+
+        Args:
+            keys: list of row keys
+
+        Return:
+            values: list with the cached value of each key (None if not cached)
+        """
+
+        now = time.time()
+        values = [ None ] * len( keys )
+        not_on_memory = []
+
+        # memory tier
+        with self._lock:
+            for position, key in enumerate( keys ):
+                entry = self._memory.get( key )
+                if ( entry is not None ) and ( entry[0] > now ):
+                    self._memory.move_to_end( key )
+                    values[ position ] = entry[1]
+                else:
+                    not_on_memory.append( position )
+
+        # disk tier
+        if ( self.disk_path is not None ) and not_on_memory:
+            found = {}
+            with self._lock:
+                for start in range( 0, len( not_on_memory ), 500 ):
+                    batch = [ keys[ position ] for position in not_on_memory[ start:start + 500 ] ]
+                    query = f'SELECT key, value FROM predictions WHERE expires > ? AND key IN ({",".join( "?" * len( batch ) )})'
+                    found.update( self._disk.execute( query, [ now ] + batch ).fetchall() )
+
+            # promote disk hits to memory
+            promoted = []
+            for position in not_on_memory:
+                if keys[ position ] in found:
+                    values[ position ] = found[ keys[ position ] ]
+                    promoted.append( position )
+            self._put_memory( [ keys[ position ] for position in promoted ], [ values[ position ] for position in promoted ] )
+            with self._lock:
+                self.disk_hits += len( promoted )
+
+        # update metrics
+        n_missing = values.count( None )
+        with self._lock:
+            self.misses += n_missing
+            self.hits += len( keys ) - n_missing
+
+
+        return values
+
+
+    def _put_memory( self, keys, values ):
+        """store values on memory tier (evicting least recently used rows)"""
+
+        expires = self._expires()
+
+        with self._lock:
+            for key, value in zip( keys, values ):
+                self._memory[ key ] = ( expires, value )
+                self._memory.move_to_end( key )
+
+            # evict least recently used rows
+            while len( self._memory ) > self.maxsize:
+                self._memory.popitem( last = False )
+
+
+    def put_many( self, keys, values ):
+        """
+        Store values on cache.
+
+        Args:
+            keys: list of row keys
+            values: list of values (bytes)
+        """
+
+        # memory tier
+        self._put_memory( keys, values )
+
+        # disk tier
+        if self.disk_path is not None:
+            expires = self._expires()
+            with self._lock:
+                # single transaction for every row
+                self._disk.execute( 'BEGIN' )
+                self._disk.executemany( 'INSERT OR REPLACE INTO predictions VALUES ( ?, ?, ? )',
+                                        [ ( key, expires, value ) for key, value in zip( keys, values ) ] )
+                self._disk.execute( 'COMMIT' )
+
+
+    def stats( self ):
+        """dictionary with cache metrics"""
+
+        stats = {'hits': self.hits,
+                 'disk_hits': self.disk_hits,
+                 'misses': self.misses,
+                 'size': len( self._memory ),
+                 'maxsize': self.maxsize,
+                 'ttl': self.ttl,
+                 'disk': self.disk_path is not None
+                }
+
+
+        return stats
+
+
+def learn_dtypes( known, df_predicted ):
+    """
+    Dtypes of predicted columns, as make_prediction returns them. A column
+    with missing values is float even if its other values are integers
+    (e.g. store_type of an unknown type), so its dtype is taken only
+    if nothing better is known.
+
+    Args:
+        known: dtypes known so far (column -> dtype, None -> nothing known)
+        df_predicted: predicted rows (see Rossmann.make_prediction)
+
+    Return:
+        dtypes: dictionary column -> dtype, on make_prediction column order
+    """
+
+    dtypes = dict( known ) if known is not None else {}
+    for column in df_predicted.columns:
+        values = df_predicted[ column ].values
+        complete = ( values.dtype.kind != 'f' ) or not np.isnan( values ).any()
+        if ( column not in dtypes ) or ( complete and values.shape[0] > 0 ):
+            dtypes[ column ] = values.dtype
+
+
+    return { column: dtypes[ column ] for column in df_predicted.columns }
+
+
+def cached_run_pipeline( cache, pipeline, ml_model, digest, df_raw, **kwargs ):
+    """
+    Run Rossmann pipeline only on rows that are not cached.
+
+    Args:
+        cache: PredictionCache
+        pipeline: Rossmann instance
+        ml_model: model trained
+        digest: artifacts digest (see cache_digest)
+        df_raw: data(frame) as sent on request (with unique index)
+        kwargs: other run_pipeline arguments (e.g. store_index)
+
+    Return:
+        df_predicted: same as pipeline.run_pipeline( ml_model, df_raw )
+    """
+
+    # identity of request rows, as run_pipeline keeps it
+    df_identity = pipeline.row_identity( pipeline.data_cleaning( df_raw.copy() ) )
+    kept = df_identity['open'].values == 1
+
+    # cached rows (values of another size were cached by a former version).
+    # Dtypes of predicted columns are learned on first scoring, so every
+    # row is scored if they are not known yet (e.g. rows cached on disk
+    # by another process)
+    keys = row_keys( df_raw, digest )
+    values = cache.get_many( keys )
+    if digest in cache.dtypes:
+        missing = [ position for position, value in enumerate( values ) if ( value is None ) or ( len( value ) != ROW_SIZE ) ]
+    else:
+        missing = list( range( len( values ) ) )
+
+    # score rows that are not cached
+    if missing:
+        df_missing = pipeline.run_pipeline( ml_model, df_raw.iloc[ missing ].copy(), restore = False, **kwargs )
+        cache.dtypes[ digest ] = learn_dtypes( cache.dtypes.get( digest ), df_missing )
+
+        # store every row as float64 bytes (pipeline keeps predicted rows in order)
+        predicted = iter( df_missing[ PREDICTED_COLUMNS ].values.astype( 'float64' ) )
+        new_values = [ next( predicted ).tobytes() if kept[ position ] else FILTERED_ROW for position in missing ]
+        cache.put_many( [ keys[ position ] for position in missing ], new_values )
+
+        # fill missing values
+        for position, value in zip( missing, new_values ):
+            values[ position ] = value
+
+    # predicted rows from cached bytes, on the dtypes make_prediction returns
+    # (integer columns with missing values are float, as pandas keeps them)
+    matrix = np.frombuffer( b''.join( values ), dtype = 'float64' ).reshape( -1, len( PREDICTED_COLUMNS ) )[ kept ]
+    predicted = {}
+    for column, dtype in cache.dtypes[ digest ].items():
+        column_values = matrix[ :, PREDICTED_COLUMNS.index( column ) ]
+        if ( dtype.kind in 'iu' ) and np.isnan( column_values ).any():
+            dtype = np.dtype( 'float64' )
+        predicted[ column ] = column_values.astype( dtype )
+    df_predicted = pd.DataFrame( predicted, index = df_identity.index[ kept ] )
+
+    # put filtered rows back, as run_pipeline does
+    df_predicted = pipeline.restore_rows( df_predicted, df_identity )
+
+
+    return df_predicted
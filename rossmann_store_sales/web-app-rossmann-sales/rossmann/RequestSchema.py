@@ -0,0 +1,311 @@
+############## LIBRARIES ##############
+
+
+import json
+import numpy                    as np
+import pandas                   as pd
+from   collections              import namedtuple
+from   rossmann.ResponseBuilder import import_orjson
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+class SchemaError( ValueError ):
+    """
+    Request data that doesn't match the schema (answered with 400).
+
+    Args:
+        message: what is wrong
+        row: position of the invalid row (None -> not a single row)
+    """
+
+    def __init__( self, message, row = None ):
+
+        self.message = message
+        self.row = row
+        super().__init__( f'row {row}: {message}' if row is not None else message )
+
+
+# request column: name as sent, name used by the pipeline (snake case), dtype
+# ('category' -> pandas categorical of categories), whether it can be null and
+# its valid range (numbers) or values (categories)
+Field = namedtuple( 'Field', ['name', 'column', 'dtype', 'nullable', 'low', 'high', 'categories'],
+                    defaults = [ False, None, None, None ] )
+
+# largest store id (store ids are int16 on the pipeline)
+MAX_STORE = np.iinfo( 'int16' ).max
+
+# largest id parsed exactly (JSON numbers are parsed as float64)
+MAX_EXACT_INTEGER = 2 ** 53
+
+# test.csv + store.csv columns (other columns are not used, so they are dropped)
+SCHEMA = [ Field( 'Id',                        'id',                           'int64',   low = 0, high = MAX_EXACT_INTEGER ),
+           Field( 'Store',                     'store',                        'int16',   low = 1, high = MAX_STORE ),
+           Field( 'DayOfWeek',                 'day_of_week',                  'uint8',   low = 1, high = 7 ),
+           Field( 'Date',                      'date',                         'datetime64[D]' ),
+           Field( 'Open',                      'open',                         'uint8',   nullable = True, low = 0, high = 1 ),
+           Field( 'Promo',                     'promo',                        'uint8',   nullable = True, low = 0, high = 1 ),
+           Field( 'StateHoliday',              'state_holiday',                'category', nullable = True, categories = [ '0', 'a', 'b', 'c' ] ),
+           Field( 'SchoolHoliday',             'school_holiday',               'uint8',   nullable = True, low = 0, high = 1 ),
+           Field( 'StoreType',                 'store_type',                   'category', categories = [ 'a', 'b', 'c', 'd' ] ),
+           Field( 'Assortment',                'assortment',                   'category', categories = [ 'a', 'b', 'c' ] ),
+           Field( 'CompetitionDistance',       'competition_distance',         'float64', nullable = True, low = 0 ),
+           Field( 'CompetitionOpenSinceMonth', 'competition_open_since_month', 'float64', nullable = True, low = 1, high = 12 ),
+           Field( 'CompetitionOpenSinceYear',  'competition_open_since_year',  'float64', nullable = True, low = 1900, high = 2100 ),
+           Field( 'Promo2',                    'promo2',                       'uint8',   nullable = True, low = 0, high = 1 ),
+           Field( 'Promo2SinceWeek',           'promo2_since_week',            'float64', nullable = True, low = 1, high = 53 ),
+           Field( 'Promo2SinceYear',           'promo2_since_year',            'float64', nullable = True, low = 1900, high = 2100 ),
+           Field( 'PromoInterval',             'promo_interval',               'category', nullable = True, categories = [ 'Jan,Apr,Jul,Oct', 'Feb,May,Aug,Nov', 'Mar,Jun,Sept,Dec' ] ) ]
+
+# columns every request needs
+REQUIRED_COLUMNS = [ 'Store', 'Date', 'Open' ]
+
+# store.csv columns, needed unless store features are taken from a StoreFeatureIndex
+STORE_COLUMNS = [ 'StoreType', 'Assortment', 'CompetitionDistance', 'CompetitionOpenSinceMonth',
+                  'CompetitionOpenSinceYear', 'Promo2SinceWeek', 'Promo2SinceYear' ]
+
+
+# python types of JSON numbers and null
+NUMBER_TYPES = { int, float, type( None ) }
+
+
+def first_row( mask ):
+    """position of the first True value"""
+
+    return int( np.argmax( mask ) )
+
+
+def parse_number( field, values ):
+    """numeric column of a field (see parse_records), from a list of
+    JSON values or from a float64 array (typed columns, see parse_frame)"""
+
+    # JSON numbers and nulls only (numeric strings, e.g. "5", and booleans are not numbers)
+    if not isinstance( values, np.ndarray ) and not set( map( type, values ) ) <= NUMBER_TYPES:
+        row = next( row for row, value in enumerate( values ) if type( value ) not in NUMBER_TYPES )
+        raise SchemaError( f'{field.name} must be a number, got {values[ row ]!r}', row = row )
+
+    # None and NaN -> NaN (integers beyond float64, e.g. 1e400 written as an integer, are out of range)
+    try:
+        array = np.array( values, dtype = 'float64' )
+    except OverflowError:
+        row = next( row for row, value in enumerate( values ) if ( type( value ) is int ) and ( abs( value ) > np.finfo( 'float64' ).max ) )
+        raise SchemaError( f'{field.name} is out of range, got {str( values[ row ] )[ :20 ]}...', row = row )
+
+    # missing values
+    nulls = np.isnan( array )
+    if nulls.any() and not field.nullable:
+        raise SchemaError( f'{field.name} is missing', row = first_row( nulls ) )
+
+    # integers
+    if field.dtype != 'float64':
+        fraction = ~nulls & ( array != np.floor( array ) )
+        if fraction.any():
+            raise SchemaError( f'{field.name} must be an integer, got {array[ first_row( fraction ) ]}', row = first_row( fraction ) )
+
+    # valid range (integers also within their dtype -> no wrap around on astype)
+    low, high = field.low, field.high
+    if field.dtype != 'float64':
+        limits = np.iinfo( field.dtype )
+        low = max( low, limits.min ) if low is not None else limits.min
+        high = min( high, limits.max ) if high is not None else limits.max
+    for bound, out_of_range in [ ( f'>= {low}', array < low if low is not None else None ),
+                                 ( f'<= {high}', array > high if high is not None else None ) ]:
+        if ( out_of_range is not None ) and out_of_range.any():
+            row = first_row( out_of_range )
+            raise SchemaError( f'{field.name} must be {bound}, got {array[ row ]:g}', row = row )
+
+    # integer type (float with NaN if values are missing)
+    if field.dtype != 'float64':
+        return array.astype( field.dtype ) if not nulls.any() else array.astype( 'float32' )
+
+
+    return array
+
+
+def parse_date( field, values ):
+    """YYYY-MM-DD date column of a field (see parse_records)"""
+
+    strings = np.array( values )
+
+    # every value is a YYYY-MM-DD string
+    if strings.dtype.kind == 'U' and strings.ndim == 1:
+        chars = strings.astype( 'U10' ).view( 'U1' ).reshape( -1, 10 ) if strings.size else np.empty( ( 0, 10 ), dtype = 'U1' )
+        valid = ( np.char.str_len( strings ) == 10 ) & ( chars[ :, 4 ] == '-' ) & ( chars[ :, 7 ] == '-' )
+    else:
+        valid = np.array( [ isinstance( value, str ) and len( value ) == 10 for value in values ] )
+    if not valid.all():
+        row = first_row( ~valid )
+        raise SchemaError( f'{field.name} must be a YYYY-MM-DD date, got {values[ row ]!r}', row = row )
+
+    # parse dates (e.g. month 13 or February 30 are invalid)
+    try:
+        return strings.astype( 'datetime64[D]' )
+    except ValueError:
+        row = next( row for row, value in enumerate( values ) if not is_date( value ) )
+        raise SchemaError( f'{field.name} must be a YYYY-MM-DD date, got {values[ row ]!r}', row = row )
+
+
+def is_date( value ):
+    """True if value can be parsed as a date"""
+
+    try:
+        np.datetime64( value, 'D' )
+    except ValueError:
+        return False
+
+
+    return True
+
+
+def parse_category( field, values ):
+    """categorical column of a field (see parse_records)"""
+
+    # None, NaN and '' -> missing, other values as strings (e.g. 0 -> '0')
+    strings = [ None if ( value is None ) or ( value != value ) or ( value == '' ) else str( value ) for value in values ]
+    categorical = pd.Categorical( strings, categories = field.categories )
+
+    # missing values
+    nulls = np.array( [ value is None for value in strings ] )
+    if nulls.any() and not field.nullable:
+        raise SchemaError( f'{field.name} is missing', row = first_row( nulls ) )
+
+    # unknown values
+    unknown = ( categorical.codes == -1 ) & ~nulls
+    if unknown.any():
+        row = first_row( unknown )
+        raise SchemaError( f'{field.name} must be one of {field.categories}, got {values[ row ]!r}', row = row )
+
+
+    return categorical
+
+
+def parse_records( records, required = REQUIRED_COLUMNS ):
+    """
+    Typed columns of request records, validated against SCHEMA.
+
+    Args:
+        records: JSON object or list of JSON objects (test.csv + store.csv columns)
+        required: columns every request must have (missing values are
+                  still allowed on nullable columns)
+
+    Return:
+        df_raw: dataframe with snake case columns (see SCHEMA), ready for the pipeline
+
+    Raises:
+        SchemaError: on the first invalid value
+    """
+
+    # unique row -> json = dictionary
+    if isinstance( records, dict ):
+        records = [ records ]
+    if not isinstance( records, list ) or not all( isinstance( record, dict ) for record in records ):
+        raise SchemaError( 'data must be a JSON object or a list of JSON objects' )
+
+    # columns sent on any row
+    sent = set().union( *records )
+    missing = [ name for name in required if name not in sent ]
+    if missing:
+        raise SchemaError( f'missing columns {missing}' )
+
+    # one typed array for each column sent
+    columns = {}
+    for field in SCHEMA:
+        if field.name not in sent:
+            continue
+
+        values = [ record.get( field.name ) for record in records ]
+        if field.dtype == 'category':
+            columns[ field.column ] = parse_category( field, values )
+        elif field.dtype.startswith( 'datetime64' ):
+            columns[ field.column ] = parse_date( field, values )
+        else:
+            columns[ field.column ] = parse_number( field, values )
+
+
+    return pd.DataFrame( columns )
+
+
+def parse_frame( df, required = REQUIRED_COLUMNS ):
+    """
+    Typed columns of a dataframe (e.g. an Arrow or Parquet table), validated
+    against SCHEMA as JSON records are (see parse_records).
+
+    Args:
+        df: dataframe with test.csv + store.csv columns
+        required: columns every request must have
+
+    Return:
+        df_raw: dataframe with snake case columns (see SCHEMA), ready for the pipeline
+
+    Raises:
+        SchemaError: on the first invalid value
+    """
+
+    # columns sent
+    missing = [ name for name in required if name not in df.columns ]
+    if missing:
+        raise SchemaError( f'missing columns {missing}' )
+
+    # one typed array for each column sent
+    columns = {}
+    for field in SCHEMA:
+        if field.name not in df.columns:
+            continue
+
+        values = df[ field.name ]
+        if field.dtype == 'category':
+            columns[ field.column ] = parse_category( field, values.tolist() )
+
+        # dates -> already typed (date or timestamp columns) or YYYY-MM-DD strings
+        elif field.dtype.startswith( 'datetime64' ):
+            if values.dtype.kind == 'M':
+                nulls = values.isna().values
+                if nulls.any():
+                    raise SchemaError( f'{field.name} is missing', row = first_row( nulls ) )
+                columns[ field.column ] = values.values.astype( 'datetime64[D]' )
+            else:
+                columns[ field.column ] = parse_date( field, values.tolist() )
+
+        # numbers -> numeric columns as float64 (nulls -> NaN), other columns value by value
+        elif values.dtype.kind in 'biuf':
+            columns[ field.column ] = parse_number( field, values.to_numpy( dtype = 'float64', na_value = np.nan ) )
+        else:
+            columns[ field.column ] = parse_number( field, values.tolist() )
+
+
+    return pd.DataFrame( columns )
+
+
+def parse_body( body, required = REQUIRED_COLUMNS ):
+    """
+    Typed columns of a JSON request body (see parse_records).
+
+    Args:
+        body: JSON request body (bytes)
+        required: columns every request must have
+
+    Return:
+        df_raw: dataframe (None if no data was sent)
+    """
+
+    # no data
+    if not body:
+        return None
+
+    # JSON (orjson if installed, json if body has NaN literals, e.g. from json.dumps)
+    orjson = import_orjson()
+    try:
+        if ( orjson is not None ) and ( b'NaN' not in body ):
+            records = orjson.loads( body )
+        else:
+            records = json.loads( body )
+    except ValueError as error:
+        raise SchemaError( f'body is not valid JSON ({error})' )
+
+    # no rows
+    if not records:
+        return None
+
+
+    return parse_records( records, required = required )
@@ -0,0 +1,130 @@
+############## LIBRARIES ##############
+
+
+import numpy                  as np
+import pandas                 as pd
+from   rossmann.Rossmann      import COLS_SELECTED, IDENTITY_COLUMNS
+
+
+############## FUNCTIONS ##############
+
+
+# columns sent back by default (and id, if the request has it)
+DEFAULT_FIELDS = [ 'store', 'date', 'predicted_sales' ]
+
+# every column that can be sent back (prepared features are scaled/encoded values)
+AVAILABLE_FIELDS = IDENTITY_COLUMNS + COLS_SELECTED + [ 'predicted_sales' ]
+
+
+def import_orjson():
+    """import orjson if it is installed (None -> pandas JSON writer is used)"""
+
+    try:
+        import orjson
+
+    except ImportError:
+        return None
+
+
+    return orjson
+
+
+def date_strings( values ):
+    """dates as YYYY-MM-DD strings (datetimes or strings as sent)"""
+
+    if np.issubdtype( values.dtype, np.datetime64 ):
+        return np.datetime_as_string( values, unit = 'D' )
+
+
+    return values.astype( 'str' )
+
+
+def parse_fields( value, has_id = False ):
+    """
+    Columns to be sent back.
+
+    Args:
+        value: comma separated field names (None -> DEFAULT_FIELDS, with id first if it was sent)
+        has_id: True if request rows have an id
+
+    Return:
+        fields: list of field names
+
+    Raises:
+        ValueError: if a field is not available
+    """
+
+    # default fields
+    if not value:
+        return ( [ 'id' ] if has_id else [] ) + DEFAULT_FIELDS
+
+    # asked fields
+    fields = [ field.strip() for field in value.split( ',' ) if field.strip() ]
+    unknown = [ field for field in fields if field not in AVAILABLE_FIELDS ]
+    if unknown:
+        raise ValueError( f'unknown fields {unknown}, available fields are {AVAILABLE_FIELDS}' )
+
+
+    return fields
+
+
+def select_fields( df_predicted, fields ):
+    """
+    Response columns of predicted rows.
+
+    Args:
+        df_predicted: predicted rows (see Rossmann.run_pipeline)
+        fields: list of field names (see parse_fields)
+
+    Return:
+        df_response: dataframe with fields columns only
+    """
+
+    columns = {}
+    for field in fields:
+        # id was not sent -> null
+        if field not in df_predicted.columns:
+            columns[ field ] = np.full( df_predicted.shape[0], None )
+
+        # date as YYYY-MM-DD string
+        elif field == 'date':
+            columns[ field ] = date_strings( df_predicted[ field ].values )
+
+        else:
+            columns[ field ] = df_predicted[ field ].values
+
+
+    return pd.DataFrame( columns, index = df_predicted.index )
+
+
+def records_json( df_response, lines = False ):
+    """
+    JSON records of response columns (orjson if installed, pandas otherwise).
+
+    Args:
+        df_response: dataframe returned by select_fields
+        lines: True -> newline delimited records instead of an array
+
+    Return:
+        body: JSON records (bytes)
+    """
+
+    orjson = import_orjson()
+
+    # pandas writer (10 decimal digits)
+    if orjson is None:
+        body = df_response.to_json( orient = 'records', lines = lines, date_format = 'iso' )
+
+        return ( body.rstrip( '\n' ) + '\n' ).encode() if lines else body.encode()
+
+    # columns as Python lists, one dictionary per row
+    names = list( df_response.columns )
+    values = [ df_response[ name ].values.tolist() for name in names ]
+    records = [ dict( zip( names, row ) ) for row in zip( *values ) ]
+
+    # NaN -> null
+    if lines:
+        return b''.join( orjson.dumps( record ) + b'\n' for record in records )
+
+
+    return orjson.dumps( records )
@@ -1,11 +1,15 @@
 ############## LIBRARIES ##############
 
 
+import os
 import pickle
 import re
-import numpy  as np
-import pandas as pd
-import sklearn
+import time
+import numpy                  as np
+import pandas                 as pd
+from   rossmann.CompiledPlan      import CompiledPlan
+from   rossmann.DateFeatureCache  import DateFeatureCache
+from   rossmann.InferenceEngine   import to_float32
 
 
 ############## CLASS AND ITS FUNCTIONS ##############
@@ -17,47 +21,371 @@ import sklearn
 # for future CRISP cycles. 
 
 
+# fitted inputters and scalers used by Rossmann class
+# (file name on parameter folder is the parameter name + .pkl)
+PARAMETERS = [ 'competition_distance_inputter',
+               'competition_open_since_month_inputter',
+               'competition_open_since_month_scaler',
+               'competition_open_since_year_inputter',
+               'promo2_since_week_inputter',
+               'promo2_since_week_scaler',
+               'promo2_since_year_inputter',
+               'promo2_since_year_scaler',
+               # 'promo_interval_inputter',
+               'store_scaler',
+               # 'year_scaler'
+             ]
+
+
+# dictionary with features and their bins (for discretization)
+DICT_BINS = {'competition_open_since_year': np.array( [1989, 1990, 1995, 2000, 2005, 2008, 2010, 2012, 2014, 2016], dtype = 'float64' ),
+             'competition_distance': np.array( [0, 50, 100, 500, 1000, 5000, 15000, 100000], dtype = 'float64' )
+            }
+
+# dictionary with features and their encodings
+ENCODING_DICT = {'store_type': {'a': 0, 'd': 1, 'c': 2, 'b': 3},
+                 'assortment': {'basic': 0, 'extended': 1, 'extra': 2},
+                 # 'promo_interval': {'Mar,Jun,Sept,Dec': 0,
+                 #                     'Feb,May,Aug,Nov': 1,
+                 #                     'Jan,Apr,Jul,Oct': 2 }
+                }
+
+# dict with feature and its cycle
+CYCLIC_DICT = {
+    # 'season': 4,
+    'day_of_month': 30,
+    'day_of_year': 365,
+    'month': 12,
+    'week_number': 52,
+    'day_of_week': 7
+}
+
+# sin and cos values for every possible (integer) value of cyclic features.
+# values are computed with the same scalar expression that was applied 
+# row by row so that looking them up gives exactly the same floats.
+CYCLIC_TABLES = {column: {'sin': np.array( [ np.sin( x * ( 2. * np.pi/ cycle ) ) for x in range( max_value + 1 ) ] ),
+                          'cos': np.array( [ np.cos( x * ( 2. * np.pi/ cycle ) ) for x in range( max_value + 1 ) ] )}
+                 for column, cycle, max_value in [ ('day_of_month', CYCLIC_DICT['day_of_month'], 31),
+                                                   ('day_of_year', CYCLIC_DICT['day_of_year'], 366),
+                                                   ('month', CYCLIC_DICT['month'], 12),
+                                                   ('week_number', CYCLIC_DICT['week_number'], 53),
+                                                   ('day_of_week', CYCLIC_DICT['day_of_week'], 7) ] }
+
+# features used by ML model (in the order the model expects them)
+COLS_SELECTED = [
+    'store',
+    'store_type',
+    'assortment',
+    'competition_distance',
+    'competition_open_since_month',
+    'competition_open_since_year',
+    'promo2_since_week',
+    'promo2_since_year',
+    'day_of_month_sin',
+    'day_of_month_cos',
+    'day_of_year_sin',
+    'day_of_year_cos',
+    'month_cos',
+    'day_of_week_sin',
+    'day_of_week_cos'
+]
+
+# selected features that only depend on store.csv data
+STORE_FEATURES = COLS_SELECTED[ :8 ]
+
+# selected features that depend on date
+DATE_FEATURES = COLS_SELECTED[ 8: ]
+
+
+def discretize( values, bins ):
+    """
+    Discretize values on the given bins, as pd.cut( values, bins ) 
+    followed by category codes, with labels ranging from 0 to 2.
+
+    Args:
+        values: float array to be discretized
+        bins: sorted array with bins edges (right edge included)
+
+    Return:
+        codes: float array with discretized values
+    """
+
+    # bin index for each value -> interval ( bins[i], bins[i+1] ] has code i
+    codes = np.searchsorted( bins, values, side = 'left' ) - 1
+
+    # values outside bins (or missing) have code -1, as on pd.cut
+    codes[ ~( ( values > bins[0] ) & ( values <= bins[-1] ) ) ] = -1
+
+    # make category labels range from 0 to 2
+    codes = codes / ( ( len( bins ) - 2 ) / 2 )
+
+
+    return codes
+
+
+def encode_categories( values, mapping, default = np.nan ):
+    """
+    Encode a categorical feature through its codes (each category is
+    mapped once, then taken for each row).
+
+    Args:
+        values: categorical series
+        mapping: dictionary with category -> encoded value
+        default: value of categories not on mapping and of missing values
+
+    Return:
+        encoded: array with encoded values
+    """
+
+    # encoded value of each category
+    table = [ mapping.get( category, default ) for category in values.cat.categories ]
+
+    # missing values have code -1 -> last item
+    codes = values.cat.codes.values
+    if ( codes < 0 ).any():
+        table.append( default )
+
+
+    return np.array( table )[ codes ]
+
+
+def compact_columns( df_to_compact ):
+    """
+    Downcast columns to the smallest dtype that keeps their values
+    (see Rossmann compact mode): strings -> categorical, integers ->
+    smallest (unsigned) integer, floats -> float32 if every value is a
+    float32 value (e.g. whole numbers, so inputs are kept). Dates are kept.
+
+    Args:
+        df_to_compact: dataframe (changed in place)
+
+    Return:
+        df_compact: same dataframe, with downcast columns
+    """
+
+    for column in df_to_compact.columns:
+        values = df_to_compact[ column ]
+
+        # strings -> categories (codes + distinct values)
+        if values.dtype == object:
+            df_to_compact[ column ] = values.astype( 'category' )
+
+        # integers -> int8 ... int64 (unsigned if there are no negative values)
+        elif values.dtype.kind in 'iu':
+            low, high = ( values.values.min(), values.values.max() ) if values.size else ( 0, 0 )
+            dtypes = [ 'uint8', 'uint16', 'uint32', 'uint64' ] if low >= 0 else [ 'int8', 'int16', 'int32', 'int64' ]
+            smallest = next( dtype for dtype in dtypes if ( np.iinfo( dtype ).min <= low ) and ( high <= np.iinfo( dtype ).max ) )
+            df_to_compact[ column ] = values.values.astype( smallest, copy = False )
+
+        # float64 -> float32 (missing values stay NaN)
+        elif ( values.dtype.kind == 'f' ) and ( values.dtype.itemsize > 4 ):
+            single = values.values.astype( 'float32' )
+            if ( ( single == values.values ) | np.isnan( single ) ).all():
+                df_to_compact[ column ] = single
+
+
+    return df_to_compact
+
+
+def cyclic_transform( values, column, transformation ):
+    """
+    Apply sin or cos transformation on a cyclic feature
+
+    Args:
+        values: array with feature values
+        column: feature name (a key of CYCLIC_DICT)
+        transformation: 'sin' or 'cos'
+
+    Return:
+        transformed: float array with transformed values
+    """
+
+    # lookup table with precomputed values
+    table = CYCLIC_TABLES[ column ][ transformation ]
+
+    # integer values on table range -> look them up
+    if ( values.dtype.kind in 'iu' ) and ( values.size == 0 or ( values.min() >= 0 and values.max() < table.size ) ):
+        transformed = table[ values ]
+
+    # unexpected values (e.g. floats or missing values) -> compute them
+    else:
+        function = np.sin if transformation == 'sin' else np.cos
+        transformed = function( values.astype( 'float64' ) * ( 2. * np.pi/ CYCLIC_DICT[ column ] ) )
+
+
+    return transformed
+
+
+# features transformed by fitted inputters and scalers
+# -> ( feature, inputter or None, scaler or None ), in the order they are applied
+TRANSFORM_STEPS = [ ('store', None, 'store_scaler'),
+                    ('competition_distance', 'competition_distance_inputter', None),
+                    ('competition_open_since_month', 'competition_open_since_month_inputter', 'competition_open_since_month_scaler'),
+                    ('competition_open_since_year', 'competition_open_since_year_inputter', None),
+                    ('promo2_since_week', 'promo2_since_week_inputter', 'promo2_since_week_scaler'),
+                    ('promo2_since_year', 'promo2_since_year_inputter', 'promo2_since_year_scaler'),
+                    # ('promo_interval', 'promo_interval_inputter', None),
+                    # ('year', None, 'year_scaler')
+                  ]
+
+
+# request columns kept on every predicted row, so results can be looked up
+# without joining them back to request data (id is optional)
+IDENTITY_COLUMNS = [ 'id', 'date' ]
+
+# request columns read by the pipeline (the other ones, e.g. promo and
+# promo_interval, are sent but are not used by any feature of the model)
+PIPELINE_COLUMNS = IDENTITY_COLUMNS + [ 'store',
+                                        'day_of_week',
+                                        'open',
+                                        'store_type',
+                                        'assortment',
+                                        'competition_distance',
+                                        'competition_open_since_month',
+                                        'competition_open_since_year',
+                                        'promo2_since_week',
+                                        'promo2_since_year' ]
+
+# date features shared by every Rossmann instance of the process
+# (features are computed once per distinct date)
+DATE_FEATURE_CACHE = DateFeatureCache( cyclic_transform, maxsize = 4096 )
+
+
+def snake_case( columns ):
+    """change columns names from Pascal case to snake case
+    (names without upper case letters are already snake case, see RequestSchema)"""
+
+    return [ '_'.join( re.findall('([A-Z][a-z0-9]+)', column) ).lower() if column != column.lower() else column for column in columns ]
+
+
+def lap( observe, stage, start ):
+    """report seconds since start of a pipeline step (if observed) -> start of next step"""
+
+    now = time.perf_counter()
+    if observe is not None:
+        observe( stage, now - start )
+
+
+    return now
+
+
+def load_parameters( parameter_path = './parameter' ):
+    """
+    Load fitted inputters and scalers from disk.
+
+    Args:
+        parameter_path: folder with the pickled inputters and scalers
+
+    Return:
+        parameters: dictionary with parameter name -> fitted object
+    """
+
+    # dictionary to store loaded parameters
+    parameters = {}
+
+    # iterate over parameters and unpickle them
+    for name in PARAMETERS:
+        with open( os.path.join( parameter_path, f'{name}.pkl' ), 'rb' ) as file:
+            parameters[ name ] = pickle.load( file )
+
+
+    return parameters
+
+
 class Rossmann:
-    def __init__( self ): # class constructor
-
-        # load scalers
-        with open( './parameter/competition_distance_inputter.pkl', 'rb' ) as competition_distance_inputter:
-            self.competition_distance_inputter = pickle.load( competition_distance_inputter )       
-        with open( './parameter/competition_open_since_month_inputter.pkl', 'rb' ) as competition_open_since_month_inputter:
-            self.competition_open_since_month_inputter = pickle.load( competition_open_since_month_inputter )
-        with open( './parameter/competition_open_since_month_scaler.pkl', 'rb' ) as competition_open_since_month_scaler:
-            self.competition_open_since_month_scaler = pickle.load( competition_open_since_month_scaler )
-        with open( './parameter/competition_open_since_year_inputter.pkl', 'rb' ) as competition_open_since_year_inputter:
-            self.competition_open_since_year_inputter = pickle.load( competition_open_since_year_inputter )
-        with open( './parameter/promo2_since_week_inputter.pkl', 'rb' ) as promo2_since_week_inputter:
-            self.promo2_since_week_inputter = pickle.load( promo2_since_week_inputter )
-        with open( './parameter/promo2_since_week_scaler.pkl', 'rb' ) as promo2_since_week_scaler:
-            self.promo2_since_week_scaler = pickle.load( promo2_since_week_scaler )
-        with open( './parameter/promo2_since_year_inputter.pkl', 'rb' ) as promo2_since_year_inputter:
-            self.promo2_since_year_inputter = pickle.load( promo2_since_year_inputter )
-        with open( './parameter/promo2_since_year_scaler.pkl', 'rb' ) as promo2_since_year_scaler:
-            self.promo2_since_year_scaler = pickle.load( promo2_since_year_scaler )
-        # with open( './parameter/promo_interval_inputter.pkl', 'rb' ) as promo_interval_inputter:
-        #     self.promo_interval_inputter = pickle.load( promo_interval_inputter )
-        with open( './parameter/store_scaler.pkl', 'rb' ) as store_scaler:
-            self.store_scaler = pickle.load( store_scaler )
-        # with open( './parameter/year_scaler.pkl', 'rb' ) as year_scaler:
-        #     self.year_scaler = pickle.load( year_scaler )
+    def __init__( self, parameters = None, mode = 'compiled', num_threads = None, plan = None, compact = False, thresholds = None ): # class constructor
+        """parameters is a dictionary as returned by load_parameters.
+        If it is not given, parameters are loaded from ./parameter
+
+        mode is how inputters and scalers are applied:
+            'compiled' -> fused NumPy plan compiled from fitted parameters (CompiledPlan)
+            'sklearn'  -> sklearn transform calls (reference mode)
+
+        num_threads is the number of LightGBM threads used on prediction
+        (None -> LightGBM default, one thread per core)
+
+        plan is an already compiled plan (e.g. read from a model bundle).
+        If it is given, parameters are not needed (nor loaded), but only
+        'compiled' mode is available
+
+        compact is the memory-lean mode: request columns are downcast to
+        the smallest dtype that keeps their values (strings -> categorical
+        codes, integers -> int8/int16..., whole floats -> float32), date
+        features are int16/float32 and prepared features (so the matrix
+        given to LightGBM) are float32. Features are still computed on
+        float64 and then rounded (a column at a time). Request columns
+        that are not read (PIPELINE_COLUMNS) are dropped first.
+
+        Each stage allocates 2-3x less memory (200k rows: 13-72 MB ->
+        14-29 MB), not 4-8x: dates stay datetime64[ns] (pandas has no day
+        resolution), the model matrix can't be smaller than float32 (half
+        of float64) and features are computed on float64 before they are
+        rounded against the model splits. It is also slower on cleaning
+        and preparation (strings are hashed to categories, rounded values
+        are checked against split thresholds), so it trades time for memory.
+
+        thresholds are the split thresholds of the model, by feature (see
+        InferenceEngine.split_thresholds), used on compact mode to round
+        features so that they take the same branch as their float64 value
+        on every split. Without them, features are rounded to nearest and
+        values equal (or close) to a threshold take the other branch: on
+        test.csv, 43% of predictions change (up to 19%). With them, only
+        values between two thresholds closer than a float32 step can't
+        be kept (day_of_month_sin of a few days): 4% of predictions change
+        (up to 2%). See benchmark_pipeline.py --compact. Responses with
+        features (fields) have float32 values"""
+
+        # check transformation mode
+        if mode not in ['compiled', 'sklearn']:
+            raise ValueError( f"mode must be 'compiled' or 'sklearn', not {mode!r}" )
+        self.mode = mode
+        self.num_threads = num_threads
+
+        # memory-lean mode
+        self.compact = compact
+        self.thresholds = thresholds if thresholds is not None else {}
+
+        # plan already compiled -> no sklearn object is required
+        if plan is not None:
+            if mode != 'compiled':
+                raise ValueError( "a compiled plan can only be used on 'compiled' mode" )
+            self.plan = plan
+
+            return None
+
+        # load scalers (only if they were not already loaded, e.g. by ArtifactRegistry)
+        if parameters is None:
+            parameters = load_parameters()
+
+        # set inputters and scalers as attributes
+        for name in PARAMETERS:
+            setattr( self, name, parameters[ name ] )
+
+        # compile fitted inputters and scalers
+        self.plan = CompiledPlan.from_parameters( parameters, TRANSFORM_STEPS ) if mode == 'compiled' else None
 
 
     def data_cleaning( self, df_to_clean ):
         """df_to_clean is the data(frame) to be cleaned"""
   
         # change from Pascal case to snake case
-        snake_case = [ '_'.join( re.findall('([A-Z][a-z0-9]+)', column) ).lower()
-                        for column in df_to_clean.columns ]
-        df_to_clean.columns = snake_case
+        df_to_clean.columns = snake_case( df_to_clean.columns )
 
         # convert data column to date format, instead of string
-        df_to_clean['date'] = pd.to_datetime( df_to_clean['date'], format = '%Y-%m-%d' )
+        # (dates parsed by RequestSchema are already datetimes)
+        if not pd.api.types.is_datetime64_any_dtype( df_to_clean['date'] ):
+            df_to_clean['date'] = pd.to_datetime( df_to_clean['date'], format = '%Y-%m-%d' )
+
+        # downcast every column (compact mode), after dropping the columns
+        # that are not read (their strings would be kept until the response)
+        if self.compact:
+            df_to_clean.drop( columns = [ column for column in df_to_clean.columns if column not in PIPELINE_COLUMNS ], inplace = True )
+            df_to_clean = compact_columns( df_to_clean )
 
         # transform given column with fitted inputter
-        df_to_clean[ 'competition_distance' ] = self.competition_distance_inputter.transform( df_to_clean[ 'competition_distance' ].values.reshape(-1, 1) )
+        # (on compiled mode, it is done with the other features on data preparation)
+        if self.mode == 'sklearn':
+            df_to_clean[ 'competition_distance' ] = self.competition_distance_inputter.transform( df_to_clean[ 'competition_distance' ].values.astype( 'float64' ).reshape(-1, 1) )
 
         # Data Cleaning is done -> df_dc_done
         df_dc_done = df_to_clean
@@ -77,21 +405,37 @@ class Rossmann:
         # df_to_fe['promo2_since_year'] = df_to_fe['promo2_since_year'].astype( int )
 
 
+        # get date features (computed once for each distinct date)
+        # (int16 and float32 on compact mode)
+        date_features = DATE_FEATURE_CACHE.lookup( df_to_fe['date'],
+                                                   int_dtype = 'int16' if self.compact else 'int64',
+                                                   cast = self.compact_feature if self.compact else None )
+
         # create a column for day of month
-        df_to_fe['day_of_month'] = df_to_fe['date'].dt.day
+        df_to_fe['day_of_month'] = date_features['day_of_month']
 
         # create day of year
-        df_to_fe['day_of_year'] = df_to_fe['date'].dt.strftime('%j')
-        df_to_fe['day_of_year'] = df_to_fe['day_of_year'].astype( 'int' )
+        df_to_fe['day_of_year'] = date_features['day_of_year']
 
         # create a column for month
-        df_to_fe['month'] = df_to_fe['date'].dt.month
+        df_to_fe['month'] = date_features['month']
+
+        # sin and cos transformations of date features (used on data preparation)
+        for column in ['day_of_month', 'day_of_year', 'month']:
+            df_to_fe[ f'{column}_sin' ] = date_features[ f'{column}_sin' ]
+            df_to_fe[ f'{column}_cos' ] = date_features[ f'{column}_cos' ]
 
         # create a column for year
         # df_to_fe['year'] = df_to_fe['date'].dt.year
 
         # make day_of_week start from 0 -> (sunday = 0)
-        df_to_fe['day_of_week'] = df_to_fe['day_of_week'].apply( lambda x: 0 if x == 7 else x )
+        if 'day_of_week' in df_to_fe.columns:
+            day_of_week = df_to_fe['day_of_week'].values
+            df_to_fe['day_of_week'] = np.where( day_of_week == 7, 0, day_of_week ).astype( day_of_week.dtype, copy = False )
+
+        # day_of_week not sent -> get it from date
+        else:
+            df_to_fe['day_of_week'] = date_features['day_of_week']
 
         # create a column for week number 
         # sunday = 0 to match day_of_week column
@@ -136,183 +480,226 @@ class Rossmann:
         return df_df_done
         
         
-    def data_preparation( self, df_to_dp ):
-        """df_to_dp is the data(frame) be (data) prepared"""
+    def row_identity( self, df_cleaned ):
+        """
+        Columns that identify each request row, kept before rows are filtered.
+
+        Args:
+            df_cleaned: cleaned data(frame) (see data_cleaning)
+
+        Return:
+            df_identity: dataframe with id (if sent), date, store and open columns
+        """
+
+        columns = [ column for column in IDENTITY_COLUMNS + [ 'store', 'open' ] if column in df_cleaned.columns ]
+
+
+        return df_cleaned[ columns ].copy()
+
+
+    def compact_feature( self, column, values ):
+        """
+        Round a prepared (float64) feature to float32, keeping the branch
+        it takes on every split of the model (see compact mode).
+
+        Args:
+            column: feature name
+            values: feature values
+
+        Return:
+            single: float32 array
+        """
+
+        return to_float32( np.asarray( values ), self.thresholds.get( column ) )
+
+
+    def transform_features( self, df_to_transform ):
+        """
+        Fill missing values and rescale features on TRANSFORM_STEPS
+
+        Args:
+            df_to_transform: data(frame) with TRANSFORM_STEPS features
+
+        Return:
+            transformed: dictionary with feature -> transformed array
+        """
+
+        # compiled mode -> a single fused transformation for every feature
+        if self.mode == 'compiled':
+            matrix = self.plan.transform( df_to_transform )
+            transformed = {column: matrix[ row ] for column, row in self.plan.rows.items()}
+
+        # sklearn mode -> one transform call for each inputter and scaler
+        else:
+            transformed = {}
+            for column, inputter_name, scaler_name in TRANSFORM_STEPS:
+                # (float64 values, as sklearn keeps float32 ones on float32, see compact mode)
+                values = df_to_transform[ column ].values.astype( 'float64' ).reshape(-1, 1)
+                if inputter_name:
+                    values = getattr( self, inputter_name ).transform( values )
+                if scaler_name:
+                    values = getattr( self, scaler_name ).transform( values )
+                transformed[ column ] = np.asarray( values, dtype = 'float64' ).ravel()
+
+
+        return transformed
+
+
+    def prepare_store_features( self, df_to_dp ):
+        """
+        Prepare store level features (the ones that only depend on store.csv)
+
+        Args:
+            df_to_dp: data(frame) with store.csv columns (snake case)
+
+        Return:
+            prepared: dictionary with feature -> array, for STORE_FEATURES
+        """
+
+        # dictionary to store prepared columns
+        prepared = {}
+
+
+        ####################
+        # MISSING VALUE INPUTATION and RESCALING
+        transformed = self.transform_features( df_to_dp )
+
+        # rescaled features
+        for column in ['store', 'competition_open_since_month', 'promo2_since_week', 'promo2_since_year']:
+            prepared[ column ] = transformed[ column ]
+
+
+        ####################
+        # ENCODING
+        # categorical columns (see RequestSchema and compact mode) are encoded by their codes
+        # map store_type (a map keeps NaN for unknown store types)
+        store_type = df_to_dp['store_type']
+        if isinstance( store_type.dtype, pd.CategoricalDtype ):
+            prepared['store_type'] = encode_categories( store_type, ENCODING_DICT['store_type'] )
+        else:
+            prepared['store_type'] = store_type.map( ENCODING_DICT['store_type'] ).values
 
         # map assortment column according to database information
         # Assortment -> a = basic, b = extra, c = extended
-        df_to_dp['assortment'] = df_to_dp['assortment'].apply(lambda x: 'basic' if x == 'a' else
-                                                                    'extra' if x == 'b' else
-                                                                    'extended'
-                                                             )       
-                
+        assortment = df_to_dp['assortment']
+        if isinstance( assortment.dtype, pd.CategoricalDtype ):
+            prepared['assortment'] = encode_categories( assortment, {'a': ENCODING_DICT['assortment']['basic'], 'b': ENCODING_DICT['assortment']['extra']},
+                                                        default = ENCODING_DICT['assortment']['extended'] )
+        else:
+            assortment = assortment.values
+            prepared['assortment'] = np.where( assortment == 'a', ENCODING_DICT['assortment']['basic'],
+                                               np.where( assortment == 'b', ENCODING_DICT['assortment']['extra'],
+                                                                            ENCODING_DICT['assortment']['extended'] ) )
+
+
+        ####################
+        # DISCRETIZATION
+        for column in ['competition_distance', 'competition_open_since_year']:
+            prepared[ column ] = discretize( transformed[ column ], DICT_BINS[ column ] )
+
+        # float32 features on compact mode (e.g. on StoreFeatureIndex)
+        if self.compact:
+            prepared = {column: self.compact_feature( column, values ) for column, values in prepared.items()}
+
+
+        return prepared
+
+
+    def prepare_date_features( self, df_to_dp ):
+        """
+        Prepare date level features (cyclic features created on feature engineering)
+
+        Args:
+            df_to_dp: engineered data(frame)
+
+        Return:
+            prepared: dictionary with feature -> array, for DATE_FEATURES
+        """
+
+        # dictionary to store prepared columns
+        prepared = {}
+
+
+        ####################
+        # NATURE TRANSFORMATION
+        for column, transformation in [ ('day_of_month', 'sin'), 
+                                        ('day_of_month', 'cos'), 
+                                        ('day_of_year', 'sin'), 
+                                        ('day_of_year', 'cos'), 
+                                        # ('month', 'sin'),
+                                        ('month', 'cos'), 
+                                        ('day_of_week', 'sin'), 
+                                        ('day_of_week', 'cos') ]:
+            # already computed on feature engineering (see DateFeatureCache)
+            if f'{column}_{transformation}' in df_to_dp.columns:
+                prepared[ f'{column}_{transformation}' ] = df_to_dp[ f'{column}_{transformation}' ].values
+
+            # apply sin or cos transformation on feature
+            else:
+                prepared[ f'{column}_{transformation}' ] = cyclic_transform( df_to_dp[ column ].values, column, transformation )
+
+
+        return prepared
+
+
+    def data_preparation( self, df_to_dp, store_index = None ):
+        """df_to_dp is the data(frame) be (data) prepared
+        store_index is an optional StoreFeatureIndex with already prepared store features"""
+
+        # NOTE: every feature is computed for the whole column at once
+        # (no apply) and written to its own array. The input dataframe
+        # is not modified. Output is the same as the former column by 
+        # column implementation (see DICT_BINS and CYCLIC_TABLES).
+
         # columns not available in production environment
         # 'customers' not in production data -> no need to be removed
-        cols_to_remove = ['state_holiday', 'school_holiday', 'promo']
-        # drop columns to be removed
-        df_to_dp.drop( columns = cols_to_remove, axis = 'columns', inplace = True )
-   
-
-        # iterate over columns
-        for column in df_to_dp:
-
-            ####################
-            dict_inputter = {'competition_open_since_month': self.competition_open_since_month_inputter,
-                            'competition_open_since_year': self.competition_open_since_year_inputter,
-                            'promo2_since_week': self.promo2_since_week_inputter,
-                            'promo2_since_year': self.promo2_since_year_inputter,
-                            # 'promo_interval': self.promo_interval_inputter
-                            }            
-            
-            # check if MISSING VALUE INPUTATION is required                      
-            if column in dict_inputter.keys():
-                # load inputter
-                inputter = dict_inputter[ column ]
-                # transform given column with inputter
-                df_to_dp[ column ] = inputter.transform( df_to_dp[ column ].values.reshape(-1, 1) )
-
-
-            ####################    
-            # no NORMALIZATION yet
-
-
-            ####################
-            dict_scaler = {'store': self.store_scaler, 
-                           'competition_open_since_month': self.competition_open_since_month_scaler,
-                           'promo2_since_week': self.promo2_since_week_scaler, 
-                           'promo2_since_year': self.promo2_since_year_scaler, 
-                        #    'year': self.year_scaler
-                          }           
-
-            # check if RESCALING is required
-            if column in dict_scaler.keys():
-
-                # load scaler 
-                scaler = dict_scaler[ column ]
-                # transform col_outlier
-                df_to_dp[ column ] = scaler.transform( df_to_dp[ column ].values.reshape(-1,1) )
-
-
-            ####################
-            # check if DISCRETIZATION is required
-            if column in ['competition_open_since_year',
-                          'competition_distance'
-                         ]:
-
-                # dictionary with feateres and their bins
-                dict_bins = {'competition_open_since_year': [1989, 1990, 1995, 2000, 2005, 2008, 2010, 2012, 2014, 2016],
-                             'competition_distance': [0, 50, 100, 500, 1000, 5000, 15000, 100000]
-                            }
-
-                # discretize column
-                df_to_dp[ column ] = pd.cut( df_to_dp[ column ], bins = dict_bins[ column ] )
-                # convert categoric dtype to integer
-                df_to_dp[ column ] = pd.Categorical( df_to_dp[ column ] ).codes
-                # make category labels range from 0 to 2
-                df_to_dp[ column ] = df_to_dp[ column ] / ( ( len( dict_bins[ column ] ) - 2 ) / 2 )
-
-
-
-             ####################       
-            # check if ENCODING is required
-            if column in ['store_type', 
-                          'assortment', 
-                        #   'promo_interval'
-                         ]:
-
-                # auxiliary list to encode
-                aux_dict = {'store_type': {'a': 0, 'd': 1, 'c': 2, 'b': 3},
-                            'assortment': {'basic': 0, 'extended': 1, 'extra': 2},
-                            # 'promo_interval': {'Mar,Jun,Sept,Dec': 0,
-                            #                     'Feb,May,Aug,Nov': 1,
-                            #                     'Jan,Apr,Jul,Oct': 2 }
-                           }
-
-                # map feature
-                df_to_dp[ column ] = df_to_dp[ column ].map( aux_dict[ column ] )
-
-
-            ####################
-            # check if NATURE TRANSFORMATION is required
-            if column in [#'season',
-                          'day_of_month',
-                          'day_of_year',
-                          'month',
-                        #   'week_number',
-                          'day_of_week'
-                         ]:
-
-                # # check season especific engineering
-                # if column == 'season':
-                #     # create season dictionary for mapping
-                #     season_map = {
-                #         'winter': 0, 
-                #         'spring': 1, 
-                #         'autumn': 2, 
-                #         'summer': 3
-                #     }
-
-                #     # map season feature
-                #     df_to_dp['season'] = df_to_dp['season'].map( season_map )
-
-                # dict with feature and its cycle
-                cyclic_dict = {
-                    # 'season': 4,
-                    'day_of_month': 30,
-                    'day_of_year': 365,
-                    'month': 12,
-                    'week_number': 52,
-                    'day_of_week': 7
-                }
+        # cols_to_remove = ['state_holiday', 'school_holiday', 'promo']
+        # -> as only cols_selected are computed, they are not used
+
+        # dictionary to store prepared columns
+        prepared = {}
+
+        # store level features -> look them up on store index or compute them
+        if store_index is None:
+            prepared.update( self.prepare_store_features( df_to_dp ) )
+        else:
+            prepared.update( store_index.gather( df_to_dp ) )
+
+        # date level features
+        prepared.update( self.prepare_date_features( df_to_dp ) )
 
-                # apply sin and cos transformation on features    
-                df_to_dp[ f'{column}_sin' ] = df_to_dp[ column ].apply( lambda x: np.sin( x * ( 2. * np.pi/ cyclic_dict[ column ] ) ) )
-                df_to_dp[ f'{column}_cos' ] = df_to_dp[ column ].apply( lambda x: np.cos( x * ( 2. * np.pi/ cyclic_dict[ column ] ) ) )
-                # remove cyclic column from dataframe
-                df_to_dp.drop( columns = [ column ], axis = 'columns', inplace = True )
-
-
-        cols_selected = [
-            'store',
-            'store_type',
-            'assortment',
-            'competition_distance',
-            'competition_open_since_month',
-            'competition_open_since_year',
-            'promo2_since_week',
-            'promo2_since_year',
-            'day_of_month_sin',
-            'day_of_month_cos',
-            'day_of_year_sin',
-            'day_of_year_cos',
-            'month_cos',
-            'day_of_week_sin',
-            'day_of_week_cos'
-        ]
-
-        # select columns
-        df_to_dp = df_to_dp[ cols_selected ]
+
+        # float32 features on compact mode (no-op for already rounded ones)
+        if self.compact:
+            prepared = {column: self.compact_feature( column, values ) for column, values in prepared.items()}
+
+        # select columns and build dataframe once (keep index of filtered data)
+        df_dp_done = pd.DataFrame( {column: prepared[ column ] for column in COLS_SELECTED}, 
+                                   index = df_to_dp.index )
         
         # Data Preparation (and feature selection) is is done -> df_dp_done
-        df_dp_done = df_to_dp
 
 
         return df_dp_done
 
 
-    def get_prediction( self, ml_model, original_data, prepared_data):
+    def make_prediction( self, ml_model, prepared_data ):
         """
         Args:
             ml_model: model trained
-            original_data: original data sent on request
             prepared_data: transformed data, ready for prediction
-        
-        Return:        
-            pred: sales prediction in the next 6 weeks
+
+        Return:
+            prepared_data: prepared data with predicted_sales column 
+                           and store number on its original scale
         """
 
+        # number of threads is a predict argument (it is not taken from model n_jobs)
+        predict_params = {'num_threads': self.num_threads} if self.num_threads else {}
+
         # make ML model predict sales on prepared data
-        prediction = ml_model.predict( prepared_data )
+        # (no rows -> e.g. every store was closed)
+        prediction = ml_model.predict( prepared_data, **predict_params ) if prepared_data.shape[0] > 0 else np.empty( 0 )
 
         # convert prediction to normal scale (instead of log scale)
         # and join prediction as a column onto original dataframe
@@ -320,15 +707,136 @@ class Rossmann:
 
         # note that store number is scaled once data was prepared
         # to get original store number -> reverse scaling
-        prepared_data[ 'store' ] = self.store_scaler.inverse_transform( prepared_data[ 'store' ].values.reshape(-1,1) )
+        if self.mode == 'compiled':
+            prepared_data[ 'store' ] = self.plan.inverse_transform( 'store', prepared_data[ 'store' ].values )
+        else:
+            prepared_data[ 'store' ] = self.store_scaler.inverse_transform( prepared_data[ 'store' ].values.reshape(-1,1) )
+
+
+        return prepared_data
+
+
+    def restore_rows( self, df_predicted, df_identity ):
+        """
+        Put filtered rows back, so there is a prediction for every request row.
+
+        Args:
+            df_predicted: predicted rows (see make_prediction)
+            df_identity: identity of every request row (see row_identity)
+
+        Return:
+            df_restored: dataframe on request index with id (if sent) and date
+                         columns, prepared features, store and predicted_sales.
+                         Closed stores get 0 sales, rows with unknown open get NaN.
+        """
+
+        # request rows that were predicted (same test as data_filtering, rows keep their order)
+        kept = df_identity['open'].values == 1
+
+        # identity columns
+        restored = { column: df_identity[ column ].values for column in IDENTITY_COLUMNS if column in df_identity.columns }
+
+        # predicted columns (NaN on filtered rows, float32 columns are kept float32)
+        for column in df_predicted.columns:
+            values = df_predicted[ column ].values
+            if kept.all():
+                restored[ column ] = values
+            else:
+                restored[ column ] = np.full( kept.shape[0], np.nan, dtype = np.result_type( values.dtype, np.float32 ) )
+                restored[ column ][ kept ] = values
+
+        # store number as sent and no sales when store is closed
+        restored['store'] = df_identity['store'].values
+        restored['predicted_sales'] = np.where( df_identity['open'].values == 0, 0.0, restored['predicted_sales'] )
+
+        # build dataframe once
+        df_restored = pd.DataFrame( restored, index = df_identity.index )
+
+
+        return df_restored
+
+
+    def run_pipeline( self, ml_model, df_raw, store_index = None, observe = None, restore = True ):
+        """
+        Run every step, from data cleaning to prediction.
+
+        Args:
+            ml_model: model trained
+            df_raw: data(frame) as sent on request (test.csv + store.csv columns)
+            store_index: optional StoreFeatureIndex with already prepared store features
+            observe: optional function called with ( step name, seconds ) after each step
+                     (e.g. Metrics.observe_stage)
+            restore: False -> return only predicted rows, as make_prediction does
+
+        Return:
+            df_predicted: every request row, with its id and date (see restore_rows)
+        """
+
+        start = time.perf_counter()
+
+        # clean data
+        df_dc_done = self.data_cleaning( df_raw )
+
+        # keep identity of request rows (closed stores are filtered)
+        df_identity = self.row_identity( df_dc_done )
+        start = lap( observe, 'data_cleaning', start )
+
+        # engineer data
+        df_fe_done = self.feature_engineering( df_dc_done )
+        start = lap( observe, 'feature_engineering', start )
+
+        # filter data
+        df_df_done = self.data_filtering( df_fe_done )
+        start = lap( observe, 'data_filtering', start )
+
+        # prepare data
+        df_dp_done = self.data_preparation( df_df_done, store_index = store_index )
+        start = lap( observe, 'data_preparation', start )
+
+        # make prediction
+        df_predicted = self.make_prediction( ml_model, df_dp_done )
+        start = lap( observe, 'make_prediction', start )
+
+        if not restore:
+            return df_predicted
+
+        # put filtered rows back
+        df_predicted = self.restore_rows( df_predicted, df_identity )
+        lap( observe, 'restore_rows', start )
+
+
+        return df_predicted
+
+
+    def get_prediction( self, ml_model, original_data, prepared_data, fields = None ):
+        """
+        Args:
+            ml_model: model trained
+            original_data: original data sent on request (cleaned)
+            prepared_data: transformed data, ready for prediction
+            fields: comma separated response columns (None -> id, store, date, predicted_sales)
+        
+        Return:        
+            pred: sales prediction in the next 6 weeks
+        """
+
+        # response builder imports this module
+        from rossmann.ResponseBuilder import parse_fields, select_fields, records_json
+
+        # make prediction (predicted_sales and store on original scale)
+        prepared_data = self.make_prediction( ml_model, prepared_data )
+
+        # every row sent, with its id and date
+        prepared_data = self.restore_rows( prepared_data, self.row_identity( original_data ) )
 
         # # calculate sales prediction for each store in the last 6 weeks
         # stores_prediction = prepared_data[ ['store', 
         #                                     'predicted_sales'] ].groupby('store').sum().reset_index()
 
-        # convert the result to json (API transferring format)
+        # convert the asked columns to json (API transferring format)
         # df_prediction = stores_prediction.to_json( orient='records', date_format='iso' )
-        df_prediction = prepared_data.to_json( orient='records', date_format='iso' )
+        df_response = select_fields( prepared_data, parse_fields( fields, has_id = 'id' in prepared_data.columns ) )
+        df_prediction = records_json( df_response ).decode()
 
 
-        return df_prediction
\ No newline at end of file
+        return df_prediction
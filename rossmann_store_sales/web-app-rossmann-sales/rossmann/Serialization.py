@@ -0,0 +1,149 @@
+############## LIBRARIES ##############
+
+
+import pandas                   as pd
+from   rossmann.ResponseBuilder import records_json
+from   rossmann.RequestSchema   import parse_body, parse_frame, SchemaError, REQUIRED_COLUMNS
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: pyarrow is only imported when an Arrow or Parquet
+# body is read or written, so JSON requests don't depend on it.
+
+
+# supported media types
+JSON_TYPE = 'application/json'
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_TYPE = 'application/vnd.apache.parquet'
+
+# media types aliases
+MEDIA_TYPES = {JSON_TYPE: JSON_TYPE,
+               ARROW_TYPE: ARROW_TYPE,
+               PARQUET_TYPE: PARQUET_TYPE,
+               'application/x-parquet': PARQUET_TYPE,
+               'application/parquet': PARQUET_TYPE
+              }
+
+
+class UnsupportedMediaType( ValueError ):
+    """media type is not supported (or its library is not installed)"""
+
+
+def media_type( content_type ):
+    """
+    Get supported media type from a Content-Type or Accept value.
+
+    Args:
+        content_type: media type, possibly with parameters (e.g. charset)
+
+    Return:
+        media_type: one of JSON_TYPE, ARROW_TYPE or PARQUET_TYPE
+    """
+
+    # remove parameters
+    content_type = ( content_type or JSON_TYPE ).split( ';' )[0].strip().lower()
+
+    # check if media type is supported
+    if content_type not in MEDIA_TYPES:
+        raise UnsupportedMediaType( f'unsupported media type: {content_type}' )
+
+
+    return MEDIA_TYPES[ content_type ]
+
+
+def import_pyarrow():
+    """import pyarrow (and parquet module) only when it is required"""
+
+    try:
+        import pyarrow         as pa
+        import pyarrow.parquet as pq
+
+    except ImportError:
+        raise UnsupportedMediaType( 'pyarrow is required for Arrow and Parquet bodies' )
+
+
+    return pa, pq
+
+
+def read_table( body, content_type, required = REQUIRED_COLUMNS ):
+    """
+    Read request body as a dataframe.
+
+    Args:
+        body: request body (bytes)
+        content_type: request Content-Type
+        required: columns every request must have (see RequestSchema)
+
+    Return:
+        df: dataframe with one row for each record (typed columns, see RequestSchema)
+
+    Raises:
+        SchemaError: if body can't be read or doesn't match the schema
+    """
+
+    # get body format
+    body_type = media_type( content_type )
+
+    # json records (or a single record), parsed on typed columns
+    if body_type == JSON_TYPE:
+        df = parse_body( body, required = required )
+
+        return df if df is not None else pd.DataFrame()
+
+    # no data
+    if not body:
+        return pd.DataFrame()
+
+    # arrow and parquet tables
+    pa, pq = import_pyarrow()
+    try:
+        if body_type == ARROW_TYPE:
+            reader = pa.ipc.open_stream( pa.py_buffer( body ) )
+            table = reader.read_all()
+        else:
+            table = pq.read_table( pa.BufferReader( pa.py_buffer( body ) ) )
+    except ( pa.ArrowException, OSError ) as error:
+        raise SchemaError( f'body is not a valid {body_type} table ({error})' )
+
+    # no rows
+    if table.num_rows == 0:
+        return pd.DataFrame()
+
+
+    # dates as datetime64 (instead of python objects), validated as JSON records are
+    return parse_frame( table.to_pandas( date_as_object = False ), required = required )
+
+
+def write_table( df, accept ):
+    """
+    Write dataframe as response body.
+
+    Args:
+        df: dataframe to be written
+        accept: response media type
+
+    Return:
+        body, mimetype: response body (bytes) and its media type
+    """
+
+    # get body format
+    body_type = media_type( accept )
+
+    # json records
+    if body_type == JSON_TYPE:
+        return records_json( df ), JSON_TYPE
+
+    # arrow and parquet tables
+    pa, pq = import_pyarrow()
+    table = pa.Table.from_pandas( df, preserve_index = False )
+    sink = pa.BufferOutputStream()
+    if body_type == ARROW_TYPE:
+        with pa.ipc.new_stream( sink, table.schema ) as writer:
+            writer.write_table( table )
+    else:
+        pq.write_table( table, sink )
+
+
+    return sink.getvalue().to_pybytes(), body_type
@@ -0,0 +1,138 @@
+############## LIBRARIES ##############
+
+
+import logging
+import os
+import sys
+import threading
+import time
+from   collections            import Counter
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+logger = logging.getLogger( __name__ )
+
+
+def collapsed_stack( frame ):
+    """stack of a frame as 'file:function;...' (outermost call first)"""
+
+    names = []
+    while frame is not None:
+        names.append( f'{os.path.basename( frame.f_code.co_filename )}:{frame.f_code.co_name}' )
+        frame = frame.f_back
+
+
+    return ';'.join( reversed( names ) )
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler of requests: while a request runs, a background
+    thread samples the stack of the thread answering it every interval_ms.
+    Samples of requests slower than threshold_ms are written as collapsed
+    stacks ('stack count' lines, for flamegraph.pl or speedscope).
+
+    Args:
+        threshold_ms: requests slower than this are written
+        interval_ms: milliseconds between samples
+        output_path: folder for profiles (one .folded file per slow request)
+    """
+
+    def __init__( self, threshold_ms, interval_ms = 5.0, output_path = './profiles' ):
+
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.output_path = output_path
+        os.makedirs( output_path, exist_ok = True )
+
+        # requests being sampled: thread id -> stack counter
+        self._active = {}
+        self._lock = threading.Lock()
+
+        # sampler thread is started by the first request of each process
+        # (threads are not inherited by forked server workers)
+        self._thread_pid = None
+
+        # metrics
+        self.profiles = 0
+
+
+    def _ensure_thread( self ):
+        """start sampler thread (once per process)"""
+
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._active = {}
+                threading.Thread( target = self._loop, name = 'slow-request-profiler', daemon = True ).start()
+                self._thread_pid = os.getpid()
+
+
+    def _loop( self ):
+        """sample stacks of threads answering requests"""
+
+        while True:
+            time.sleep( self.interval )
+
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get( thread_id )
+                    if frame is not None:
+                        samples[ collapsed_stack( frame ) ] += 1
+
+
+    def start( self ):
+        """
+        Start sampling the current thread.
+
+        Return:
+            token: to be given to stop
+        """
+
+        self._ensure_thread()
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[ thread_id ] = Counter()
+
+
+        return thread_id, time.perf_counter()
+
+
+    def stop( self, token, label ):
+        """
+        Stop sampling and write samples if the request was slow.
+
+        Args:
+            token: returned by start
+            label: request description, used on file name (e.g. endpoint)
+
+        Return:
+            path: profile written (None if request was not slow)
+        """
+
+        thread_id, start = token
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            samples = self._active.pop( thread_id, None )
+
+        # fast request (or no sample)
+        if ( seconds < self.threshold ) or not samples:
+            return None
+
+        # write collapsed stacks
+        name = ''.join( character if character.isalnum() else '_' for character in label ).strip( '_' )
+        path = os.path.join( self.output_path, f'{time.strftime( "%Y%m%dT%H%M%S" )}-{os.getpid()}-{name}-{seconds * 1000:.0f}ms.folded' )
+        with open( path, 'w' ) as file:
+            file.writelines( f'{stack} {count}\n' for stack, count in samples.most_common() )
+        self.profiles += 1
+
+        logger.warning( 'Slow request %s (%.0f ms) profiled to %s', label, seconds * 1000, path )
+
+
+        return path
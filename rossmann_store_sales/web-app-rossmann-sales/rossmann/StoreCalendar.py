@@ -0,0 +1,118 @@
+############## LIBRARIES ##############
+
+
+import os
+import threading
+import numpy  as np
+import pandas as pd
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+class StoreCalendar:
+    """
+    Server-side copy of test.csv (calendar of each store) merged with
+    store.csv, so that prediction rows of a store can be built from its
+    id and a date range, instead of being sent on the request.
+
+    Rows are sorted by store and date, so the rows of a store are a
+    contiguous slice found with a binary search.
+
+    Args:
+        data_path: folder with test.csv and store.csv
+    """
+
+    def __init__( self, data_path = '../data' ):
+
+        self.test_path = os.path.join( data_path, 'test.csv' )
+        self.store_path = os.path.join( data_path, 'store.csv' )
+
+        # (rows, store of each row, date of each row) -> published together on load
+        self._tables = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+        # load data
+        self.load()
+
+
+    def _file_signature( self ):
+        """modification time and size of csv files"""
+
+        return tuple( ( os.stat( path ).st_mtime_ns, os.stat( path ).st_size )
+                      for path in [ self.test_path, self.store_path ] )
+
+
+    def load( self ):
+        """(Re)load csv files"""
+
+        with self._lock:
+            # get file signature before loading
+            signature = self._file_signature()
+
+            # merge test dataset + store suplementary info
+            df_calendar = pd.merge( pd.read_csv( self.test_path, low_memory = False ),
+                                    pd.read_csv( self.store_path, low_memory = False ),
+                                    how = 'left', on = 'Store' )
+
+            # sort by store and date
+            dates = pd.to_datetime( df_calendar['Date'], format = '%Y-%m-%d' )
+            order = np.lexsort( ( dates.values, df_calendar['Store'].values ) )
+            df_calendar = df_calendar.iloc[ order ].reset_index( drop = True )
+
+            # publish (a single attribute assignment is atomic)
+            self._tables = ( df_calendar, df_calendar['Store'].values, dates.values[ order ] )
+            self._signature = signature
+
+
+        return self
+
+
+    def is_stale( self ):
+        """True if csv files changed on disk since they were loaded"""
+
+        return self._file_signature() != self._signature
+
+
+    def __contains__( self, store_id ):
+        """True if store_id is on calendar"""
+
+        store_ids = self._tables[1]
+        position = np.searchsorted( store_ids, store_id, side = 'left' )
+
+
+        return position < store_ids.size and store_ids[ position ] == store_id
+
+
+    def rows( self, store_id, start = None, end = None, horizon = None ):
+        """
+        Calendar rows of a store, as they would be sent on a prediction request.
+
+        Args:
+            store_id: store number
+            start: first date (None -> first date on calendar)
+            end: last date (None -> last date on calendar)
+            horizon: number of days from the first row, used if end is not given
+
+        Return:
+            df_rows: test.csv + store.csv rows of the store, sorted by date
+        """
+
+        df_calendar, store_ids, dates = self._tables
+
+        # rows of the store
+        first = np.searchsorted( store_ids, store_id, side = 'left' )
+        last = np.searchsorted( store_ids, store_id, side = 'right' )
+
+        # rows on date range
+        if start is not None:
+            first = first + np.searchsorted( dates[ first:last ], np.datetime64( start, 'ns' ), side = 'left' )
+        if ( end is None ) and ( horizon is not None ) and ( first < last ):
+            end = dates[ first ] + np.timedelta64( horizon - 1, 'D' )
+        if end is not None:
+            last = first + np.searchsorted( dates[ first:last ], np.datetime64( end, 'ns' ), side = 'right' )
+
+
+        # copy -> pipeline changes the data it receives
+        return df_calendar.iloc[ first:last ].copy()
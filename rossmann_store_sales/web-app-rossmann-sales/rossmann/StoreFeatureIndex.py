@@ -0,0 +1,175 @@
+############## LIBRARIES ##############
+
+
+import hashlib
+import os
+import threading
+import time
+import numpy                  as np
+import pandas                 as pd
+from   rossmann.Rossmann      import STORE_FEATURES, snake_case
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+class StoreFeatureIndex:
+    """
+    Store level features (STORE_FEATURES) already prepared for every
+    store on store.csv. Each feature is a dense array indexed by store id,
+    so preparing store features for a request is a single gather.
+
+    Index is built once and only rebuilt when rebuild() is called
+    (e.g. when store.csv changed on disk -> is_stale()).
+
+    Args:
+        pipeline: Rossmann instance used to prepare store features
+        store_path: path to store.csv
+        version: optional tag of the artifacts used by pipeline
+    """
+
+    def __init__( self, pipeline, store_path = '../data/store.csv', version = None ):
+
+        self.pipeline = pipeline
+        self.store_path = store_path
+
+        # (features, known stores) -> published together on rebuild
+        self._tables = None
+        # lock so that only one thread rebuilds the index at a time
+        self._lock = threading.Lock()
+
+        # bookkeeping
+        self.version = None
+        self.build_time = None
+        self.digest = None
+        self._signature = None
+
+        # build index
+        self.rebuild( version = version )
+
+
+    def _file_signature( self ):
+        """modification time and size of store.csv"""
+
+        stat = os.stat( self.store_path )
+
+
+        return ( stat.st_mtime_ns, stat.st_size )
+
+
+    def rebuild( self, pipeline = None, version = None ):
+        """
+        (Re)build the index from store.csv.
+
+        Args:
+            pipeline: new Rossmann instance (e.g. after artifacts were reloaded).
+                      If None, the current one is used
+            version: optional tag of the artifacts used by pipeline
+        """
+
+        with self._lock:
+            start = time.perf_counter()
+
+            # update pipeline
+            if pipeline is not None:
+                self.pipeline = pipeline
+
+            # load store data (and hash of its content -> see PredictionCache.cache_digest)
+            signature = self._file_signature()
+            with open( self.store_path, 'rb' ) as file:
+                digest = hashlib.sha256( file.read() ).hexdigest()[ :16 ]
+            df_store = pd.read_csv( self.store_path, low_memory = False )
+            df_store.columns = snake_case( df_store.columns )
+
+            # check store ids
+            store_ids = df_store['store'].values
+            if ( store_ids.dtype.kind not in 'iu' ) or ( store_ids.min() < 0 ):
+                raise ValueError( f'{self.store_path}: store ids must be non-negative integers' )
+            if np.unique( store_ids ).size != store_ids.size:
+                raise ValueError( f'{self.store_path}: duplicated store ids' )
+
+            # prepare store features for every store at once
+            prepared = self.pipeline.prepare_store_features( df_store )
+
+            # dense arrays indexed by store id
+            size = store_ids.max() + 1
+            features = {}
+            for column in STORE_FEATURES:
+                features[ column ] = np.zeros( size, dtype = prepared[ column ].dtype )
+                features[ column ][ store_ids ] = prepared[ column ]
+
+            # stores on store.csv
+            known = np.zeros( size, dtype = bool )
+            known[ store_ids ] = True
+
+            # publish new index (a single attribute assignment is atomic)
+            self._tables = ( features, known )
+
+            # update bookkeeping
+            self.version = version
+            self.digest = digest
+            self._signature = signature
+            self.build_time = time.perf_counter() - start
+
+
+        return self
+
+
+    def is_stale( self ):
+        """True if store.csv changed on disk since index was built"""
+
+        return self._file_signature() != self._signature
+
+
+    def __contains__( self, store_id ):
+        """True if store_id is on index"""
+
+        known = self._tables[1]
+
+
+        return 0 <= store_id < known.size and bool( known[ store_id ] )
+
+
+    def gather( self, df_to_dp ):
+        """
+        Get prepared store features for each row.
+
+        Args:
+            df_to_dp: data(frame) with store column. Rows of stores that
+                      are not on index are prepared from their own columns
+
+        Return:
+            prepared: dictionary with feature -> array, for STORE_FEATURES
+        """
+
+        # get current index
+        features, known = self._tables
+
+        # store of each row
+        store_ids = df_to_dp['store'].values
+
+        # non integer store ids -> prepare every row from its own columns
+        if store_ids.dtype.kind not in 'iu':
+            return self.pipeline.prepare_store_features( df_to_dp )
+
+        # rows whose store is on index
+        on_index = np.zeros( store_ids.size, dtype = bool )
+        in_range = ( store_ids >= 0 ) & ( store_ids < known.size )
+        on_index[ in_range ] = known[ store_ids[ in_range ] ]
+
+        # every store on index -> just gather
+        if on_index.all():
+            prepared = {column: features[ column ][ store_ids ] for column in STORE_FEATURES}
+
+        # some stores are not on index -> gather known ones and prepare the others
+        else:
+            missing = self.pipeline.prepare_store_features( df_to_dp[ ~on_index ] )
+            prepared = {}
+            for column in STORE_FEATURES:
+                values = np.empty( store_ids.size, dtype = np.result_type( features[ column ], missing[ column ] ) )
+                values[ on_index ] = features[ column ][ store_ids[ on_index ] ]
+                values[ ~on_index ] = missing[ column ]
+                prepared[ column ] = values
+
+
+        return prepared
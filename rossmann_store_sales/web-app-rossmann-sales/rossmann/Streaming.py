@@ -0,0 +1,267 @@
+############## LIBRARIES ##############
+
+
+import io
+import json
+import pandas                  as pd
+from   rossmann.Serialization  import import_pyarrow
+from   rossmann.ResponseBuilder import records_json
+from   rossmann.RequestSchema   import parse_records, parse_frame, SchemaError, REQUIRED_COLUMNS
+
+
+############## CLASS AND ITS FUNCTIONS ##############
+
+
+# NOTE: readers yield dataframes of at most chunk_size rows and writers
+# consume them one at a time, so memory depends on chunk_size and not
+# on the size of the request.
+#
+# the first chunk is read before the response starts (see handler), so
+# its errors are answered with 400. Errors of later chunks are found after
+# predictions were sent, so writers end the stream with an error record
+# (NDJSON) or an empty batch with error metadata (Arrow) instead.
+
+
+# supported media types for streaming
+NDJSON_TYPE = 'application/x-ndjson'
+
+
+class StreamError( SchemaError ):
+    """
+    Invalid data on a stream.
+
+    Args:
+        message: what is wrong
+        line: line of the whole stream (1-based, NDJSON) or None
+    """
+
+    def __init__( self, message, line = None ):
+
+        super().__init__( f'line {line}: {message}' if line is not None else message )
+        self.line = line
+
+
+def parse_chunk( records, lines, required ):
+    """typed columns of a chunk of records, errors located on the whole stream"""
+
+    try:
+        return parse_records( records, required = required )
+
+    # row of the chunk -> line of the stream
+    except SchemaError as error:
+        if error.row is not None:
+            raise StreamError( error.message, line = lines[ error.row ] )
+        raise StreamError( f'lines {lines[0]}-{lines[-1]}: {error.message}' )
+
+
+def iter_ndjson_chunks( stream, chunk_size, required = REQUIRED_COLUMNS ):
+    """
+    Read newline delimited JSON records in chunks.
+
+    Args:
+        stream: file-like object with one JSON record per line
+        chunk_size: maximum number of rows of each chunk
+        required: columns every record must have (see RequestSchema)
+
+    Return:
+        generator of dataframes (typed columns, see RequestSchema.parse_records)
+
+    Raises:
+        StreamError: on the first invalid line (when its chunk is read)
+    """
+
+    # records of current chunk and their lines
+    records, lines = [], []
+
+    # read one line at a time
+    for number, line in enumerate( stream, start = 1 ):
+        # skip blank lines
+        if not line.strip():
+            continue
+
+        # store record
+        try:
+            records.append( json.loads( line ) )
+        except ValueError as error:
+            raise StreamError( f'invalid JSON ({error})', line = number )
+        lines.append( number )
+
+        # chunk is full
+        if len( records ) == chunk_size:
+            yield parse_chunk( records, lines, required )
+            records, lines = [], []
+
+    # last chunk
+    if records:
+        yield parse_chunk( records, lines, required )
+
+
+def iter_batches( pa, reader ):
+    """record batches of an Arrow IPC stream reader (truncated or invalid stream -> StreamError)"""
+
+    rows = 0
+    while True:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            return
+        except ( pa.ArrowException, OSError ) as error:
+            raise StreamError( f'invalid Arrow record batch after row {rows} ({error})' )
+
+        rows += batch.num_rows
+        yield batch
+
+
+def validate_chunk( df, offset, required ):
+    """typed columns of a chunk of rows, errors located on the whole stream"""
+
+    try:
+        return parse_frame( df, required = required )
+
+    # row of the chunk -> row of the stream
+    except SchemaError as error:
+        if error.row is not None:
+            raise StreamError( f'row {offset + error.row}: {error.message}' )
+        raise StreamError( f'rows {offset}-{offset + df.shape[0] - 1}: {error.message}' )
+
+
+def iter_arrow_chunks( stream, chunk_size, required = REQUIRED_COLUMNS ):
+    """
+    Read Arrow IPC stream record batches in chunks.
+
+    Args:
+        stream: file-like object with an Arrow IPC stream
+        chunk_size: maximum number of rows of each chunk
+        required: columns every chunk must have (see RequestSchema)
+
+    Return:
+        generator of dataframes (typed columns, see RequestSchema.parse_frame)
+
+    Raises:
+        StreamError: if the stream is invalid (when its batch is read)
+    """
+
+    # import pyarrow
+    pa, _ = import_pyarrow()
+
+    # read one record batch at a time
+    try:
+        reader = pa.ipc.open_stream( stream )
+    except ( pa.ArrowException, OSError ) as error:
+        raise StreamError( f'invalid Arrow stream ({error})' )
+
+    # record batches not yielded yet (and rows already yielded)
+    pending, pending_rows = [], 0
+    offset = 0
+
+    for batch in iter_batches( pa, reader ):
+        # store batch
+        pending.append( batch )
+        pending_rows += batch.num_rows
+
+        # yield full chunks
+        while pending_rows >= chunk_size:
+            table = pa.Table.from_batches( pending, schema = reader.schema )
+            yield validate_chunk( table.slice( 0, chunk_size ).to_pandas( date_as_object = False ), offset, required )
+            offset += chunk_size
+
+            # keep remaining rows
+            rest = table.slice( chunk_size )
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+
+    # last chunk
+    if pending_rows:
+        yield validate_chunk( pa.Table.from_batches( pending, schema = reader.schema ).to_pandas( date_as_object = False ), offset, required )
+
+
+def error_record( error ):
+    """error of a chunk read after the response started"""
+
+    return {'error': str( error ), 'line': getattr( error, 'line', None )}
+
+
+def write_ndjson_chunks( frames ):
+    """
+    Write dataframes as newline delimited JSON records. Invalid data
+    found while frames are read ends the stream with an
+    {"error", "line"} record.
+
+    Args:
+        frames: iterable of dataframes
+
+    Return:
+        generator of bytes
+    """
+
+    try:
+        for df in frames:
+            # skip empty chunks (e.g. only closed stores)
+            if df.empty:
+                continue
+
+            yield records_json( df, lines = True )
+
+    # invalid chunk -> error record (response status was already sent)
+    except SchemaError as error:
+        yield ( json.dumps( error_record( error ) ) + '\n' ).encode()
+
+
+def write_arrow_chunks( frames ):
+    """
+    Write dataframes as an Arrow IPC stream (one record batch per dataframe).
+    The schema is taken from the first batch (integers as int64, floats as
+    float64) and later batches are written with it, so integer columns
+    (e.g. id and store) stay integers and missing values on them are nulls
+    (e.g. store_type of a chunk with an unknown store type).
+    Invalid data found while frames are read ends the stream with an empty
+    batch whose custom metadata has the error.
+
+    Args:
+        frames: iterable of dataframes
+
+    Return:
+        generator of bytes
+    """
+
+    # import pyarrow
+    pa, _ = import_pyarrow()
+
+    # buffer drained after each batch
+    sink = io.BytesIO()
+    writer = None
+
+    try:
+        for df in frames:
+            # skip empty chunks (e.g. only closed stores)
+            if df.empty:
+                continue
+
+            # schema is written with the first batch (integers as int64, floats as float64)
+            if writer is None:
+                widest = {column: 'int64' if dtype.kind in 'iu' else 'float64'
+                          for column, dtype in df.dtypes.items() if dtype.kind in 'iuf'}
+                batch = pa.RecordBatch.from_pandas( df.astype( widest ), preserve_index = False )
+                writer = pa.ipc.new_stream( sink, batch.schema )
+
+            # later batches are converted to the first schema
+            else:
+                batch = pa.RecordBatch.from_pandas( df, schema = batch.schema, preserve_index = False )
+            writer.write_batch( batch )
+
+            # send batch
+            yield sink.getvalue()
+            sink.seek( 0 )
+            sink.truncate()
+
+    # invalid chunk -> empty batch with error metadata (response status was already sent)
+    except SchemaError as error:
+        schema = batch.schema if writer is not None else pa.schema( [] )
+        if writer is None:
+            writer = pa.ipc.new_stream( sink, schema )
+        empty = pa.RecordBatch.from_arrays( [ pa.array( [], type = field.type ) for field in schema ], schema = schema )
+        writer.write_batch( empty, custom_metadata = { key: str( value ) for key, value in error_record( error ).items() if value is not None } )
+
+    # end of stream
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
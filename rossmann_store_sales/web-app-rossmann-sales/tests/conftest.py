@@ -0,0 +1,43 @@
+############## LIBRARIES ##############
+
+
+import os
+import sys
+import pytest
+import pandas                      as pd
+
+
+############## SETUP ##############
+
+
+# web app folder on import path (rossmann package, model and parameters)
+WEB_APP_PATH = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+if WEB_APP_PATH not in sys.path:
+    sys.path.insert( 0, WEB_APP_PATH )
+
+# repository test.csv and store.csv
+DATA_PATH = os.path.join( os.path.dirname( WEB_APP_PATH ), 'data' )
+
+
+@pytest.fixture( scope = 'session' )
+def artifacts():
+    """model, inputters and scalers (pickles)"""
+
+    from rossmann.ArtifactRegistry import ArtifactRegistry
+
+    registry = ArtifactRegistry( model_path = os.path.join( WEB_APP_PATH, 'model', 'model_rossmann_sales.pkl' ),
+                                 parameter_path = os.path.join( WEB_APP_PATH, 'parameter' ) )
+
+
+    return registry.load()
+
+
+@pytest.fixture( scope = 'session' )
+def df_raw():
+    """test.csv + store.csv rows, as sent on requests"""
+
+    df_test = pd.read_csv( os.path.join( DATA_PATH, 'test.csv' ), low_memory = False )
+    df_store = pd.read_csv( os.path.join( DATA_PATH, 'store.csv' ), low_memory = False )
+
+
+    return pd.merge( df_test, df_store, how = 'left', on = 'Store' )
@@ -0,0 +1,30 @@
+############## LIBRARIES ##############
+
+
+import numpy                       as np
+from   rossmann.Rossmann           import Rossmann, COLS_SELECTED
+from   rossmann.InferenceEngine    import split_thresholds
+
+
+############## TESTS ##############
+
+
+def test_compact_predictions_stay_close_to_float64( artifacts, df_raw ):
+
+    # compact (float32, rounded against split thresholds) and float64 pipelines
+    thresholds = split_thresholds( artifacts.model, COLS_SELECTED )
+    compact = Rossmann( artifacts.parameters, plan = artifacts.plan, compact = True, thresholds = thresholds )
+    reference = Rossmann( artifacts.parameters, plan = artifacts.plan )
+
+    predicted = compact.run_pipeline( artifacts.model, df_raw.copy() )['predicted_sales'].values
+    expected = reference.run_pipeline( artifacts.model, df_raw.copy() )['predicted_sales'].values
+
+    # same rows are predicted (closed stores -> 0, unknown open -> NaN)
+    assert ( np.isnan( predicted ) == np.isnan( expected ) ).all()
+    kept = ~np.isnan( expected )
+    error = np.abs( predicted[ kept ] - expected[ kept ] )
+
+    # only values between two split thresholds closer than a float32
+    # step take another branch (see Rossmann compact mode)
+    assert ( error > 0 ).mean() <= 0.05
+    assert ( error / np.maximum( np.abs( expected[ kept ] ), 1.0 ) ).max() <= 0.02
@@ -0,0 +1,44 @@
+############## LIBRARIES ##############
+
+
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Rossmann           import Rossmann
+
+
+############## TESTS ##############
+
+
+# columns filled by the inputters when they are missing
+NULLABLE_COLUMNS = [ 'CompetitionDistance', 'CompetitionOpenSinceMonth', 'CompetitionOpenSinceYear',
+                     'Promo2SinceWeek', 'Promo2SinceYear' ]
+
+
+def prepare( pipeline, df_raw ):
+    """features of every open row (every step up to data preparation)"""
+
+    return pipeline.data_preparation( pipeline.data_filtering( pipeline.feature_engineering( pipeline.data_cleaning( df_raw.copy() ) ) ) )
+
+
+def test_compiled_plan_matches_sklearn_transforms( artifacts, df_raw ):
+
+    # every test.csv row, plus missing values on each nullable column of some rows
+    # (store.csv also has missing values, e.g. promo2 columns of stores without promo2)
+    df_missing = df_raw.copy()
+    for position, column in enumerate( NULLABLE_COLUMNS ):
+        df_missing.loc[ df_missing.index % 7 == position, column ] = np.nan
+    assert df_missing[ NULLABLE_COLUMNS ].isna().any().all()
+
+    compiled = Rossmann( artifacts.parameters, mode = 'compiled' )
+    sklearn = Rossmann( artifacts.parameters, mode = 'sklearn' )
+
+    for df in [ df_raw, df_missing ]:
+        # feature matrices
+        df_compiled = prepare( compiled, df )
+        df_sklearn = prepare( sklearn, df )
+        pd.testing.assert_frame_equal( df_compiled, df_sklearn, check_exact = True )
+
+        # predictions
+        predicted_compiled = compiled.run_pipeline( artifacts.model, df.copy() )
+        predicted_sklearn = sklearn.run_pipeline( artifacts.model, df.copy() )
+        pd.testing.assert_frame_equal( predicted_compiled, predicted_sklearn, check_exact = True )
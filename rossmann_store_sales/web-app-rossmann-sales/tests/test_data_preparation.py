@@ -0,0 +1,28 @@
+############## LIBRARIES ##############
+
+
+import os
+import pandas                      as pd
+from   conftest                    import WEB_APP_PATH
+from   rossmann.Rossmann           import Rossmann
+
+
+############## TESTS ##############
+
+
+# features prepared by the original (apply based) Rossmann.data_preparation,
+# on every 80th row of test.csv + store.csv (written with %.17g -> exact floats)
+REFERENCE_PATH = os.path.join( WEB_APP_PATH, 'tests', 'data', 'prepared_reference.csv' )
+
+
+def test_prepared_features_are_identical_to_reference( artifacts, df_raw ):
+
+    df_reference = pd.read_csv( REFERENCE_PATH, index_col = 'row', float_precision = 'round_trip' ).rename_axis( None )
+
+    # every step up to data preparation, on both transform modes
+    for mode in [ 'compiled', 'sklearn' ]:
+        pipeline = Rossmann( artifacts.parameters, mode = mode )
+        df_sample = df_raw.iloc[ ::80 ].reset_index( drop = True )
+        df_prepared = pipeline.data_preparation( pipeline.data_filtering( pipeline.feature_engineering( pipeline.data_cleaning( df_sample ) ) ) )
+
+        pd.testing.assert_frame_equal( df_prepared, df_reference, check_exact = True )
@@ -0,0 +1,78 @@
+############## LIBRARIES ##############
+
+
+import os
+import json
+import shutil
+import pytest
+import numpy                       as np
+import pandas                      as pd
+from   conftest                    import WEB_APP_PATH, DATA_PATH
+from   rossmann.Rossmann           import Rossmann
+from   rossmann.ArtifactRegistry   import ArtifactRegistry
+from   rossmann.StoreFeatureIndex  import StoreFeatureIndex
+from   rossmann.RequestSchema      import parse_records
+from   rossmann.PredictionCache    import PredictionCache, cached_run_pipeline, cache_digest
+
+
+############## TESTS ##############
+
+
+def test_store_index_rebuild_invalidates_cached_predictions( tmp_path ):
+
+    # artifacts and a store.csv that can be changed
+    artifacts = ArtifactRegistry( model_path = os.path.join( WEB_APP_PATH, 'model', 'model_rossmann_sales.pkl' ),
+                                  parameter_path = os.path.join( WEB_APP_PATH, 'parameter' ) ).load()
+    pipeline = Rossmann( artifacts.parameters, plan = artifacts.plan )
+    store_path = str( tmp_path / 'store.csv' )
+    shutil.copy( os.path.join( DATA_PATH, 'store.csv' ), store_path )
+    store_index = StoreFeatureIndex( pipeline, store_path = store_path )
+
+    # open days of store 1 (store features are taken from the index)
+    df_test = pd.read_csv( os.path.join( DATA_PATH, 'test.csv' ), low_memory = False )
+    df_raw = df_test[ ( df_test['Store'] == 1 ) & ( df_test['Open'] == 1 ) ].reset_index( drop = True )
+
+    cache = PredictionCache( maxsize = 1000, ttl = None )
+    def predict():
+        digest = cache_digest( artifacts.digest, store_index = store_index )
+        return cached_run_pipeline( cache, pipeline, artifacts.model, digest, df_raw.copy(), store_index = store_index )
+
+    before = predict()['predicted_sales'].values
+    assert cache.misses == df_raw.shape[0]
+
+    # store 1 changes type and competition -> index is rebuilt
+    df_store = pd.read_csv( store_path, low_memory = False )
+    df_store.loc[ df_store['Store'] == 1, ['StoreType', 'CompetitionDistance'] ] = [ 'b', 50.0 ]
+    df_store.to_csv( store_path, index = False )
+    store_index.rebuild()
+
+    # cached rows are not reused and predictions match the new store features
+    after = predict()['predicted_sales'].values
+    expected = pipeline.run_pipeline( artifacts.model, df_raw.copy(), store_index = store_index )['predicted_sales'].values
+
+    assert cache.hits == 0
+    assert ( after != before ).any()
+    assert ( after == expected ).all()
+
+
+@pytest.mark.parametrize( 'compact', [ False, True ] )
+def test_cached_rows_keep_run_pipeline_dtypes( artifacts, df_raw, compact ):
+
+    pipeline = Rossmann( artifacts.parameters, plan = artifacts.plan, compact = compact )
+    digest = cache_digest( artifacts.digest, compact = compact )
+
+    # open, closed and unknown open rows (csv and parsed JSON requests)
+    df_sample = df_raw.iloc[ :2000 ].copy()
+    df_sample.loc[ df_sample.index[ ::50 ], 'Open' ] = np.nan
+    df_open = df_sample[ df_sample['Open'] == 1 ]
+    records = json.loads( df_sample.to_json( orient = 'records' ) )
+    requests = [ df_open.iloc[ :500 ], df_open, df_sample.iloc[ :1000 ], df_sample, parse_records( records ) ]
+
+    # first scoring, partial hits and full hits match the uncached pipeline
+    cache = PredictionCache( maxsize = 100000, ttl = None )
+    for df_request in requests + requests:
+        cached = cached_run_pipeline( cache, pipeline, artifacts.model, digest, df_request.copy() )
+        expected = pipeline.run_pipeline( artifacts.model, df_request.copy() )
+        pd.testing.assert_frame_equal( cached, expected )
+
+    assert cache.hits > 0
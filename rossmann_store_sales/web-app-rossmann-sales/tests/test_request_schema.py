@@ -0,0 +1,45 @@
+############## LIBRARIES ##############
+
+
+import json
+import pytest
+from   rossmann.RequestSchema      import parse_records, parse_body, SchemaError
+
+
+############## TESTS ##############
+
+
+ROW = {'Id': 1, 'Store': 1, 'Date': '2015-09-17', 'Open': 1}
+
+
+@pytest.mark.parametrize( 'column, value', [ ( 'Store', 40000 ), ( 'Store', 0 ), ( 'Id', 2 ** 63 + 10 ), ( 'Id', -1 ), ( 'Open', 300 ) ] )
+def test_out_of_range_integers_are_rejected( column, value ):
+
+    # out of range values never wrap around on the integer dtype
+    with pytest.raises( SchemaError, match = f'{column} must be' ):
+        parse_records( { **ROW, column: value } )
+
+
+def test_largest_store_id_is_parsed():
+
+    df_raw = parse_records( { **ROW, 'Store': 32767 } )
+
+    assert df_raw['store'].iloc[0] == 32767
+
+
+@pytest.mark.parametrize( 'value', [ '5', True, [ 5 ], {'value': 5} ] )
+def test_non_numeric_json_values_are_rejected( value ):
+
+    # numeric strings and booleans are not numbers (no silent conversion)
+    with pytest.raises( SchemaError, match = 'Store must be a number' ):
+        parse_records( { **ROW, 'Store': value } )
+
+
+def test_integer_beyond_float64_is_rejected():
+
+    # NaN literal -> body is parsed by json, which keeps integers of any size
+    body = json.dumps( [ ROW, { **ROW, 'Id': 10 ** 400, 'CompetitionDistance': float( 'nan' ) } ] ).encode()
+
+    with pytest.raises( SchemaError, match = 'Id is out of range' ) as error:
+        parse_body( body )
+    assert error.value.row == 1
@@ -0,0 +1,44 @@
+############## LIBRARIES ##############
+
+
+import io
+import pytest
+import pandas                      as pd
+from   rossmann.Serialization      import read_table, PARQUET_TYPE
+from   rossmann.RequestSchema      import SchemaError
+
+
+############## TESTS ##############
+
+
+pa = pytest.importorskip( 'pyarrow' )
+pq = pytest.importorskip( 'pyarrow.parquet' )
+
+DF = pd.DataFrame( {'Id': [ 1, 2 ], 'Store': [ 1, 2 ], 'Date': [ '2015-09-17', '2015-09-16' ], 'Open': [ 1.0, None ]} )
+
+
+def parquet( df ):
+    """parquet body of a dataframe"""
+
+    sink = io.BytesIO()
+    pq.write_table( pa.Table.from_pandas( df, preserve_index = False ), sink )
+
+
+    return sink.getvalue()
+
+
+def test_parquet_body_is_parsed_as_json_records_are():
+
+    df_raw = read_table( parquet( DF ), PARQUET_TYPE )
+
+    assert list( df_raw.columns ) == [ 'id', 'store', 'date', 'open' ]
+    assert df_raw['date'].dtype.kind == 'M' and df_raw['store'].dtype == 'int16'
+
+
+@pytest.mark.parametrize( 'df, message', [ ( DF.drop( columns = 'Open' ), "missing columns \\['Open'\\]" ),
+                                           ( DF.assign( Store = [ 1, 40000 ] ), 'row 1: Store must be <= 32767' ),
+                                           ( DF.assign( Date = [ '2015-09-17', '2015-13-01' ] ), 'row 1: Date must be a YYYY-MM-DD date' ) ] )
+def test_invalid_parquet_body_raises_schema_error( df, message ):
+
+    with pytest.raises( SchemaError, match = message ):
+        read_table( parquet( df ), PARQUET_TYPE )
@@ -0,0 +1,44 @@
+############## LIBRARIES ##############
+
+
+import os
+import pytest
+from   conftest                    import WEB_APP_PATH
+
+
+############## SETUP ##############
+
+
+@pytest.fixture( scope = 'module' )
+def client():
+    """Flask test client of the API (server-side data from the repository data folder)"""
+
+    # handler reads artifacts and data relative to the web app folder (as gunicorn runs it)
+    cwd = os.getcwd()
+    os.chdir( WEB_APP_PATH )
+    try:
+        import handler
+        yield handler.app.test_client()
+    finally:
+        os.chdir( cwd )
+
+
+############## TESTS ##############
+
+
+def test_store_forecast_on_date_range( client ):
+
+    response = client.get( '/rossmann/stores/1/forecast?start=2015-08-01&end=2015-08-07' )
+
+    assert response.status_code == 200
+    assert [ day['date'] for day in response.get_json()['daily'] ] == [ f'2015-08-0{day}' for day in range( 1, 8 ) ]
+
+
+@pytest.mark.parametrize( 'query', [ 'horizon=abc', 'horizon=1.5', 'horizon=-3', 'horizon=0', 'horizon=367', 'horizon=',
+                                     'start=2015-08-07&end=2015-08-01', 'start=2015-13-01' ] )
+def test_invalid_date_range_is_rejected( client, query ):
+
+    response = client.get( f'/rossmann/stores/1/forecast?{query}' )
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
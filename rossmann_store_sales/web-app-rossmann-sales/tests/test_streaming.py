@@ -0,0 +1,57 @@
+############## LIBRARIES ##############
+
+
+import io
+import json
+import pytest
+import numpy                       as np
+import pandas                      as pd
+from   rossmann.Streaming          import iter_ndjson_chunks, write_ndjson_chunks, write_arrow_chunks, StreamError
+
+
+############## TESTS ##############
+
+
+ROW = {'Id': 1, 'Store': 1, 'Date': '2015-09-17', 'Open': 1}
+
+
+def ndjson( lines ):
+    """text stream with one line per item"""
+
+    return io.StringIO( '\n'.join( lines ) + '\n' )
+
+
+def test_errors_are_located_on_the_whole_stream():
+
+    lines = [ json.dumps( ROW ) ] * 5 + [ '' ] + [ json.dumps( {**ROW, 'Store': 40000} ) ]
+    chunks = iter_ndjson_chunks( ndjson( lines ), chunk_size = 2 )
+
+    # first chunks are valid, invalid row is on line 7 (blank line included)
+    assert [ chunk.shape[0] for chunk in [ next( chunks ), next( chunks ) ] ] == [ 2, 2 ]
+    with pytest.raises( StreamError, match = 'line 7: Store must be <= 32767' ):
+        next( chunks )
+
+
+def test_invalid_json_line_ends_stream_with_error_record():
+
+    lines = [ json.dumps( ROW ) ] * 3 + [ '{bad' ]
+    frames = ( pd.DataFrame( {'store': chunk['store']} ) for chunk in iter_ndjson_chunks( ndjson( lines ), chunk_size = 2 ) )
+
+    records = [ json.loads( line ) for line in b''.join( write_ndjson_chunks( frames ) ).decode().splitlines() ]
+
+    assert len( records ) == 3
+    assert records[-1]['line'] == 4 and records[-1]['error'].startswith( 'line 4: invalid JSON' )
+
+
+def test_arrow_stream_keeps_integer_columns():
+
+    pa = pytest.importorskip( 'pyarrow' )
+
+    # second chunk has a missing store type (float column on pandas)
+    frames = [ pd.DataFrame( {'id': [ 1, 2 ], 'store': [ 1, 2 ], 'store_type': [ 0, 1 ], 'predicted_sales': [ 1.5, 2.5 ]} ),
+               pd.DataFrame( {'id': [ 3 ], 'store': [ 3 ], 'store_type': [ np.nan ], 'predicted_sales': [ 3.5 ]} ) ]
+
+    table = pa.ipc.open_stream( b''.join( write_arrow_chunks( frames ) ) ).read_all()
+
+    assert [ str( type ) for type in table.schema.types ] == [ 'int64', 'int64', 'int64', 'double' ]
+    assert table.column( 'store_type' ).to_pylist() == [ 0, 1, None ]